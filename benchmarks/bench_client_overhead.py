@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# coding: utf-8
+#
+"""
+CPU time and memory facebook-wda itself spends per command
+
+wda.fetch is replaced by an in-process fake transport which returns canned
+responses, so only the client code path is measured: request facades, urljoin,
+callbacks, metrics, json decoding, AttrDict and result objects.
+
+Usage:
+    python benchmarks/bench_client_overhead.py [-n 20000] [--only tap,status]
+
+ns/op is the mean of n calls after a warm up. Python has no allocation counter,
+so mem/op is the tracemalloc peak of a single call and blocks/op the tracemalloc
+blocks still alive after n calls divided by n (leaks or caches).
+"""
+
+import argparse
+import base64
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import wda
+from wda.metrics import route_template
+from wda.usbmux import HTTPResponseWrapper
+from wda.usbmux.streaming import Base64ValueReader
+
+DEVICE_URL = "http://fake-device:8100"
+SESSION_ID = "6DB1C8F2-6D5F-4A3B-9C1E-2B6A1F0D3C4E"
+ELEMENT_ID = "5A000000-0000-0000-0C2B-000000000000"
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(64 * 1024)
+
+
+def _body(value) -> bytes:
+    return json.dumps({"value": value, "sessionId": SESSION_ID}).encode()
+
+
+RESPONSES = {
+    ("GET", "/status"): _body({"state": "success", "ios": {"ip": "192.168.1.2"}, "build": {}}),
+    ("POST", "/session/:sid/wda/tap"): _body(None),
+    ("POST", "/session/:sid/elements"): _body([{"ELEMENT": ELEMENT_ID, "element-6066-11e4-a52e-4f735466cecf": ELEMENT_ID}]),
+    ("GET", "/session/:sid/element/:id/rect"): _body({"x": 10, "y": 20, "width": 100, "height": 44}),
+    ("GET", "/screenshot"): _body(base64.b64encode(PNG).decode()),
+}
+
+
+def fake_fetch(url: str, method="GET", data=None, timeout=None, value_sink=None, **kwargs) -> HTTPResponseWrapper:
+    """ same signature and return value as wda.usbmux.fetch, without any IO """
+    content = RESPONSES[(method.upper(), route_template(url))]
+    sent = len(json.dumps(data)) if data else 0
+    if value_sink is not None:
+        reader = Base64ValueReader(value_sink)
+        reader.feed(content)
+        return HTTPResponseWrapper(reader.envelope(), 200, sent, len(content))
+    return HTTPResponseWrapper(content, 200, sent, len(content))
+
+
+def make_cases(client: wda.Client) -> dict:
+    selector = client(text="Settings")
+    element = selector.get()
+    return {
+        "tap": lambda: client.tap(100, 200),
+        "Selector.get": lambda: selector.get(),
+        "Element.bounds": lambda: element.bounds,
+        "status": lambda: client.status(),
+        "screenshot": lambda: client.screenshot(format="raw"),
+    }
+
+
+def measure(fn, n: int) -> dict:
+    for _ in range(min(n, 200)):  # warm up caches
+        fn()
+
+    start = time.perf_counter_ns()
+    for _ in range(n):
+        fn()
+    ns_per_op = (time.perf_counter_ns() - start) / n
+
+    tracemalloc.start()
+    try:
+        fn()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        before = len(tracemalloc.take_snapshot().traces)
+        for _ in range(min(n, 1000)):
+            fn()
+        after = len(tracemalloc.take_snapshot().traces)
+    finally:
+        tracemalloc.stop()
+    return {
+        "ns_per_op": ns_per_op,
+        "mem_per_op": peak - base,
+        "blocks_per_op": (after - before) / min(n, 1000),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=20000, help="calls per case")
+    parser.add_argument("--only", help="comma separated case names")
+    parser.add_argument("--json", action="store_true", help="print results as json")
+    args = parser.parse_args()
+
+    wda.fetch = fake_fetch
+    client = wda.Client(DEVICE_URL)
+    client.session_id = SESSION_ID
+    cases = make_cases(client)
+    if args.only:
+        cases = {k: v for k, v in cases.items() if k in args.only.split(",")}
+
+    results = {}
+    for name, fn in cases.items():
+        n = args.n if name != "screenshot" else max(args.n // 20, 1)
+        results[name] = measure(fn, n)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print("{:<16} {:>12} {:>12} {:>10}".format("case", "ns/op", "mem/op", "blocks/op"))
+    for name, r in results.items():
+        print("{:<16} {:>12,.0f} {:>10,d} B {:>10.2f}".format(name, r["ns_per_op"], r["mem_per_op"], r["blocks_per_op"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# coding: utf-8
+#
+"""
+Client throughput against the mock WDA server (wda.testing.MockWDAServer)
+
+Usage:
+    python benchmarks/bench_mock_wda.py [--latency 0.005] [--threads 1,4] [--seconds 3]
+
+Every thread runs the same command mix on its own session client, ops/s is
+the total of all threads, p50/p99 are per command latencies in milliseconds.
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import wda
+from wda.testing import MockWDAServer
+from wda.testing.wdaserver import TEST_BUNDLE_ID
+
+
+def _percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def command_mix(s: wda.Client):
+    el = s(text="ENABLED_BTN").get(timeout=0)
+    return [
+        ("status", lambda: s.status()),
+        ("tap", lambda: s.tap(10, 10)),
+        ("Selector.get", lambda: s(text="ENABLED_BTN").get(timeout=0)),
+        ("Element.bounds", lambda: el.bounds),
+        ("screenshot", lambda: s.screenshot(format="raw")),
+    ]
+
+
+def run(url: str, threads: int, seconds: float) -> dict:
+    session = wda.Client(url).session(TEST_BUNDLE_ID)
+    samples = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def _worker():
+        s = wda.Client(url, _session_id=session.session_id)
+        local = {}
+        commands = command_mix(s)
+        while time.perf_counter() < deadline:
+            for name, fn in commands:
+                start = time.perf_counter()
+                fn()
+                local.setdefault(name, []).append(time.perf_counter() - start)
+        with lock:
+            for name, values in local.items():
+                samples.setdefault(name, []).extend(values)
+
+    workers = [threading.Thread(target=_worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    total = sum(len(v) for v in samples.values())
+    return {"ops": total / elapsed, "commands": {
+        name: (_percentile(v, .5) * 1000, _percentile(v, .99) * 1000) for name, v in samples.items()}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.005, help="mock server latency in seconds")
+    parser.add_argument("--threads", default="1,4", help="comma separated thread counts")
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--screenshot-size", type=int, default=500 * 1024)
+    args = parser.parse_args()
+
+    with MockWDAServer(latency=args.latency, screenshot_size=args.screenshot_size) as server:
+        for threads in map(int, args.threads.split(",")):
+            result = run(server.url, threads, args.seconds)
+            print("threads={} latency={:.1f}ms: {:.0f} ops/s".format(threads, args.latency * 1000, result["ops"]))
+            for name, (p50, p99) in result["commands"].items():
+                print("  {:<16} p50 {:7.2f}ms  p99 {:7.2f}ms".format(name, p50, p99))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# coding: utf-8
+#
+"""
+Peak memory of reading a /screenshot response
+
+- legacy: chunked reader before the Content-Length aware implementation
+- current: wda.usbmux.fetch(url).json()
+- stream: wda.usbmux.fetch(url, value_sink=...), used by Client.screenshot
+
+Usage:
+    python benchmarks/bench_response_memory.py [--size-mb 8] [--rounds 3]
+
+Every measurement runs in a fresh subprocess, peak RSS is the VmHWM growth of one screenshot
+(ru_maxrss on platforms without /proc), traced is the tracemalloc peak.
+"""
+
+import argparse
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _legacy_fetch(url: str) -> dict:
+    """ reader before the Content-Length aware implementation """
+    from http.client import HTTPConnection
+    from urllib.parse import urlparse
+    u = urlparse(url)
+    conn = HTTPConnection(u.netloc)
+    conn.request("GET", u.path)
+    response = conn.getresponse()
+    content = bytearray()
+    while True:
+        chunk = response.read(4096)
+        if len(chunk) == 0:
+            break
+        content.extend(chunk)
+    conn.close()
+    return json.loads(content.decode("utf-8"))
+
+
+def _current_fetch(url: str) -> dict:
+    from wda.usbmux import fetch
+    return fetch(url).json()
+
+
+def _stream_fetch(url: str) -> dict:
+    """ path used by Client.screenshot: png is decoded while receiving """
+    import io
+    from wda.usbmux import fetch
+    sink = io.BytesIO()
+    envelope = fetch(url, value_sink=sink).json()
+    envelope["value"] = sink.getbuffer()
+    return envelope
+
+
+def _reset_peak_rss() -> bool:
+    """ Linux only: reset VmHWM, ru_maxrss of a forked child still contains the peak of its parent """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss() -> int:
+    """ bytes """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+
+
+def child(mode: str, url: str):
+    fn = {"legacy": _legacy_fetch, "current": _current_fetch, "stream": _stream_fetch}[mode]
+    fn(url.replace("/screenshot", "/status"))  # import and warm up everything first
+    _reset_peak_rss()
+    rss_before = _peak_rss()
+    value = fn(url)["value"]
+    rss_after = _peak_rss()
+    del value
+
+    tracemalloc.start()
+    value = fn(url)["value"]
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(value) > 0
+    print(json.dumps({"rss_peak": rss_after - rss_before, "traced_peak": traced_peak}))
+
+
+def serve(payload: bytes) -> ThreadingHTTPServer:
+    status = json.dumps({"value": {"state": "success"}, "sessionId": None}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            body = payload if self.path == "/screenshot" else status
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=8.0, help="decoded png size")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "URL"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(*args.child)
+
+    png = b"\x89PNG\r\n\x1a\n" + os.urandom(int(args.size_mb * 1024 * 1024))
+    payload = json.dumps({"value": base64.b64encode(png).decode(), "sessionId": "x"}).encode()
+    server = serve(payload)
+    url = "http://127.0.0.1:%d/screenshot" % server.server_address[1]
+
+    print("payload: %.1f MiB json, %.1f MiB png" % (len(payload) / 2**20, len(png) / 2**20))
+    print("%-8s %16s %16s %10s" % ("reader", "peak RSS MiB", "traced MiB", "x payload"))
+    for mode in ("legacy", "current", "stream"):
+        results = []
+        for _ in range(args.rounds):
+            out = subprocess.check_output([sys.executable, __file__, "--child", mode, url])
+            results.append(json.loads(out))
+        rss = min(r["rss_peak"] for r in results)
+        traced = min(r["traced_peak"] for r in results)
+        print("%-8s %16.1f %16.1f %10.2f" % (mode, rss / 2**20, traced / 2**20, traced / len(payload)))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
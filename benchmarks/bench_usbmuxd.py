@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# coding: utf-8
+#
+"""
+usbmux transport against the mock usbmuxd daemon (wda.testing.MockUsbmuxd)
+
+Usage:
+    python benchmarks/bench_usbmuxd.py [--protocol PLIST,BINARY] [--latency 0] [--mb 64]
+
+handshake: create_mux + Connect until the tunnel is usable, p50/p99 in milliseconds
+throughput: MB/s read through the tunnel, compared to a direct tcp connection
+devices: list_devices() time with hundreds of fake devices attached, BINARY
+    collects Attached events for a fixed 0.1s so it does not scale with the count
+"""
+
+import argparse
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wda.testing import MockUsbmuxd
+from wda.usbmux import pyusbmux
+
+CHUNK = b"\0" * (256 * 1024)
+
+
+class _SourceHandler(socketserver.BaseRequestHandler):
+    """ writes the number of MB asked in the first line, then closes """
+
+    def handle(self):
+        mb = int(self.request.makefile("rb").readline() or 0)
+        for _ in range(mb * 4):
+            self.request.sendall(CHUNK)
+
+
+def _percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def _read_all(sock: socket.socket, mb: int) -> int:
+    sock.sendall(b"%d\n" % mb)
+    buf = bytearray(256 * 1024)
+    total = 0
+    while True:
+        n = sock.recv_into(buf)
+        if not n:
+            break
+        total += n
+    sock.close()
+    return total
+
+
+def bench_handshake(usbmuxd: MockUsbmuxd, device: pyusbmux.MuxDevice, n: int):
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        sock = device.connect(8100, usbmux_address=usbmuxd.address)
+        samples.append(time.perf_counter() - start)
+        sock.close()
+    return _percentile(samples, .5) * 1000, _percentile(samples, .99) * 1000
+
+
+def bench_throughput(usbmuxd: MockUsbmuxd, device: pyusbmux.MuxDevice, source_address, mb: int):
+    start = time.perf_counter()
+    total = _read_all(socket.create_connection(source_address), mb)
+    direct = total / (time.perf_counter() - start) / 1e6
+
+    start = time.perf_counter()
+    total = _read_all(device.connect(8100, usbmux_address=usbmuxd.address), mb)
+    tunnel = total / (time.perf_counter() - start) / 1e6
+    return direct, tunnel
+
+
+def bench_devices(usbmuxd: MockUsbmuxd, counts, repeat: int = 5):
+    results = []
+    for count in counts:
+        while len(usbmuxd.devices) < count:
+            usbmuxd.add_device()
+        best = min(_timed(pyusbmux.list_devices, usbmuxd.address) for _ in range(repeat))
+        results.append((count, best * 1000))
+    return results
+
+
+def _timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--protocol", default="PLIST,BINARY", help="comma separated protocols")
+    parser.add_argument("--latency", type=float, default=0.0, help="mock usbmuxd reply latency in seconds")
+    parser.add_argument("-n", type=int, default=500, help="handshakes per protocol")
+    parser.add_argument("--mb", type=int, default=64, help="MB read through the tunnel")
+    parser.add_argument("--devices", default="1,10,100,500", help="comma separated device counts")
+    args = parser.parse_args()
+
+    source = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _SourceHandler)
+    source.daemon_threads = True
+    threading.Thread(target=source.serve_forever, daemon=True).start()
+
+    for protocol in args.protocol.split(","):
+        with MockUsbmuxd(protocol=protocol, latency=args.latency) as usbmuxd:
+            mock = usbmuxd.add_device(ports={8100: source.server_address})
+            device = pyusbmux.MuxDevice(mock.device_id, mock.serial, "USB")
+            print("{} latency={:.1f}ms".format(protocol, args.latency * 1000))
+
+            p50, p99 = bench_handshake(usbmuxd, device, args.n)
+            print("  handshake        p50 {:7.3f}ms  p99 {:7.3f}ms".format(p50, p99))
+            direct, tunnel = bench_throughput(usbmuxd, device, source.server_address, args.mb)
+            print("  throughput       {:7.0f} MB/s  (direct tcp {:.0f} MB/s)".format(tunnel, direct))
+            for count, ms in bench_devices(usbmuxd, [int(c) for c in args.devices.split(",")]):
+                print("  list_devices {:>4} devices {:8.2f}ms".format(count, ms))
+    source.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+# coding: utf-8
+#
+"""
+Run the e2e tests without an iPhone:
+
+    WDA_MOCK=1 pytest -v e2e_benchmarks/
+
+WDA_MOCK_LATENCY (seconds) adds latency to every mocked response
+"""
+
+import os
+import tempfile
+
+_server = None
+
+
+def pytest_configure(config):
+    global _server
+    if os.getenv("WDA_MOCK") not in ("1", "true", "yes"):
+        return
+    from wda.testing import MockWDAServer
+    # capabilities of the mock are not saved in ~/.cache
+    os.environ.setdefault("WDA_CACHE_DIR", tempfile.mkdtemp(prefix="wda-cache-"))
+    _server = MockWDAServer(latency=float(os.getenv("WDA_MOCK_LATENCY", "0"))).start()
+    os.environ["DEVICE_URL"] = _server.url
+
+
+def pytest_unconfigure(config):
+    if _server is not None:
+        _server.stop()
@@ -1,9 +1,39 @@
 # coding: utf-8
 #
 
+import os
+import threading
+from http.server import ThreadingHTTPServer
+
 import wda
 import pytest
-import os
+from wda import usbmux
+
+
+@pytest.fixture(autouse=True)
+def capability_cache(tmp_path, monkeypatch):
+    """ capabilities learned by a test are not saved in ~/.cache """
+    monkeypatch.setenv("WDA_CACHE_DIR", str(tmp_path / "cache"))
+    wda.capabilities.default_store.clear()
+
+
+@pytest.fixture
+def http_server():
+    """ http_server(handler_class) serves on a local port and returns the url, stopped after the test """
+    servers = []
+
+    def _serve(handler_class) -> str:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return "http://127.0.0.1:%d" % server.server_address[1]
+
+    yield _serve
+    for server in servers:
+        usbmux.close_connections("http://127.0.0.1:%d" % server.server_address[1])
+        server.shutdown()
+        server.server_close()
 
 
 @pytest.fixture
@@ -0,0 +1,170 @@
+# coding: utf-8
+#
+
+import asyncio
+import json
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+import wda
+from wda.aio import AsyncClient
+from wda.usbmux.exceptions import HTTPError
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, value, session_id="SID"):
+        body = json.dumps({"value": value, "sessionId": session_id}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/status":
+            self._reply({"state": "success"})
+        elif self.path == "/wda/locked":
+            self._reply(False)
+        elif self.path == "/session/SID/window/size":
+            self._reply({"width": 375, "height": 667})
+        else:
+            self._reply({"error": "unknown command", "message": self.path})
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers["Content-Length"] or 0)) or b"{}")
+        if self.path == "/session/SID/wda/tap":
+            self._reply(data)
+        elif self.path == "/session/SID/elements":
+            self._reply([{"ELEMENT": "E1"}])
+        else:
+            self._reply({"error": "unknown command", "message": self.path})
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server_url(http_server):
+    return http_server(_Handler)
+
+
+def test_async_client(server_url):
+    async def main():
+        c = AsyncClient(server_url)
+        st, locked = await asyncio.gather(c.status(), c.locked())
+        assert st["state"] == "success" and st["sessionId"] == "SID"
+        assert locked is False
+        assert await c.get_session_id() == "SID"
+
+        res = await c.click(0.5, 0.5)
+        assert res.value == {"x": 187, "y": 333}
+
+        el = await c(text="Settings").get(timeout=0)
+        assert el.id == "E1"
+        assert await c(text="Settings").exists
+
+        with pytest.raises(wda.WDARequestError):
+            await c.http.get("/unknown")
+
+    asyncio.run(main())
+
+
+def test_async_surface():
+    # every public method of the sync classes is overridden, a sync one would block the event loop
+    from wda.aio import AsyncElement, AsyncSelector
+    sync_safe = {"http", "id", "set_timeout"}  # send no request
+    for sync_cls, async_cls in ((wda.Selector, AsyncSelector), (wda.Element, AsyncElement)):
+        for name in dir(sync_cls):
+            if name.startswith("_") or name in sync_safe:
+                continue
+            assert name in vars(async_cls), "%s.%s is inherited" % (async_cls.__name__, name)
+
+
+def test_async_errors():
+    from wda.testing import MockWDAServer
+    from wda.testing.wdaserver import TEST_BUNDLE_ID
+
+    async def main(server, legacy):
+        c = AsyncClient(server.url)
+        s = await c.session(TEST_BUNDLE_ID)
+        await s.tap(100, 120)
+        assert server.request_count("/session/:sid/wda/tap/0", "POST") == (1 if legacy else 0)
+
+        # only "unknown command" falls back to the legacy route
+        server.add_fault("/session/:sid/wda/tap", "error", error="unknown error")
+        with pytest.raises(wda.WDAUnknownError):
+            await s.tap(100, 120)
+        assert server.request_count("/session/:sid/wda/tap/0", "POST") == (1 if legacy else 0)
+
+        with pytest.raises(wda.WDAElementNotFoundError):
+            await s(text="NOT_EXISTS").get(timeout=0)
+        assert await s(text="NOT_EXISTS").exists is False
+
+        server.add_fault("/wda/locked", "delay", seconds=1.0)
+        with pytest.raises(HTTPError) as e:
+            await c.http.get("/wda/locked", timeout=.2)
+        assert isinstance(e.value.args[0], asyncio.TimeoutError)
+
+    with MockWDAServer() as server:
+        asyncio.run(main(server, legacy=False))
+    with MockWDAServer(unsupported_routes=("/session/:sid/wda/tap",)) as server:
+        asyncio.run(main(server, legacy=True))
+
+
+def test_async_element():
+    from wda.testing import MockWDAServer
+    from wda.testing.wdaserver import TEST_BUNDLE_ID
+
+    async def main():
+        c = AsyncClient(server.url)
+        s = await c.session(TEST_BUNDLE_ID)
+        el = await s(text="DISABLED_BTN").get(timeout=0)
+        assert await el.label == "DISABLED_BTN"
+        assert await el.enabled is False
+        assert await el.bounds == wda.Rect(20, 150, 200, 40)
+        info = await el.info
+        assert info["id"] == el.id and info["enabled"] is False and info["accessibilityContainer"] is False
+        assert await (await s(text="CHECKED_BTN").get()).selected() is True
+
+        field = await s(text="INPUT_FIELD").get()
+        await field.set_text("hello")
+        assert await field.value == "hello"
+        await field.clear_text()
+        assert not await field.value
+
+        await (await s(text="LONG_TAP_ALERT").get()).tap_hold(1.0)
+        assert await s.alert.text == "LONG_TAP_ALERT"
+        await s.alert.accept()
+        await (await s(text="ACCEPT_OR_REJECT_ALERT").get()).tap()
+        assert await s.alert.exists
+        with pytest.raises(ValueError):
+            await el.scroll("nowhere")
+
+    with MockWDAServer() as server:
+        asyncio.run(main())
+
+
+def test_async_stale_connection():
+    from wda.testing import MockWDAServer
+    from wda.testing.wdaserver import TEST_BUNDLE_ID
+
+    async def main():
+        c = AsyncClient(server.url)
+        s = await c.session(TEST_BUNDLE_ID)
+        await s.tap(1, 1)
+        # WDA may have run the tap before the connection died, it is not sent again
+        server.add_fault("/session/:sid/wda/tap", "disconnect")
+        with pytest.raises(HTTPError):
+            await s.tap(1, 1)
+        assert server.request_count("/session/:sid/wda/tap", "POST") == 2
+
+        await c.status()  # an idle keep-alive connection
+        locked = server.request_count("/wda/locked")
+        server.add_fault("/wda/locked", "disconnect")
+        assert await c.locked() is False  # GET is sent again
+        assert server.request_count("/wda/locked") == locked + 2
+
+    with MockWDAServer() as server:
+        asyncio.run(main())
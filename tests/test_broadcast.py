@@ -0,0 +1,55 @@
+# coding: utf-8
+#
+
+import wda
+from wda.broadcast import Broadcaster
+from wda.testing import MockWDAServer
+
+
+def test_broadcast():
+    servers = [MockWDAServer(latency=(0.0, 0.05), seed=i).start() for i in range(4)]
+    servers.append(MockWDAServer(unsupported_routes=("/session/:sid/wda/tap",),
+                                 build={"time": "Jan 10 2023 08:00:00", "version": "4.10.0"}).start())
+    try:
+        b = Broadcaster([wda.Client(s.url) for s in servers], timeout=5)
+        b.warmup()
+        assert b.tap(0.5, 0.5).ok  # the last server gets /wda/tap/0 after /wda/tap failed
+        for _ in range(3):
+            r = b.tap(0.5, 0.5)
+            assert r.ok, [d.error for d in r.dispatches]
+            # the spread is the wakeup of threads behind the barrier, not the round trips
+            assert r.spread < 0.03, r.offsets
+        assert [s.request_count("/session/:sid/wda/tap", "POST") for s in servers] == [4, 4, 4, 4, 1]
+        assert servers[-1].request_count("/session/:sid/wda/tap/0", "POST") == 4
+
+        assert b.swipe(0.5, 0.8, 0.5, 0.2).ok
+        pngs = b.screenshot().values
+        assert all(png.startswith(b"\x89PNG") for png in pngs)
+        assert wda.usbmux.connection_stats()["reused"] > 0
+    finally:
+        for s in servers:
+            s.stop()
+
+    r = b.tap(10, 10)
+    assert not r.ok and all(d.sent_at is None or d.error for d in r.dispatches)
+
+
+def test_broadcast_device_slots():
+    with MockWDAServer() as server:
+        c = wda.Client(server.url)
+        b = Broadcaster([c], timeout=0.3)
+        b.warmup()
+        assert b.tap(10, 10).ok  # prepare() has nothing to ask the device any more
+        slots = wda.device_slots(wda.retrying.device_key(server.url))
+        taken = 0
+        while slots.acquire(blocking=False):  # every slot of the device is busy
+            taken += 1
+        try:
+            r = b.tap(10, 10)
+            assert isinstance(r.dispatches[0].error, TimeoutError)
+            assert server.request_count("/session/:sid/wda/tap", "POST") == 1
+        finally:
+            for _ in range(taken):
+                slots.release()
+        assert b.tap(10, 10).ok
+        assert server.request_count("/session/:sid/wda/tap", "POST") == 2
@@ -0,0 +1,87 @@
+# coding: utf-8
+#
+
+import json
+import os
+
+import pytest
+
+import wda
+from wda import capabilities
+from wda.testing import MockWDAServer
+from wda.testing.wdaserver import TEST_BUNDLE_ID
+
+OLD_BUILD = {"time": "Jan 10 2023 08:00:00", "productBundleIdentifier": "com.facebook.WebDriverAgentRunner"}
+
+
+def test_capabilities(tmp_path):
+    old = MockWDAServer(build=OLD_BUILD,
+                        unsupported_routes=("/session/:sid/wda/tap", "/session/:sid/wda/screen")).start()
+    new = MockWDAServer(build=dict(OLD_BUILD, time="Mar 18 2024 11:29:21", version="6.0.0")).start()
+    try:
+        s = wda.Client(old.url).session(TEST_BUNDLE_ID)
+        s.tap(1, 1)
+        s.tap(1, 1)
+        assert s.scale == 2
+        assert s.capabilities.as_dict() == {"tap": "/wda/tap/0", "screen": False}
+        assert old.request_count("/session/:sid/wda/tap", "POST") == 1
+        assert old.request_count("/session/:sid/wda/tap/0", "POST") == 2
+        with open(s.capabilities.path) as f:
+            assert json.load(f) == {"build": OLD_BUILD, "device": old.url,
+                                    "capabilities": {"tap": "/wda/tap/0", "screen": False}}
+        assert os.path.dirname(s.capabilities.path) == str(tmp_path / "cache" / "capabilities")
+
+        # a new process loads the table from disk and routes directly
+        capabilities.default_store.clear()
+        s = wda.Client(old.url).session(TEST_BUNDLE_ID)
+        s.tap(1, 1)
+        assert s.scale == 2
+        assert old.request_count("/session/:sid/wda/tap", "POST") == 1
+        assert old.request_count("/session/:sid/wda/screen") == 1
+
+        # a transient error is not taken as an unsupported route
+        c = wda.Client(new.url)
+        s = c.session(TEST_BUNDLE_ID)
+        new.add_fault("/session/:sid/wda/tap", "error", times=1, error="unknown error")
+        s.tap(1, 1)
+        assert s.capabilities.get(capabilities.TAP) is None
+        s.tap(1, 1)
+        assert s.scale == 2
+        assert c.capabilities.as_dict() == {"tap": "/wda/tap", "screen": True}
+        assert len(os.listdir(tmp_path / "cache" / "capabilities")) == 2
+    finally:
+        old.stop()
+        new.stop()
+
+
+def test_capabilities_stale_route():
+    # WDA was upgraded in place and reports the same build, the cached legacy route is gone
+    with MockWDAServer(build=OLD_BUILD, unsupported_routes=("/session/:sid/wda/tap/0",)) as server:
+        s = wda.Client(server.url).session(TEST_BUNDLE_ID)
+        s.capabilities.set(capabilities.TAP, "/wda/tap/0")
+        s.tap(1, 1)
+        s.tap(1, 1)
+        assert s.capabilities.get(capabilities.TAP) == "/wda/tap"
+        assert server.request_count("/session/:sid/wda/tap/0", "POST") == 1
+        assert server.request_count("/session/:sid/wda/tap", "POST") == 2
+
+        # another device with the same build has its own table
+        other = capabilities.default_store.load(OLD_BUILD, "http://127.0.0.1:1")
+        assert other is not s.capabilities and other.get(capabilities.TAP) is None
+
+        # a transient error of the cached route is raised, not taken as a route change
+        server.add_fault("/session/:sid/wda/tap", "error", times=1, error="unknown error")
+        with pytest.raises(wda.WDAUnknownError):
+            s.tap(1, 1)
+        assert s.capabilities.get(capabilities.TAP) == "/wda/tap"
+
+
+def test_capabilities_build_from_state():
+    # sessions share the state of the client, the build of a /status seen before is reused
+    with MockWDAServer(build=OLD_BUILD) as server:
+        c = wda.Client(server.url)
+        baseline = server.request_count("/status")
+        for _ in range(3):
+            c.session().tap(1, 1)
+        assert server.request_count("/status") - baseline <= 1
+        assert c.state.peek("build") == OLD_BUILD
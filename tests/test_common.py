@@ -12,4 +12,43 @@ def test_rect():
     assert r.top == 20
     assert r.x == 10 and r.y == 20 and r.width == 10 and r.height == 30
     assert r.center.x == 15 and r.center.y == 35
-    assert r.origin.x == 10 and r.origin.y == 20
\ No newline at end of file
+    assert r.origin.x == 10 and r.origin.y == 20
+
+def test_compile_call():
+    from wda.utils import compile_call
+    calls = []
+
+    def _cb(url, client=None):
+        calls.append((url, client))
+
+    call = compile_call(_cb)
+    call(url="/status", method="GET", data=None)
+    assert calls == [("/status", None)]
+    assert call == _cb and compile_call(call) is call
+
+    callbacks = [call]
+    callbacks.remove(_cb)
+    assert callbacks == []
+
+
+def test_fetch_callback_events():
+    from wda.testing import MockWDAServer
+
+    with MockWDAServer() as server:
+        c = wda.Client(server.url)
+        events = []
+        run_callback = c._run_callback
+
+        def _run_callback(event_name, callbacks, **kwargs):
+            events.append(event_name)
+            return run_callback(event_name, callbacks, **kwargs)
+
+        c._run_callback = _run_callback
+        c.status()
+        assert events == []  # only the ERROR callback of the Client is registered
+
+        urls = []
+        c.register_callback(wda.Callback.HTTP_REQUEST_AFTER, lambda url: urls.append(url))
+        c.status()
+        assert events == [wda.Callback.HTTP_REQUEST_AFTER]
+        assert urls == [server.url + "/status"]
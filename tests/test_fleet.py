@@ -0,0 +1,55 @@
+# coding: utf-8
+#
+
+import socket
+import sys
+import time
+
+import pytest
+
+from wda.fleet import DeviceFleet
+from wda.testing import MockUsbmuxd, MockWDAServer
+from wda.usbmux import pyusbmux
+
+
+@pytest.fixture
+def rack(monkeypatch):
+    """ 4 devices with a slow WDA and 1 device whose WDA is not running """
+    servers = [MockWDAServer(latency=0.2).start() for _ in range(4)]
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        dead_port = s.getsockname()[1]
+    with MockUsbmuxd() as usbmuxd:
+        monkeypatch.setenv("USBMUXD_SOCKET_ADDRESS", "UNIX:" + usbmuxd.address)
+        monkeypatch.setattr(pyusbmux, "_directories", {})
+        monkeypatch.setattr(pyusbmux, "_protocol_versions", {})
+        for i, server in enumerate(servers):
+            usbmuxd.add_device("00008030-%04d" % i, ports={8100: server.address})
+        usbmuxd.add_device("00008030-DEAD", ports={8100: dead_port})
+        usbmuxd.add_device("00008030-0000", ports={8100: servers[0].address}, connection_type="Network")
+        yield usbmuxd
+    for server in servers:
+        server.stop()
+
+
+def test_fleet(rack):
+    with DeviceFleet(max_workers=8, ready_timeout=0.5) as fleet:
+        assert sorted(fleet.udids) == ["00008030-0000", "00008030-0001", "00008030-0002", "00008030-0003",
+                                       "00008030-DEAD"]
+        start = time.monotonic()
+        results = fleet.bootstrap()
+        assert time.monotonic() - start < 1.5  # in parallel, a serial bootstrap takes 4 * 0.2 + 0.5 * 2
+        assert sorted(udid for udid, r in results.items() if r.ok) == sorted(fleet.clients)
+        assert not results["00008030-DEAD"].ok
+        assert len(fleet.clients) == 4
+
+        start = time.monotonic()
+        results = fleet.run(lambda c: c.status()["ready"])
+        assert time.monotonic() - start < 0.6
+        assert [r.value for r in results.values()] == [True] * 4
+
+        results = fleet.run(lambda c: 1 / 0)
+        assert all(isinstance(r.error, ZeroDivisionError) for r in results.values())
+
+        results = fleet.run_command([sys.executable, "-c", "print('{udid}')"])
+        assert {r.value.stdout.strip() for r in results.values()} == set(fleet.clients)
@@ -0,0 +1,62 @@
+# coding: utf-8
+#
+
+import json
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+import wda
+from wda import metrics
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/status":
+            value = {"state": "success"}
+        else:
+            value = {"error": "no such element", "message": self.path}
+        body = json.dumps({"value": value, "sessionId": "SID"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server_url(http_server):
+    return http_server(_Handler)
+
+
+def test_route_template():
+    assert metrics.route_template("/status?x=1") == "/status"
+    assert metrics.route_template(
+        "/session/6DB1C8F2-6D5F-4A3B-9C1E-2B6A1F0D3C4E/element/5A000000-0000-0000-0C2B-000000000000/rect"
+    ) == "/session/:sid/element/:id/rect"
+    assert metrics.route_template("http+usbmux://UDID:8100/session/SID/wda/element/12/swipe") \
+        == "/session/:sid/wda/element/:id/swipe"
+    assert metrics.route_template("/session/SID/elements") == "/session/:sid/elements"
+
+
+def test_client_metrics(server_url, tmp_path):
+    metrics.default_registry.reset()
+    c = wda.Client(server_url)
+    c.http.get("/status")
+    with pytest.raises(wda.WDARequestError):
+        c.http.get("/session/SID/element/E1/rect")
+
+    assert metrics.default_registry.histogram("GET", "/status").count == 1
+    assert metrics.default_registry.errors() == {"WDARequestError": 1}
+
+    text = metrics.render()
+    assert 'wda_request_duration_seconds_count{method="GET",route="/session/:sid/element/:id/rect"} 1' in text
+    assert 'wda_request_duration_seconds_bucket{method="GET",route="/status",le="+Inf"} 1' in text
+    assert 'wda_response_received_bytes_total{method="GET",route="/status"}' in text
+
+    metrics.dump(str(tmp_path / "wda.prom"))
+    assert (tmp_path / "wda.prom").read_text() == metrics.render()
@@ -0,0 +1,42 @@
+# coding: utf-8
+#
+
+import pytest
+
+import wda
+from wda import replay
+from wda.testing import MockWDAServer
+from wda.testing.wdaserver import TEST_BUNDLE_ID
+
+
+def _scenario(c: wda.Client, server=None):
+    s = c.session(TEST_BUNDLE_ID)
+    if server is not None:
+        server.add_fault("/wda/locked", "error", times=1, error="unknown error")
+    s(text="ACCEPT_OR_REJECT_ALERT").click()
+    buttons = s.alert.buttons()
+    s.alert.accept()
+    with pytest.raises(wda.WDAUnknownError):
+        s.locked()
+    return buttons, s.app_current()["bundleId"], s.screenshot(format="raw")
+
+
+def test_record_replay(tmp_path):
+    path = str(tmp_path / "trace.jsonl.gz")
+    with MockWDAServer() as server:
+        c = wda.Client(server.url)
+        with replay.Recorder(path) as recorder:
+            c.transport = recorder
+            recorded = _scenario(c, server)
+        assert recorder.count == len(list(replay.read_trace(path)))
+
+    # the server is gone, the same calls are answered from the trace
+    c = wda.Client("http://127.0.0.1:1")
+    replayer = replay.Replayer(path, speed=0, strict=True)
+    c.transport = replayer
+    assert _scenario(c) == recorded
+    assert replayer.remaining() == 0
+    assert replayer.misses == 0
+
+    with pytest.raises(wda.WDAReplayError):
+        c.status()
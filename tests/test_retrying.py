@@ -0,0 +1,117 @@
+# coding: utf-8
+#
+
+import pytest
+
+import wda
+from wda import metrics, retrying
+from wda.testing import MockWDAServer
+from wda.usbmux.exceptions import HTTPError
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def _policy(clock, **kwargs) -> retrying.RetryPolicy:
+    return retrying.RetryPolicy(sleep=clock.sleep, clock=clock, rnd=lambda: 0.5, **kwargs)
+
+
+def test_backoff():
+    backoff = retrying.Backoff(delay=1, factor=2, max_delay=3, jitter=0.5)
+    assert [backoff.delay_for(n, lambda: 0.5) for n in (1, 2, 3)] == [1, 2, 3]
+    assert backoff.delay_for(1, lambda: 0.0) == 0.5
+    assert backoff.delay_for(1, lambda: 1.0) == 1.5
+
+
+def test_retry_policy_budget():
+    clock = _Clock()
+    policy = _policy(clock, budget=2, window=10, rules={wda.WDAUnknownError: retrying.Backoff(tries=5, delay=1)})
+    calls = []
+
+    def _fail():
+        calls.append(clock.now)
+        raise wda.WDAUnknownError(110, {"error": "unknown error"})
+
+    with pytest.raises(wda.WDAUnknownError):
+        policy.call(_fail, "http://device:8100/status", "test", (wda.WDAUnknownError,))
+    assert calls == [0, 1, 3]  # budget allows 2 retries
+    assert policy.retry_budget("http://device:8100").available == 0
+
+    # exceptions without a rule are not retried
+    calls.clear()
+    with pytest.raises(ValueError):
+        policy.call(lambda: calls.append(1) or int("x"), "http://device:8100", "test", (ValueError,))
+    assert calls == [1]
+
+
+def test_circuit_breaker():
+    clock = _Clock()
+    breaker = retrying.CircuitBreaker("http://device:8100", threshold=2, cooldown=5, clock=clock)
+    breaker.record_failure(wda.WDARequestError(110, {}))  # WDA answered, it is up
+    breaker.record_failure(HTTPError("refused"))
+    assert breaker.state == breaker.CLOSED
+    breaker.record_failure(HTTPError("refused"))
+    assert breaker.state == breaker.OPEN
+    with pytest.raises(wda.WDACircuitOpenError):
+        breaker.before_request()
+
+    clock.now = 5
+    breaker.before_request()  # trial request
+    with pytest.raises(wda.WDACircuitOpenError):
+        breaker.before_request()
+    breaker.record_failure(HTTPError("refused"))
+    assert breaker.state == breaker.OPEN
+
+    clock.now = 10
+    breaker.before_request()
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED
+    breaker.before_request()
+
+
+def test_client_retry_policy():
+    clock = _Clock()
+    with MockWDAServer() as server:
+        c = wda.Client(server.url)
+        c.retry_policy = _policy(clock, threshold=2)
+        server.add_fault("/wda/activeAppInfo", "error", times=2, error="unknown error")
+        assert c.app_current()["bundleId"] == "com.apple.springboard"
+        assert c.session().retry_policy is c.retry_policy
+        assert 'wda_policy_retries_total{operation="app_current",error="WDAUnknownError"}' in metrics.render()
+
+    # server is down, the circuit opens after two failures
+    for _ in range(2):
+        with pytest.raises(HTTPError):
+            c.locked()
+    with pytest.raises(wda.WDACircuitOpenError):
+        c.locked()
+
+
+def test_default_policy():
+    clock = _Clock()
+    policy = _policy(clock)
+    breaker = policy.breaker("http://device:8100")
+    for _ in range(20):
+        breaker.record_failure(HTTPError("refused"))
+    assert breaker.state == breaker.CLOSED  # opt-in
+    breaker.before_request()
+
+    # status waits 2 seconds between tries, like before the policy
+    calls = []
+
+    def _empty():
+        calls.append(clock.now)
+        raise wda.WDAEmptyResponseError(-1, "empty")
+
+    with pytest.raises(wda.WDAEmptyResponseError):
+        policy.call(_empty, "http://device:8100", "status", (wda.WDAEmptyResponseError,))
+    assert calls == [0, 2, 4]
+    assert 'wda_policy_retries_total{operation="status",error="WDAEmptyResponseError"}' in metrics.render()
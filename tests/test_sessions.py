@@ -0,0 +1,59 @@
+# coding: utf-8
+#
+
+import pytest
+
+import wda
+from wda.sessions import SessionPool
+from wda.testing import MockWDAServer
+from wda.testing.wdaserver import TEST_BUNDLE_ID
+
+
+def test_session_pool():
+    with MockWDAServer() as server:
+        c = wda.Client(server.url)
+        pool = SessionPool(c, reset="activate")
+        for _ in range(5):
+            with pool.session(TEST_BUNDLE_ID) as s:
+                assert s.app_current()["bundleId"] == TEST_BUNDLE_ID
+                c.home()
+        assert server.request_count("/session", "POST") == 1
+        assert pool.stats.as_dict() == {"created": 1, "reused": 4, "invalid": 0, "resets": 4}
+
+        # WDA keeps one session, the pooled one is gone after a session of another app
+        c.session("com.apple.Preferences")
+        with pool.session(TEST_BUNDLE_ID) as s:
+            assert s.app_current()["bundleId"] == TEST_BUNDLE_ID
+        assert pool.stats.invalid == 1 and pool.stats.created == 2
+
+        pool = SessionPool(c, reset="relaunch")
+        with pool.session(TEST_BUNDLE_ID) as s:
+            pid = s.app_current()["pid"]
+        with pool.session(TEST_BUNDLE_ID) as s:
+            assert s.app_current()["pid"] != pid
+        pool.close()
+        assert server.request_count("/session/:sid/", "DELETE") == 1
+
+    with pytest.raises(ValueError):
+        SessionPool(c, reset="reboot")
+
+
+def test_session_pool_errors():
+    with MockWDAServer() as server:
+        c = wda.Client(server.url)
+        pool = SessionPool(c, reset="activate")
+        with pytest.raises(RuntimeError):
+            with pool.session(TEST_BUNDLE_ID):
+                raise RuntimeError("test failed")
+        with pool.session(TEST_BUNDLE_ID):
+            pass
+        assert pool.stats.created == 2 and pool.stats.reused == 0  # not pooled after the error
+
+        # without validation, a dead session is replaced when activating the app fails
+        pool = SessionPool(c, reset="activate", validate=False)
+        with pool.session(TEST_BUNDLE_ID):
+            pass
+        c.session("com.apple.Preferences")
+        with pool.session(TEST_BUNDLE_ID) as s:
+            assert s.app_current()["bundleId"] == TEST_BUNDLE_ID
+        assert pool.stats.as_dict() == {"created": 2, "reused": 0, "invalid": 1, "resets": 1}
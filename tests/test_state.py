@@ -0,0 +1,135 @@
+# coding: utf-8
+#
+
+import time
+
+import wda
+from wda import state
+from wda.testing import MockWDAServer
+from wda.testing.wdaserver import TEST_BUNDLE_ID
+
+
+def test_device_state():
+    with MockWDAServer() as server:
+        c = wda.Client(server.url)
+        s = c.session(TEST_BUNDLE_ID)
+        s = c.session(TEST_BUNDLE_ID)
+        s.app_launch(TEST_BUNDLE_ID)
+        assert server.request_count("/wda/locked") == 1
+
+        c.lock()
+        c.session(TEST_BUNDLE_ID)
+        assert server.request_count("/wda/unlock", "POST") == 1
+        assert server.request_count("/wda/locked") == 1
+
+        s = c.session(TEST_BUNDLE_ID)
+        assert s.orientation == s.orientation == "PORTRAIT"
+        assert server.request_count("/session/:sid/orientation") == 1
+        s.orientation = "LANDSCAPE"
+        assert s.orientation == "LANDSCAPE"
+        assert server.request_count("/session/:sid/orientation") == 2
+
+        assert c.state.peek(state.SESSION_ID) == s.session_id
+        assert s.app_current()["bundleId"] == TEST_BUNDLE_ID
+        assert c.state.peek(state.APP_CURRENT)["bundleId"] == TEST_BUNDLE_ID
+        s.tap(1, 1)  # may open another app
+        assert c.state.peek(state.APP_CURRENT) is None
+
+        c.state.invalidate()
+        c.state.start_refresh(c, interval=0.05)
+        try:
+            deadline = time.monotonic() + 5
+            while c.state.stats.refreshes < 2 and time.monotonic() < deadline:
+                time.sleep(.01)
+        finally:
+            c.state.stop_refresh()
+        snapshot = c.state.snapshot()
+        assert snapshot["locked"] is False
+        assert snapshot["app_current"] == c.app_current()
+        assert snapshot["session_id"] == s.session_id
+        assert snapshot["orientation"] == "LANDSCAPE"
+
+
+def test_device_state_ttl():
+    now = [0.0]
+    st = state.DeviceState(ttl=2.0, clock=lambda: now[0])
+    fetched = []
+    st.get(state.LOCKED, lambda: fetched.append(1) or True)
+    now[0] = 1.9
+    assert st.get(state.LOCKED, lambda: fetched.append(1) or False) is True
+    now[0] = 2.0
+    assert st.get(state.LOCKED, lambda: fetched.append(1) or False) is False
+    assert len(fetched) == 2
+    assert (st.stats.hits, st.stats.misses) == (1, 2)
+
+
+def test_static_cache():
+    with MockWDAServer() as server:
+        c = wda.Client(server.url)
+        s = c.session(TEST_BUNDLE_ID)
+        s.click(0.5, 0.9)
+        assert s.window_size() == s.window_size()  # the tap may have rotated the app, asked once again
+        s.swipe_up()
+        assert server.request_count("/session/:sid/window/size") == 2
+        assert s.scale == s.scale == 2
+        assert s.info["model"] == s.device_info()["model"]
+        assert server.request_count("/session/:sid/wda/screen") == 1
+        assert server.request_count("/session/:sid/wda/device/info") == 1
+        assert (c.state.stats.static_hits, c.state.stats.static_misses) == (4, 4)
+
+        s.orientation = "LANDSCAPE"
+        w, h = s.window_size()
+        assert w > h
+        assert server.request_count("/session/:sid/window/size") == 3
+        assert s.scale == 2
+        assert server.request_count("/session/:sid/wda/screen") == 1
+
+        s = c.session(TEST_BUNDLE_ID)
+        s.swipe_left()
+        s.scale
+        assert server.request_count("/session/:sid/window/size") == 4
+        assert server.request_count("/session/:sid/wda/screen") == 2
+
+
+def test_window_size_app_rotation():
+    from wda.testing.wdaserver import LANDSCAPE
+    with MockWDAServer() as server:
+        s = wda.Client(server.url).session(TEST_BUNDLE_ID)
+        assert s.window_size() == (414, 896)
+        server.device.orientation = LANDSCAPE  # the app rotates by itself
+        s.tap(1, 1)
+        assert s.window_size() == (896, 414)
+
+        # without any request in between, the window size expires after ttl
+        server.device.orientation = "PORTRAIT"
+        s.state.ttl = 0.1
+        time.sleep(0.15)
+        assert s.window_size() == (414, 896)
+
+        # another app in the foreground
+        s.state.ttl = 60
+        s.window_size()
+        s.app_current()
+        server.device.orientation = LANDSCAPE
+        server.device.launch("com.apple.Preferences")
+        assert s.app_current()["bundleId"] == "com.apple.Preferences"
+        assert s.window_size() == (896, 414)
+
+
+def test_device_state_stats_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    ds = state.DeviceState(ttl=60)
+    ds.set(state.LOCKED, False)
+    ds.set(state.SCALE, 2)
+
+    def _read(_):
+        for _ in range(1000):
+            ds.get(state.LOCKED, lambda: True)
+            ds.get(state.SCALE, lambda: 3)
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(_read, range(8)))
+    assert (ds.stats.hits, ds.stats.static_hits) == (8000, 8000)
+    ds.record_miss(state.ORIENTATION)
+    assert ds.stats.misses == 1
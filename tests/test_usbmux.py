@@ -0,0 +1,517 @@
+# coding: utf-8
+#
+
+import base64
+import gzip
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPResponse, IncompleteRead
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from wda import usbmux
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    dropped = []  # "METHOD path" closed without a response
+
+    def _drop(self) -> bool:
+        """ /drop closes the connection without a response, /drop-once only the first time """
+        key = self.command + " " + self.path
+        if self.path == "/drop" or (self.path.startswith("/drop-once") and key not in self.dropped):
+            self.dropped.append(key)
+            self.close_connection = True
+            return True
+        return False
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self._drop():
+            self.do_GET()
+
+    def do_GET(self):
+        if self.command == "GET" and self._drop():
+            return
+        value = self.path
+        if self.path.startswith("/sleep"):
+            time.sleep(0.3)
+        elif self.path == "/screenshot":
+            value = base64.b64encode(b"\x89PNG" * 5000).decode()
+        elif self.path == "/source":
+            value = "<XCUIElementTypeApplication/>" * 1000
+        body = json.dumps({"value": value, "sessionId": None}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server_url(http_server):
+    return http_server(_Handler)
+
+
+def test_fetch_reuse_connection(server_url):
+    before = usbmux.connection_stats()
+    for i in range(3):
+        resp = usbmux.fetch(server_url + "/status?i=%d" % i)
+        assert resp.json()["value"] == "/status?i=%d" % i
+    after = usbmux.connection_stats()
+    assert after["created"] - before["created"] == 1
+    assert after["reused"] - before["reused"] == 2
+
+
+def test_fetch_reconnect_half_closed(server_url):
+    usbmux.fetch(server_url + "/status")
+    # simulate the server closing the idle keep-alive connection
+    conn = usbmux._pool._idle[usbmux._pool.endpoint_key(server_url)][0]
+    conn.sock.shutdown(2)
+
+    before = usbmux.connection_stats()
+    assert usbmux.fetch(server_url + "/status").json()["value"] == "/status"
+    after = usbmux.connection_stats()
+    assert after["reconnects"] - before["reconnects"] == 1
+
+
+def test_prepared_request_stale_connection(server_url):
+    usbmux.fetch(server_url + "/status")  # an idle keep-alive connection in the pool
+
+    # WDA may have run the POST before closing the connection, it is not sent again
+    req = usbmux.PreparedRequest(server_url + "/drop", "POST", {"x": 1})
+    req.send()
+    with pytest.raises(usbmux.HTTPError):
+        req.response()
+    assert _Handler.dropped.count("POST /drop") == 1
+
+    # GET is sent again on a new connection
+    usbmux.fetch(server_url + "/status")
+    req = usbmux.PreparedRequest(server_url + "/drop-once", "GET")
+    req.send()
+    assert req.response().json()["value"] == "/drop-once"
+    assert _Handler.dropped.count("GET /drop-once") == 1
+
+    # nothing was written yet, a POST is sent on a new connection
+    usbmux.fetch(server_url + "/status")
+    req = usbmux.PreparedRequest(server_url + "/tap", "POST", {"x": 1})
+    req._conn.sock.shutdown(2)
+    req.send()
+    assert req.response().json()["value"] == "/tap"
+
+
+def test_fetch_stale_connection(server_url):
+    usbmux.fetch(server_url + "/status")  # an idle keep-alive connection in the pool
+    dropped = _Handler.dropped.count("POST /drop")
+    with pytest.raises(usbmux.HTTPError):
+        usbmux.fetch(server_url + "/drop", "POST", {"x": 1})
+    assert _Handler.dropped.count("POST /drop") == dropped + 1  # not sent again
+
+    usbmux.fetch(server_url + "/status")
+    assert usbmux.fetch(server_url + "/drop-once?fetch").json()["value"] == "/drop-once?fetch"
+    assert "GET /drop-once?fetch" in _Handler.dropped
+
+
+def test_device_directory_cache(monkeypatch):
+    from wda.usbmux import pyusbmux
+    calls = []
+
+    def _list_devices(usbmux_address=None):
+        calls.append(usbmux_address)
+        return [pyusbmux.MuxDevice(1, "00008030-AAAA", "Network"),
+                pyusbmux.MuxDevice(2, "00008030-AAAA", "USB")]
+
+    monkeypatch.setattr(pyusbmux, "list_devices", _list_devices)
+    directory = pyusbmux.DeviceDirectory(ttl=60)
+    assert directory.lookup("00008030AAAA").devid == 2
+    assert directory.lookup("00008030-AAAA").is_usb
+    assert len(calls) == 1
+
+    # unknown udid triggers exactly one refresh
+    assert directory.lookup("unknown") is None
+    assert len(calls) == 2
+
+    directory.detach(2)
+    assert directory.lookup("00008030-AAAA").devid == 1
+    directory.attach(pyusbmux.MuxDevice(3, "BBBB", "USB"))
+    assert directory.lookup("BBBB").devid == 3
+    assert len(calls) == 2
+
+    directory.invalidate()
+    directory.devices()
+    assert len(calls) == 3
+
+
+class _FakeSocket:
+    def __init__(self, raw: bytes):
+        self._file = io.BytesIO(raw)
+
+    def makefile(self, *args, **kwargs):
+        return self._file
+
+
+def _fake_response(head: bytes, body: bytes) -> HTTPResponse:
+    response = HTTPResponse(_FakeSocket(b"HTTP/1.1 200 OK\r\n" + head + b"\r\n" + body))
+    response.begin()
+    return response
+
+
+@pytest.mark.parametrize("head, body, expect", [
+    (b"Content-Length: 11\r\n", b"hello world", b"hello world"),
+    (b"Content-Length: 11\r\n", b"hello world, and more", b"hello world"),
+    (b"Content-Length: 0\r\n", b"", b""),
+    (b"Transfer-Encoding: chunked\r\n", b"5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n", b"hello world"),
+    (b"Transfer-Encoding: chunked\r\n", b"0\r\n\r\n", b""),
+])
+def test_read_response(head, body, expect):
+    content = usbmux._read_response(_fake_response(head, body), chunk_size=4)
+    assert isinstance(content, bytearray)
+    assert content == expect
+
+
+def test_read_response_incomplete():
+    response = _fake_response(b"Content-Length: 11\r\n", b"hello")
+    with pytest.raises(IncompleteRead) as e:
+        usbmux._read_response(response)
+    assert e.value.partial == b"hello"
+    assert e.value.expected == 6
+
+
+def test_safe_stream_socket_parse():
+    import plistlib
+    import socket
+    from wda.usbmux import pyusbmux
+
+    a, b = socket.socketpair()
+    devices = [{'MessageType': 'Attached', 'DeviceID': i,
+                'Properties': {'SerialNumber': 'SN%04d' % i, 'ConnectionType': 'USB'}} for i in range(500)]
+    message = pyusbmux.usbmuxd_response.build({
+        'header': {'version': pyusbmux.usbmuxd_version.PLIST, 'message': pyusbmux.usbmuxd_msgtype.PLIST, 'tag': 7},
+        'data': plistlib.dumps({'DeviceList': devices}),
+    })
+    threading.Thread(target=a.sendall, args=(message,), daemon=True).start()
+
+    stream = pyusbmux.SafeStreamSocket.wrap(b)
+    response = pyusbmux.usbmuxd_response.parse_stream(stream)
+    assert response.header.tag == 7
+    assert len(plistlib.loads(response.data)['DeviceList']) == 500
+    assert stream.tell() == len(message)
+    a.close()
+    b.close()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 4096])
+def test_base64_value_reader(chunk_size):
+    import base64
+    import io
+    import os
+    from wda.usbmux.streaming import Base64ValueReader
+
+    raw = os.urandom(3000)
+    b64 = base64.encodebytes(raw).decode()  # with line breaks like WDA
+    body = json.dumps({"value": b64.replace("/", "\\/"), "sessionId": "S"}, indent=2)
+    body = body.replace("\\\\/", "\\/").encode()
+
+    sink = io.BytesIO()
+    reader = Base64ValueReader(sink)
+    for i in range(0, len(body), chunk_size):
+        reader.feed(body[i:i + chunk_size])
+    assert reader.streamed
+    assert sink.getvalue() == raw
+    assert json.loads(reader.envelope()) == {"value": "", "sessionId": "S"}
+
+
+def test_base64_value_reader_error_value():
+    import io
+    from wda.usbmux.streaming import Base64ValueReader
+
+    body = json.dumps({"value": {"error": "unknown error", "message": "x"}}).encode()
+    sink = io.BytesIO()
+    reader = Base64ValueReader(sink)
+    reader.feed(body)
+    assert not reader.streamed
+    assert reader.envelope() == body
+    assert sink.getvalue() == b""
+
+
+def test_fetch_compressed(server_url):
+    before = usbmux.transfer_stats()
+    resp = usbmux.fetch(server_url + "/source")
+    assert resp.json()["value"] == "<XCUIElementTypeApplication/>" * 1000
+    after = usbmux.transfer_stats()
+    assert after["compressed_responses"] - before["compressed_responses"] == 1
+    assert after["wire_bytes"] - before["wire_bytes"] < after["decoded_bytes"] - before["decoded_bytes"]
+
+    # streaming the screenshot value through the decoder
+    sink = io.BytesIO()
+    resp = usbmux.fetch(server_url + "/screenshot", value_sink=sink)
+    assert sink.getvalue() == b"\x89PNG" * 5000
+    assert resp.json()["value"] == ""
+
+    # endpoints not listed are not compressed, the connection is still reusable
+    resp = usbmux.fetch(server_url + "/status")
+    assert resp.json()["value"] == "/status"
+    assert usbmux.transfer_stats()["compressed_responses"] - before["compressed_responses"] == 2
+
+
+@pytest.mark.parametrize("serialize", [False, True])
+def test_httpdo_concurrency(server_url, serialize):
+    import wda
+    start = time.time()
+    with ThreadPoolExecutor(3) as pool:
+        futures = [pool.submit(wda.httpdo, server_url + "/sleep?i=%d" % i, serialize=serialize) for i in range(3)]
+        assert [f.result().value for f in futures] == ["/sleep?i=%d" % i for i in range(3)]
+    elapsed = time.time() - start
+    if serialize:
+        assert elapsed >= 0.9
+    else:
+        assert elapsed < 0.8
+
+
+@pytest.mark.parametrize("protocol", ["PLIST", "BINARY"])
+def test_mock_usbmuxd(server_url, protocol):
+    from wda.testing import MockUsbmuxd
+    from wda.usbmux import pyusbmux
+    from wda.usbmux.exceptions import BadDevError, MuxConnectError
+
+    port = int(server_url.rsplit(":", 1)[1])
+    with MockUsbmuxd(protocol=protocol) as usbmuxd:
+        address = usbmuxd.address
+        device = usbmuxd.add_device("00008030-AAAA", ports={8100: port})
+        other = usbmuxd.add_device("00008030-BBBB")
+        assert sorted(d.serial for d in pyusbmux.list_devices(address)) == ["00008030-AAAA", "00008030-BBBB"]
+
+        mux_device = pyusbmux.MuxDevice(device.device_id, device.serial, "USB")
+        sock = mux_device.connect(8100, usbmux_address=address)
+        sock.sendall(b"GET /status HTTP/1.0\r\n\r\n")
+        with sock.makefile("rb") as f:
+            assert b'"/status"' in f.read()
+        sock.close()
+
+        with pytest.raises(MuxConnectError):
+            mux_device.connect(9100, usbmux_address=address)
+        usbmuxd.remove_device(device.device_id)
+        with pytest.raises(BadDevError):
+            mux_device.connect(8100, usbmux_address=address)
+
+        # Listen: current devices first, then events
+        mux = pyusbmux.create_mux(address)
+        mux.listen()
+        if protocol == "PLIST":
+            assert mux._receive()["DeviceID"] == other.device_id
+            usbmuxd.remove_device(other.device_id)
+            assert mux._receive() == {"MessageType": "Detached", "DeviceID": other.device_id}
+        else:
+            mux._receive_device_state_update()
+            assert [d.devid for d in mux.devices] == [other.device_id]
+            usbmuxd.remove_device(other.device_id)
+            mux._receive_device_state_update()
+            assert mux.devices == []
+        mux.close()
+
+        if protocol == "PLIST":
+            with pyusbmux.create_mux(address) as mux:
+                assert mux.get_buid() == usbmuxd.buid
+        assert usbmuxd.stats["tunnels"] == 1
+
+
+@pytest.mark.parametrize("protocol", ["PLIST", "BINARY"])
+def test_wait_for_device(protocol):
+    from wda.testing import MockUsbmuxd
+    from wda.usbmux import pyusbmux
+
+    with MockUsbmuxd(protocol=protocol) as usbmuxd:
+        threading.Timer(0.2, usbmuxd.add_device, args=("00008030-AAAA",)).start()
+        start = time.monotonic()
+        device = pyusbmux.wait_for_device("00008030AAAA", 3, usbmux_address=usbmuxd.address)
+        assert device.serial == "00008030-AAAA"
+        assert time.monotonic() - start < 1.0
+        assert pyusbmux.wait_for_device("00008030-BBBB", 0.1, usbmux_address=usbmuxd.address) is None
+
+
+def test_usbmuxd_address_change(monkeypatch, tmp_path):
+    from wda.testing import MockUsbmuxd
+    from wda.usbmux import pyusbmux
+
+    monkeypatch.setattr(pyusbmux, "_directories", {})
+    monkeypatch.setattr(pyusbmux, "_protocol_versions", {})
+    with MockUsbmuxd(str(tmp_path / "a"), protocol="BINARY") as a, MockUsbmuxd(str(tmp_path / "b")) as b:
+        a.add_device("00008030-AAAA")
+        b.add_device("00008030-BBBB")
+        monkeypatch.setenv("USBMUXD_SOCKET_ADDRESS", "UNIX:" + a.address)
+        assert pyusbmux.select_device("00008030-AAAA") is not None
+        # the caches are keyed by the resolved address, not by the usbmux_address argument None
+        monkeypatch.setenv("USBMUXD_SOCKET_ADDRESS", "UNIX:" + b.address)
+        assert pyusbmux.select_device("00008030-AAAA") is None
+        assert pyusbmux.select_device("00008030-BBBB") is not None
+        assert pyusbmux.device_directory() is pyusbmux.device_directory(b.address)
+        assert set(pyusbmux._protocol_versions) == {a.address, b.address}
+
+
+def test_prewarm_tunnels(server_url, tmp_path):
+    from wda.testing import MockUsbmuxd
+    from wda.usbmux import prewarm, pyusbmux
+
+    port = int(server_url.rsplit(":", 1)[1])
+    with MockUsbmuxd(str(tmp_path / "usbmuxd")) as usbmuxd:
+        address = usbmuxd.address
+        device = usbmuxd.add_device("00008030-AAAA", ports={8100: port})
+        mux_device = pyusbmux.MuxDevice(device.device_id, device.serial, "USB")
+        prewarmer = prewarm.enable_prewarm(device.serial, 8100, size=2, usbmux_address=address)
+        try:
+            deadline = time.monotonic() + 5
+            while prewarmer.stats.opened < 2 and time.monotonic() < deadline:
+                time.sleep(.02)
+            assert prewarmer.stats.opened == 2
+            assert usbmuxd.stats["tunnels"] == 2
+
+            # another usbmuxd has its own tunnels
+            assert prewarm.take_tunnel(mux_device, 8100, usbmux_address=str(tmp_path / "other")) is None
+            sock = prewarm.take_tunnel(mux_device, 8100, usbmux_address=address)
+            assert sock is not None and prewarmer.stats.taken == 1
+            sock.sendall(b"GET /status HTTP/1.0\r\n\r\n")
+            with sock.makefile("rb") as f:
+                assert b'"/status"' in f.read()
+            sock.close()
+            spare = [s for s, _ in prewarmer._idle]
+            assert spare
+        finally:
+            prewarm.disable_prewarm(device.serial, 8100, usbmux_address=address)
+        assert all(s.fileno() == -1 for s in spare)
+        assert prewarm.take_tunnel(mux_device, 8100, usbmux_address=address) is None
+
+
+def test_wait_ready_usbmux(monkeypatch):
+    import socket
+    import wda
+    from wda.testing import MockUsbmuxd, MockWDAServer
+    from wda.usbmux import pyusbmux
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        wda_port = s.getsockname()[1]
+
+    servers = []
+
+    def _restart_wda():
+        servers.append((time.monotonic(), MockWDAServer(port=wda_port).start()))
+
+    with MockUsbmuxd() as usbmuxd:
+        monkeypatch.setenv("USBMUXD_SOCKET_ADDRESS", "UNIX:" + usbmuxd.address)
+        monkeypatch.setattr(pyusbmux, "_directories", {})
+        monkeypatch.setattr(pyusbmux, "_protocol_versions", {})
+
+        # the device is plugged in first, WDA starts later
+        threading.Timer(0.2, usbmuxd.add_device, args=("00008030-AAAA", {8100: wda_port})).start()
+        threading.Timer(0.5, _restart_wda).start()
+        c = wda.Client("http+usbmux://00008030-AAAA:8100")
+        assert c.wait_ready(timeout=5, noprint=True)
+        started_at, server = servers[0]
+        assert time.monotonic() - started_at < 0.3
+        assert usbmux.probe(c.wda_url)
+        server.stop()
+        usbmux.close_connections(c.wda_url)
+        assert not usbmux.probe(c.wda_url)
+        assert not c.wait_ready(timeout=0.2, noprint=True)
+
+
+def test_wait_ready_without_usbmuxd(monkeypatch, tmp_path):
+    import wda
+    from wda.usbmux import pyusbmux
+
+    monkeypatch.setenv("USBMUXD_SOCKET_ADDRESS", "UNIX:" + str(tmp_path / "no-usbmuxd"))
+    monkeypatch.setattr(pyusbmux, "_directories", {})
+    monkeypatch.setattr(pyusbmux, "_protocol_versions", {})
+    c = wda.Client("http+usbmux://00008030-AAAA:8100")
+    start = time.monotonic()
+    assert not c.wait_ready(timeout=0.3, noprint=True)
+    assert time.monotonic() - start < 1.0
+
+    # starting WDA and waiting for it share one deadline
+    def _start_wda_xctest(udid, wda_bundle_id=None, ready=None, timeout=3.0):
+        time.sleep(timeout)
+        return False
+
+    monkeypatch.setattr(wda, "_start_wda_xctest", _start_wda_xctest)
+    start = time.monotonic()
+    assert not wda._ensure_wda(c, "00008030-AAAA", timeout=0.5, noprint=True)
+    assert time.monotonic() - start < 0.9
+
+
+def test_device_monitor(tmp_path):
+    from wda.testing import MockUsbmuxd
+    from wda.usbmux import pyusbmux
+    from wda.usbmux.monitor import DeviceMonitor
+
+    address = str(tmp_path / "usbmuxd")
+    events = []
+    usbmuxd = MockUsbmuxd(address).start()
+    first = usbmuxd.add_device("00008030-AAAA")
+    monitor = DeviceMonitor(address, reconnect_interval=0.05)
+    monitor.on_attach(lambda d: events.append(("attach", d.serial)))
+    monitor.on_detach(lambda d: events.append(("detach", d.serial)))
+    with monitor:
+        assert monitor.wait_synced(2)
+        assert events == [("attach", "00008030-AAAA")]
+
+        second = usbmuxd.add_device("00008030-BBBB")
+        usbmuxd.remove_device(first.device_id)
+        deadline = time.monotonic() + 2
+        while len(events) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert events[1:] == [("attach", "00008030-BBBB"), ("detach", "00008030-AAAA")]
+
+        # lookups are served by the pinned directory, a miss does not ask usbmuxd
+        directory = pyusbmux.device_directory(address)
+        messages = usbmuxd.stats["messages"]
+        assert directory.lookup("00008030-BBBB").devid == second.device_id
+        assert directory.lookup("00008030-AAAA") is None
+        assert usbmuxd.stats["messages"] == messages
+
+        # usbmuxd restarts without the device, the table is synced again
+        usbmuxd.stop()
+        usbmuxd = MockUsbmuxd(address).start()
+        time.sleep(0.1)
+        assert monitor.wait_synced(2)
+        assert monitor.devices() == []
+        assert events[-1] == ("detach", "00008030-BBBB")
+        assert monitor.stats.connects == 2
+    assert not directory.pinned
+    usbmuxd.stop()
+
+
+def test_start_monitor_address(monkeypatch, tmp_path):
+    from wda.testing import MockUsbmuxd
+    from wda.usbmux import monitor, pyusbmux
+
+    address = str(tmp_path / "usbmuxd")
+    monkeypatch.setattr(pyusbmux, "_directories", {})
+    monkeypatch.setattr(monitor, "_monitors", {})
+    monkeypatch.setenv("USBMUXD_SOCKET_ADDRESS", "UNIX:" + address)
+    with MockUsbmuxd(address) as usbmuxd:
+        m = monitor.start_monitor()
+        try:
+            # the default address and the resolved one are the same monitor
+            assert monitor.start_monitor(address) is m
+            assert m.wait_synced(2)
+
+            # the environment is read once, events still update the directory of the monitor
+            monkeypatch.setenv("USBMUXD_SOCKET_ADDRESS", "UNIX:" + str(tmp_path / "other"))
+            device = usbmuxd.add_device("00008030-AAAA")
+            deadline = time.monotonic() + 2
+            while not m.devices() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert pyusbmux.device_directory(address).lookup("00008030-AAAA").devid == device.device_id
+        finally:
+            monitor.stop_monitor(address)
+        assert monitor._monitors == {}
@@ -0,0 +1,68 @@
+# coding: utf-8
+#
+
+import pytest
+
+import wda
+from wda.testing import MockWDAServer
+from wda.testing import query
+from wda.testing.wdaserver import TEST_BUNDLE_ID
+
+_TREE = {"type": "XCUIElementTypeApplication", "name": "app", "children": [
+    {"type": "XCUIElementTypeButton", "name": "OK", "label": "OK", "children": []},
+    {"type": "XCUIElementTypeOther", "name": "box", "children": [
+        {"type": "XCUIElementTypeButton", "name": "Row1", "enabled": False, "children": []},
+        {"type": "XCUIElementTypeButton", "name": "Row2", "children": []},
+    ]},
+]}
+
+
+def _names(nodes):
+    return [n["name"] for n in nodes]
+
+
+def test_query():
+    root = {"children": [_TREE]}
+    assert _names(query.find(root, "predicate string", "name BEGINSWITH 'Row' AND enabled == true")) == ["Row2"]
+    assert _names(query.find(root, "class chain", "**/XCUIElementTypeButton[`name == 'OK' OR name == 'Row1'`]")) \
+        == ["OK", "Row1"]
+    assert _names(query.find(root, "class chain", "**/XCUIElementTypeOther/XCUIElementTypeButton[-1]")) == ["Row2"]
+    assert _names(query.find(root, "xpath", '//XCUIElementTypeOther/*[@name="Row1"]')) == ["Row1"]
+    with pytest.raises(query.QueryError):
+        query.find(root, "predicate string", "name ~~ 'x'")
+
+
+def test_mock_server_client():
+    with MockWDAServer() as server:
+        c = wda.Client(server.url)
+        assert c.status()["ready"] is True
+        s = c.session(TEST_BUNDLE_ID)
+        assert s.app_current()["bundleId"] == TEST_BUNDLE_ID
+        assert s(text="DISABLED_BTN").enabled is False
+
+        s(text="ACCEPT_OR_REJECT_ALERT").click()
+        assert s.alert.buttons() == ["Reject", "Accept"]
+        s.alert.accept()
+        assert not s.alert.exists
+
+        s(text="ListView").click()
+        assert not s(text="Row30").exists
+        s.swipe(200, 800, 200, 200)
+        assert s(text="Row30").get(timeout=0).displayed
+
+        assert s.screenshot(format="raw").startswith(b"\x89PNG")
+
+
+def test_mock_server_faults():
+    with MockWDAServer() as server:
+        c = wda.Client(server.url)
+        fault = server.add_fault("/wda/locked", "error", times=1, error="unknown error")
+        with pytest.raises(wda.WDAUnknownError):
+            c.locked()
+        assert c.locked() is False
+        assert fault.hits == 1
+
+        server.add_fault("/wda/healthcheck", "status", status=502)
+        with pytest.raises(wda.WDABadGateway):
+            c.healthcheck()
+        assert server.request_count("/wda/healthcheck") == 1
@@ -20,16 +20,15 @@ from collections import defaultdict, namedtuple
 from typing import Callable, Optional, Union
 from urllib.parse import urlparse
 
-import retry
 import six
 from deprecated import deprecated
 
-from wda import xcui_element_types
+from wda import capabilities, metrics, retrying, state, usbmux, xcui_element_types
 from wda._proto import *
 from wda.exceptions import *
 from wda.usbmux import fetch
-from wda.usbmux.pyusbmux import list_devices, select_device
-from wda.utils import inject_call, limit_call_depth, AttrDict, convert
+from wda.usbmux.pyusbmux import device_directory, list_devices, select_device, wait_for_device
+from wda.utils import CompiledCall, compile_call, inject_call, limit_call_depth, AttrDict, convert
 
 
 try:
@@ -51,6 +50,7 @@ except ImportError:
 
 DEBUG = False
 HTTP_TIMEOUT = 180.0  # unit second
+HTTP_MAX_CONCURRENCY = 4  # max requests in flight per device, read when the device is first requested
 DEVICE_WAIT_TIMEOUT = 180.0  # wait ready
 
 LANDSCAPE = 'LANDSCAPE'
@@ -104,21 +104,49 @@ def namedlock(name):
     return namedlock.locks[name]
 
 
-def httpdo(url, method="GET", data=None, timeout=None) -> AttrDict:
+def device_slots(name):
+    """
+    Returns:
+        threading.BoundedSemaphore, limit concurrent requests to the same device
+    """
+    if not hasattr(device_slots, 'slots'):
+        device_slots.slots = {}
+        device_slots.lock = threading.Lock()
+    with device_slots.lock:
+        slots = device_slots.slots.get(name)
+        if slots is None:
+            slots = device_slots.slots[name] = threading.BoundedSemaphore(HTTP_MAX_CONCURRENCY)
+        return slots
+
+
+def httpdo(url, method="GET", data=None, timeout=None, value_sink=None, serialize=False) -> AttrDict:
     """
     thread safe http request
 
+    At most HTTP_MAX_CONCURRENCY requests to the same device are in flight,
+    each of them uses its own keep-alive connection.
+
+    Args:
+        serialize: also hold the device lock, requests with serialize=True never overlap each other
+
     Raises:
         WDAError, WDARequestError, WDAEmptyResponseError
     """
-    p = urlparse(url)
-    with namedlock(p.scheme + "://" + p.netloc):
-        return _unsafe_httpdo(url, method, data, timeout)
+    scheme, _, rest = url.partition("://")
+    name = scheme + "://" + rest.split("/", 1)[0]
+    with device_slots(name):
+        if serialize:
+            with namedlock(name):
+                return _unsafe_httpdo(url, method, data, timeout, value_sink)
+        return _unsafe_httpdo(url, method, data, timeout, value_sink)
 
 
-def _unsafe_httpdo(url: str, method='GET', data=None, timeout=None):
+def _unsafe_httpdo(url: str, method='GET', data=None, timeout=None, value_sink=None):
     """
     Do HTTP Request
+
+    Args:
+        value_sink: file-like object, the base64 value is decoded into it, see wda.usbmux.fetch
     """
     start = time.time()
     if DEBUG:
@@ -128,7 +156,19 @@ def _unsafe_httpdo(url: str, method='GET', data=None, timeout=None):
 
     if timeout is None:
         timeout = HTTP_TIMEOUT
-    response = fetch(url, method, data, timeout)
+    response = fetch(url, method, data, timeout, value_sink=value_sink)
+    metrics.default_registry.add_bytes(method, metrics.route_template(url), response.bytes_sent,
+                                       response.bytes_received)
+    return _handle_response(response, url, method, data, start)
+
+
+def _handle_response(response, url: str, method: str, data, start: float) -> AttrDict:
+    """
+    Convert wda.usbmux.HTTPResponseWrapper to AttrDict, shared by the sync and the asyncio client
+
+    Raises:
+        WDAError, WDARequestError, WDAEmptyResponseError
+    """
     if response.status_code == 502:  # Bad Gateway
         raise WDABadGateway(response.status_code, response.text)
     if DEBUG:
@@ -159,6 +199,12 @@ def _unsafe_httpdo(url: str, method='GET', data=None, timeout=None):
         raise WDAError(method, url, response.text[:100] + "...") # should not too long
 
 
+_Point = namedtuple('Point', ['x', 'y'])
+_Size = namedtuple('Size', ['width', 'height'])
+_HTTPRequest = namedtuple("HTTPRequest", ['fetch', 'get', 'post'])
+_HTTPSessionRequest = namedtuple("HTTPSessionRequest", ['fetch', 'get', 'post', 'delete'])
+
+
 class Rect(list):
     def __init__(self, x, y, width, height):
         super().__init__([x, y, width, height])
@@ -178,12 +224,11 @@ class Rect(list):
 
     @property
     def center(self):
-        return namedtuple('Point', ['x', 'y'])(self.x + self.width // 2,
-                                               self.y + self.height // 2)
+        return _Point(self.x + self.width // 2, self.y + self.height // 2)
 
     @property
     def origin(self):
-        return namedtuple('Point', ['x', 'y'])(self.x, self.y)
+        return _Point(self.x, self.y)
 
     @property
     def left(self):
@@ -202,7 +247,24 @@ class Rect(list):
         return self.y + self.height
 
 
-def _start_wda_xctest(udid: str, wda_bundle_id=None) -> bool:
+def _probe_delays(first: float = 0.01, maximum: float = 0.05):
+    """ exponential schedule of readiness probes, seconds """
+    delay = first
+    while True:
+        yield delay
+        delay = min(delay * 2, maximum)
+
+
+def _start_wda_xctest(udid: str, wda_bundle_id=None, ready: Optional[Callable[[], bool]] = None,
+                      timeout: float = 3.0) -> bool:
+    """
+    Args:
+        ready: returns True when WDA serves requests, checked on an exponential schedule
+        timeout: seconds to wait for ready, without ready the process only has to be alive after it
+
+    Returns:
+        bool
+    """
     xctool_path = shutil.which("tins2") or shutil.which("tidevice")
     if not xctool_path:
         return False
@@ -214,11 +276,60 @@ def _start_wda_xctest(udid: str, wda_bundle_id=None) -> bool:
     if wda_bundle_id:
         args.extend(['-B', wda_bundle_id])
     p = subprocess.Popen([xctool_path] + args)
-    time.sleep(3)
-    if p.poll() is not None:
-        logger.warning("xctest launch failed")
-        return False
-    return True
+    deadline = time.monotonic() + timeout
+    for delay in _probe_delays():
+        if p.poll() is not None:
+            logger.warning("xctest launch failed")
+            return False
+        if ready is not None and ready():
+            return True
+        left = deadline - time.monotonic()
+        if left <= 0:
+            return ready is None
+        time.sleep(min(delay, left))
+
+
+def _ensure_wda(client: "BaseClient", udid: str, wda_bundle_id=None, timeout: float = 20.0,
+                noprint: bool = False) -> bool:
+    """
+    start WDA with tins2 or tidevice when it does not answer
+
+    Returns:
+        bool, WDA is ready
+    """
+    deadline = time.monotonic() + timeout
+    if client._probe_ready():
+        return True
+    if _start_wda_xctest(udid, wda_bundle_id, ready=client._probe_ready, timeout=timeout):
+        return True
+    # one deadline for both waits, not timeout each
+    return client.wait_ready(timeout=max(0.0, deadline - time.monotonic()), noprint=noprint)
+
+
+def _session_payload(bundle_id=None,
+                     arguments: Optional[list] = None,
+                     environment: Optional[dict] = None,
+                     alert_action: Optional[AlertAction] = None) -> dict:
+    """ POST /session payload, see BaseClient.session """
+    capabilities = {}
+    if bundle_id:
+        always_match = {
+            "bundleId": bundle_id,
+            "arguments": arguments or [],
+            "environment": environment or {},
+            "shouldWaitForQuiescence": False,
+        }
+        if alert_action:
+            assert alert_action in ["accept", "dismiss"]
+            capabilities["defaultAlertAction"] = alert_action
+
+        capabilities['alwaysMatch'] = always_match
+
+    return {
+        "capabilities": capabilities,
+        "desiredCapabilities": capabilities.get('alwaysMatch',
+                                                {}),  # 兼容旧版的wda
+    }
 
 
 class BaseClient(object):
@@ -241,6 +352,13 @@ class BaseClient(object):
         self.__callbacks = defaultdict(list)
         self.__callback_depth = 0
         self.__callback_running = False
+        # same signature as httpdo, see wda.replay for a recording and a replaying transport
+        self.transport: Callable[..., AttrDict] = httpdo
+        # backoff, retry budget and circuit breaker (off by default), shared by all clients of the device
+        self.retry_policy: retrying.RetryPolicy = retrying.default_policy
+        # lock state, foreground app, session id and orientation seen in responses, shared with sessions
+        self.state = state.DeviceState()
+        self.__capabilities: Optional[capabilities.Capabilities] = None
 
         if not _session_id:
             self._init_callback()
@@ -292,32 +410,67 @@ class BaseClient(object):
         Returns:
             bool (if wda works)
         """
-        deadline = time.time() + timeout
+        deadline = time.monotonic() + timeout
 
         def _dprint(message: str):
             if noprint:
                 return
             print("facebook-wda", time.ctime(), message)
 
+        udid = None
+        if self.__wda_url.startswith("http+usbmux://"):
+            udid = self.__wda_url.split("://", 1)[1].split(":")[0]
+
         _dprint("Wait ready (timeout={:.1f})".format(timeout))
-        while time.time() < deadline:
-            if self.is_ready():
-                _dprint("device back online")
-                return True
-            else:
-                _dprint("{!r} wait_ready left {:.1f} seconds".format(self.__wda_url, deadline - time.time()))
-                time.sleep(1.0)
-        _dprint("device still offline")
-        return False
+        delays = _probe_delays()
+        next_print = time.monotonic() + 1.0
+        while not self._probe_ready():
+            left = deadline - time.monotonic()
+            if left <= 0:
+                _dprint("device still offline")
+                return False
+            if time.monotonic() >= next_print:
+                next_print = time.monotonic() + 1.0
+                _dprint("{!r} wait_ready left {:.1f} seconds".format(self.__wda_url, left))
+            if udid:
+                try:
+                    if select_device(udid) is None:
+                        # sleep until usbmuxd reports the device attached
+                        wait_for_device(udid, left)
+                        continue
+                except (OSError, usbmux.MuxError):  # usbmuxd is not running, or went away
+                    pass
+            time.sleep(min(next(delays), left))
+        _dprint("device back online")
+        return True
 
-    @retry.retry(exceptions=WDAEmptyResponseError, tries=3, delay=2)
+    def _probe_ready(self) -> bool:
+        """ a cheap connect to the WDA port first, /status only when something listens """
+        if not usbmux.probe(self.__wda_url, timeout=1.0):
+            return False
+        self.retry_policy.breaker(self.__wda_url).reset()
+        return self.is_ready()
+
+    @retrying.retry_on(WDAEmptyResponseError)
     def status(self):
         res = self.http.get('status')
         res["value"]['sessionId'] = res.get("sessionId")
         # Can't use res.value['sessionId'] = ...
         return res.value
 
+    @property
+    def capabilities(self) -> capabilities.Capabilities:
+        """ routes and behaviors supported by the WDA build, see wda.capabilities """
+        if self.__capabilities is None:
+            # the state is shared with the sessions, any /status seen before tells the build
+            build = self.state.peek(state.BUILD)
+            if build is None:
+                build = self.status().get("build") or {}
+            self.__capabilities = capabilities.default_store.load(build, retrying.device_key(self.__wda_url))
+        return self.__capabilities
+
     def register_callback(self, event_name: str, func: Callable, try_first: bool = False):
+        func = compile_call(func)
         if try_first:
             self.__callbacks[event_name].insert(0, func)
         else:
@@ -337,13 +490,16 @@ class BaseClient(object):
     def _run_callback(self, event_name, callbacks,
                       **kwargs) -> Union[None, Callback]:
         """ 运行回调函数 """
-        if not callbacks:
+        fns = callbacks.get(event_name) if callbacks else None
+        if not fns:
             return
 
         self.__callback_running = True
         try:
-            for fn in callbacks[event_name]:
-                ret = inject_call(fn, **kwargs)
+            for fn in fns:
+                if not isinstance(fn, CompiledCall):  # appended to self.callbacks directly
+                    fn = compile_call(fn)
+                ret = fn(**kwargs)
                 if ret in [
                         Callback.RET_RETRY, Callback.RET_ABORT,
                         Callback.RET_CONTINUE
@@ -352,63 +508,104 @@ class BaseClient(object):
         finally:
             self.__callback_running = False
 
+    def _run_fetch_callback(self, event_name, callbacks, method, url, urlpath, with_session, data, **kwargs):
+        """ used by _fetch, which checks callbacks.get(event_name) before """
+        return self._run_callback(event_name,
+                                  callbacks,
+                                  method=method,
+                                  url=url,
+                                  urlpath=urlpath,
+                                  with_session=with_session,
+                                  data=data,
+                                  client=self,
+                                  **kwargs)
+
     @property
     def callbacks(self):
         return self.__callbacks
 
+    @property
+    def wda_url(self) -> str:
+        return self.__wda_url
+
     @limit_call_depth(4)
     def _fetch(self,
                method: str,
                urlpath: str,
                data: Optional[dict] = None,
                with_session: bool = False,
-               timeout: Optional[float] = None) -> AttrDict:
-        """ do http request """
-        urlpath = "/" + urlpath.lstrip("/")  # urlpath always startswith /
+               timeout: Optional[float] = None,
+               value_sink: Optional[io.IOBase] = None,
+               serialize: bool = False) -> AttrDict:
+        """
+        do http request
 
-        callbacks = self.__callbacks
+        Args:
+            serialize: requests to the device with serialize=True are sent one by one, see httpdo
+        """
+        urlpath = "/" + urlpath.lstrip("/")  # urlpath always startswith /
 
-        if self.__callback_running:
-            callbacks = None
+        # each event is looked up on its own, every Client has an ERROR callback
+        callbacks = {} if self.__callback_running else self.__callbacks
 
         url = urljoin(self.__wda_url, urlpath)
+        request_url = url
 
-        run_callback = functools.partial(self._run_callback,
-                                         callbacks=callbacks,
-                                         method=method,
-                                         url=url,
-                                         urlpath=urlpath,
-                                         with_session=with_session,
-                                         data=data,
-                                         client=self)
-
+        route = metrics.route_template("/session/:sid" + urlpath if with_session else urlpath)
         try:
             if with_session:
-                url = urljoin(self.__wda_url, "session", self.session_id,
-                              urlpath)
-            run_callback(Callback.HTTP_REQUEST_BEFORE)
-            response = httpdo(url, method, data, timeout)
-            run_callback(Callback.HTTP_REQUEST_AFTER, response=response)
+                request_url = urljoin(self.__wda_url, "session", self.session_id,
+                                      urlpath)
+            if callbacks.get(Callback.HTTP_REQUEST_BEFORE):
+                self._run_fetch_callback(Callback.HTTP_REQUEST_BEFORE, callbacks, method, url, urlpath,
+                                         with_session, data)
+            breaker = self.retry_policy.breaker(self.__wda_url)
+            breaker.before_request()
+            start = time.perf_counter()
+            try:
+                response = self.transport(request_url, method, data, timeout, value_sink, serialize)
+            except Exception as err:
+                metrics.default_registry.observe_request(method, route, time.perf_counter() - start, err)
+                breaker.record_failure(err)
+                if isinstance(err, WDAInvalidSessionIdError):
+                    self.state.invalidate(state.SESSION_ID)
+                raise
+            metrics.default_registry.observe_request(method, route, time.perf_counter() - start)
+            breaker.record_success()
+            self.state.observe(method.upper(), route, data, response)
+            if callbacks.get(Callback.HTTP_REQUEST_AFTER):
+                self._run_fetch_callback(Callback.HTTP_REQUEST_AFTER, callbacks, method, url, urlpath,
+                                         with_session, data, response=response)
             return response
         except Exception as err:
-            ret = run_callback(Callback.ERROR, err=err)
+            ret = None
+            if callbacks.get(Callback.ERROR):
+                ret = self._run_fetch_callback(Callback.ERROR, callbacks, method, url, urlpath,
+                                               with_session, data, err=err)
             if ret == Callback.RET_RETRY:
-                return self._fetch(method, urlpath, data, with_session)
+                if not self.retry_policy.allow_retry(self.__wda_url, "_fetch"):
+                    raise
+                metrics.default_registry.inc_retry(method, route)
+                if value_sink is not None and value_sink.seekable():
+                    # drop what the failed request has written
+                    value_sink.seek(0)
+                    value_sink.truncate()
+                return self._fetch(method, urlpath, data, with_session, timeout, value_sink, serialize)
             elif ret == Callback.RET_CONTINUE:
                 return
             else:
                 raise
 
-    @property
+    @cached_property
     def http(self):
-        return namedtuple("HTTPRequest", ['fetch', 'get', 'post'])(
+        return _HTTPRequest(
             self._fetch,
             functools.partial(self._fetch, "GET"),
             functools.partial(self._fetch, "POST"))  # yapf: disable
 
-    @property
+    @cached_property
     def _session_http(self):
-        return namedtuple("HTTPSessionRequest", ['fetch', 'get', 'post', 'delete'])(
+        return _HTTPSessionRequest(
             functools.partial(self._fetch, with_session=True),
             functools.partial(self._fetch, "GET", with_session=True),
             functools.partial(self._fetch, "POST", with_session=True),
@@ -442,7 +639,7 @@ class BaseClient(object):
         """ same as time.sleep """
         time.sleep(secs)
 
-    @retry.retry(WDAUnknownError, tries=3, delay=.5, jitter=.2)
+    @retrying.retry_on(WDAUnknownError)
     def app_current(self) -> dict:
         """
         Returns:
@@ -477,21 +674,23 @@ class BaseClient(object):
         Raises:
             WDARequestError
         """
-        value = self.http.get('screenshot').value
-        raw_value = base64.b64decode(value)
+        # png is decoded while receiving, the base64 json is never held in memory as a whole
+        buff = io.BytesIO()
+        self.http.get('screenshot', value_sink=buff)
         png_header = b"\x89PNG\r\n\x1a\n"
-        if not raw_value.startswith(png_header) and png_filename:
-            raise WDARequestError(-1, "screenshot png format error")
+        with buff.getbuffer() as raw_value:  # released on errors too, else buff can not be resized
+            if raw_value[:len(png_header)] != png_header and png_filename:
+                raise WDARequestError(-1, "screenshot png format error")
 
-        if png_filename:
-            with open(png_filename, 'wb') as f:
-                f.write(raw_value)
+            if png_filename:
+                with open(png_filename, 'wb') as f:
+                    f.write(raw_value)
 
         if format == 'raw':
-            return raw_value
+            return buff.getvalue()
         elif format == 'pillow':
             from PIL import Image
-            buff = io.BytesIO(raw_value)
+            buff.seek(0)
             im = Image.open(buff)
             return im.convert("RGB") # convert to RGB to fix save jpeg error
         else:
@@ -552,31 +751,13 @@ class BaseClient(object):
         #     if session_id:
         #         return self
 
-        capabilities = {}
-        if bundle_id:
-            always_match = {
-                "bundleId": bundle_id,
-                "arguments": arguments or [],
-                "environment": environment or {},
-                "shouldWaitForQuiescence": False,
-            }
-            if alert_action:
-                assert alert_action in ["accept", "dismiss"]
-                capabilities["defaultAlertAction"] = alert_action
-
-            capabilities['alwaysMatch'] = always_match
-
-        payload = {
-            "capabilities": capabilities,
-            "desiredCapabilities": capabilities.get('alwaysMatch',
-                                                    {}),  # 兼容旧版的wda
-        }
+        payload = _session_payload(bundle_id, arguments, environment, alert_action)
 
         # when device is Locked, it is unable to start app
-        if self.locked():
+        if self.state.get(state.LOCKED, self.locked):
             self.unlock()
         try:
-            res = self.http.post('session', payload)
+            res = self.http.post('session', payload, serialize=True)
         except WDAEmptyResponseError:
             """ when there is alert, might be got empty response
             use /wda/apps/state may still get sessionId
@@ -587,6 +768,10 @@ class BaseClient(object):
         client = Client(self.__wda_url, _session_id=res.sessionId)
         client.__timeout = self.__timeout
         client.__callbacks = self.__callbacks
+        client.transport = self.transport
+        client.retry_policy = self.retry_policy
+        client.state = self.state
+        client.__capabilities = self.__capabilities
         return client
 
 
@@ -625,7 +810,7 @@ class BaseClient(object):
     def session_id(self) -> str:
         if self.__session_id:
             return self.__session_id
-        current_sid = self.status()['sessionId']
+        current_sid = self.state.get(state.SESSION_ID, lambda: self.status()['sessionId'])
         if current_sid:
             self.__session_id = current_sid  # store old session id to reduce request count
             return current_sid
@@ -638,21 +823,29 @@ class BaseClient(object):
     def _get_session_id(self) -> str:
         return self.session_id
 
-    @cached_property
+    @property
     def scale(self) -> int:
         """
-        UIKit scale factor
+        UIKit scale factor, cached until a new session is created
 
         Refs:
             https://developer.apple.com/library/archive/documentation/DeviceInformation/Reference/iOSDeviceCompatibility/Displays/Displays.html
         There is another way to get scale
             self._session_http.get("/wda/screen").value returns {"statusBarSize": {'width': 320, 'height': 20}, 'scale': 2}
         """
-        try:
-            return self._session_http.get("/wda/screen").value['scale']
-        except (KeyError, WDARequestError):
-            v = max(self.screenshot().size) / max(self.window_size())
-            return round(v)
+        return self.state.get(state.SCALE, self._scale)
+
+    def _scale(self) -> int:
+        if self.capabilities.get(capabilities.SCREEN) is not False:
+            try:
+                scale = self._session_http.get("/wda/screen").value['scale']
+                self.capabilities.set(capabilities.SCREEN, True)
+                return scale
+            except (KeyError, WDARequestError) as e:
+                if isinstance(e, KeyError) or capabilities.is_unsupported(e):
+                    self.capabilities.set(capabilities.SCREEN, False)
+        v = max(self.screenshot().size) / max(self.window_size())
+        return round(v)
 
     @cached_property
     def bundle_id(self):
@@ -676,10 +869,10 @@ class BaseClient(object):
 
     def device_info(self):
         """
-        Returns dict:
+        Returns dict, cached until a new session is created:
             eg: {'currentLocale': 'zh_CN', 'timeZone': 'Asia/Shanghai'}
         """
-        return self._session_http.get("/wda/device/info").value
+        return self.state.get(state.DEVICE_INFO, lambda: self._session_http.get("/wda/device/info").value)
 
     @property
     def info(self):
@@ -761,7 +954,7 @@ class BaseClient(object):
         assert isinstance(environment, dict)
 
         # When device is locked, it is unable to launch
-        if self.locked():
+        if self.state.get(state.LOCKED, self.locked):
             self.unlock()
 
         return self._session_http.post(
@@ -770,18 +963,18 @@ class BaseClient(object):
                 "arguments": arguments,
                 "environment": environment,
                 "shouldWaitForQuiescence": wait_for_quiescence,
-            })
+            }, serialize=True)
 
     def app_activate(self, bundle_id):
         return self._session_http.post("/wda/apps/launch", {
             "bundleId": bundle_id,
-        })
+        }, serialize=True)
 
     def app_terminate(self, bundle_id):
         # Deprecated, use app_stop instead
         return self._session_http.post("/wda/apps/terminate", {
             "bundleId": bundle_id,
-        })
+        }, serialize=True)
 
     def app_state(self, bundle_id):
         """
@@ -847,10 +1040,21 @@ class BaseClient(object):
     def tap(self, x, y):
         # Support WDA `BREAKING CHANGES`
         # More see: https://github.com/appium/WebDriverAgent/blob/master/CHANGELOG.md#600-2024-01-31
+        cached = self.capabilities.get(capabilities.TAP)
+        route = cached or '/wda/tap'
         try:
-            return self._session_http.post('/wda/tap', dict(x=x, y=y))
-        except:
-            return self._session_http.post('/wda/tap/0', dict(x=x, y=y))
+            ret = self._session_http.post(route, dict(x=x, y=y))
+        except Exception as e:
+            if cached and not capabilities.is_unsupported(e):
+                raise
+            # WDA was replaced by another version without changing its build info
+            other = '/wda/tap/0' if route == '/wda/tap' else '/wda/tap'
+            ret = self._session_http.post(other, dict(x=x, y=y))
+            if capabilities.is_unsupported(e):
+                self.capabilities.set(capabilities.TAP, other)
+            return ret
+        self.capabilities.set(capabilities.TAP, route)
+        return ret
 
     def _percent2pos(self, x, y, window_size=None):
         if any(isinstance(v, float) for v in [x, y]):
@@ -951,6 +1155,11 @@ class BaseClient(object):
         Return string
         One of <PORTRAIT | LANDSCAPE>
         """
+        result = self.state.peek(state.ORIENTATION)
+        if result:
+            self.state.record_hit(state.ORIENTATION)
+            return result
+        self.state.record_miss(state.ORIENTATION)
         for _ in range(3):
             result = self._session_http.get('orientation').value
             if result:
@@ -969,10 +1178,15 @@ class BaseClient(object):
 
     def window_size(self):
         """
+        Cached until the orientation or the app changes, or a new session is created
+
         Returns:
             namedtuple: eg
                 Size(width=320, height=568)
         """
+        return self.state.get(state.WINDOW_SIZE, self._window_size)
+
+    def _window_size(self):
         size = self._unsafe_window_size()
         if min(size) > 0:
             return size
@@ -1000,9 +1214,9 @@ class BaseClient(object):
         value = self._session_http.get('/window/size').value
         w = roundint(value['width'])
         h = roundint(value['height'])
-        return namedtuple('Size', ['width', 'height'])(w, h)
+        return _Size(w, h)
 
-    @retry.retry(WDAKeyboardNotPresentError, tries=3, delay=1.0)
+    @retrying.retry_on(WDAKeyboardNotPresentError)
     def send_keys(self, value):
         """
         send keys, yet I know not, todo function
@@ -1231,6 +1445,8 @@ Session = Client  # for compability
 
 
 class Selector(object):
+    _session_type = Session
+
     def __init__(self,
                  session: Session,
                  predicate=None,
@@ -1308,7 +1524,7 @@ class Selector(object):
             wdValue,
             wdVisible
         '''
-        assert isinstance(session, Session)
+        assert isinstance(session, self._session_type)
         self._session = session
 
         self._predicate = predicate
@@ -1418,7 +1634,7 @@ class Selector(object):
             chain = chain + '[%d]' % self._index
         return chain
 
-    @retry.retry(WDAStaleElementReferenceError, tries=3, delay=.5, jitter=.2)
+    @retrying.retry_on(WDAStaleElementReferenceError)
     def find_element_ids(self):
         elems = []
         if self._id:
@@ -1767,7 +1983,7 @@ class USBClient(Client):
 
     def __init__(self, udid: str = "", port: int = 8100, wda_bundle_id=None):
         if not udid:
-            infos = [info for info in list_devices() if info.connection_type == 'USB']
+            infos = [info for info in device_directory().devices() if info.connection_type == 'USB']
             if len(infos) == 0:
                 raise RuntimeError("no device connected")
             elif len(infos) >= 2:
@@ -1775,9 +1991,5 @@ class USBClient(Client):
             udid = infos[0].serial
 
         super().__init__(url=f"http+usbmux://{udid}:{port}")
-        if self.is_ready():
-            return
-
-        _start_wda_xctest(udid, wda_bundle_id)
-        if not self.wait_ready(timeout=20):
+        if not _ensure_wda(self, udid, wda_bundle_id, timeout=20):
             raise RuntimeError("wda xctest launched but check failed")
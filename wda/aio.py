@@ -0,0 +1,937 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+asyncio client of WebDriverAgent
+
+Usage:
+    import asyncio
+    from wda.aio import AsyncClient
+
+    async def main():
+        c = AsyncClient("http+usbmux://00008030-xxxx:8100")
+        print(await c.status())
+        s = await c.session("com.apple.Preferences")
+        await s(text="蓝牙").click()
+        el = await s(text="通用").get()
+        print(await el.bounds)
+
+    asyncio.run(main())
+
+Methods which send requests are coroutines. Properties which send requests
+(eg: Element.label, Selector.exists, Alert.text) return awaitables.
+A single event loop can drive many devices, no thread or lock per device is needed.
+"""
+
+import asyncio
+import base64
+import contextlib
+import functools
+import io
+import json
+import os
+import re
+import time
+from collections import namedtuple
+from typing import Optional, Union
+
+import six
+
+import wda
+from wda import capabilities
+from wda import AlertAction, Element, Rect, Selector, _handle_response, _session_payload, logger, metrics, roundint, urljoin
+from wda.exceptions import *
+from wda.usbmux.aio import fetch
+from wda.utils import AttrDict
+
+_HTTPRequest = namedtuple("AsyncHTTPRequest", ['fetch', 'get', 'post'])
+_HTTPSessionRequest = namedtuple("AsyncHTTPSessionRequest", ['fetch', 'get', 'post', 'delete'])
+_Size = namedtuple('Size', ['width', 'height'])
+
+
+async def httpdo(url: str, method="GET", data=None, timeout=None) -> AttrDict:
+    """
+    asyncio version of wda.httpdo, requests to the same device are not serialized
+
+    Raises:
+        WDAError, WDARequestError, WDAEmptyResponseError
+    """
+    start = time.time()
+    if wda.DEBUG:
+        body = json.dumps(data) if data else ''
+        print("Shell$ curl -X {method} -d '{body}' '{url}'".format(
+            method=method.upper(), body=body or '', url=url))
+    if timeout is None:
+        timeout = wda.HTTP_TIMEOUT
+    response = await fetch(url, method, data, timeout)
+    metrics.default_registry.add_bytes(method, metrics.route_template(url), response.bytes_sent,
+                                       response.bytes_received)
+    return _handle_response(response, url, method, data, start)
+
+
+class AsyncBaseClient(object):
+    def __init__(self, url=None, _session_id=None):
+        """
+        Args:
+            url (string): the device url, same as wda.Client
+        """
+        if not url:
+            url = os.environ.get('DEVICE_URL', 'http://localhost:8100')
+        assert re.match(r"^(http\+usbmux|https?)://", url), "Invalid URL: %r" % url
+
+        self.__wda_url = url
+        self.__session_id = _session_id
+        self.__timeout = 30.0
+        self.__scale = None
+
+        self.http = _HTTPRequest(
+            self._fetch,
+            functools.partial(self._fetch, "GET"),
+            functools.partial(self._fetch, "POST"))  # yapf: disable
+        self._session_http = _HTTPSessionRequest(
+            functools.partial(self._fetch, with_session=True),
+            functools.partial(self._fetch, "GET", with_session=True),
+            functools.partial(self._fetch, "POST", with_session=True),
+            functools.partial(self._fetch, "DELETE", with_session=True))  # yapf: disable
+
+    async def _fetch(self,
+                     method: str,
+                     urlpath: str,
+                     data: Optional[dict] = None,
+                     with_session: bool = False,
+                     timeout: Optional[float] = None) -> AttrDict:
+        """ do http request, renew session id once when it is invalid """
+        urlpath = "/" + urlpath.lstrip("/")  # urlpath always startswith /
+        route = metrics.route_template("/session/:sid" + urlpath if with_session else urlpath)
+        for renew in (True, False):
+            if with_session:
+                url = urljoin(self.__wda_url, "session", await self.get_session_id(), urlpath)
+            else:
+                url = urljoin(self.__wda_url, urlpath)
+            start = time.perf_counter()
+            try:
+                response = await httpdo(url, method, data, timeout)
+                metrics.default_registry.observe_request(method, route, time.perf_counter() - start)
+                return response
+            except Exception as err:
+                metrics.default_registry.observe_request(method, route, time.perf_counter() - start, err)
+                if not (with_session and renew) or not isinstance(err, (WDAInvalidSessionIdError,
+                                                                         WDAPossiblyCrashedError)):
+                    raise
+                metrics.default_registry.inc_retry(method, route)
+                if isinstance(err, WDAInvalidSessionIdError):
+                    self.__session_id = None
+                else:
+                    self.__session_id = await (await self.session()).get_session_id()
+
+    async def is_ready(self) -> bool:
+        try:
+            await self.http.get("status", timeout=3)
+            return True
+        except Exception:
+            return False
+
+    async def wait_ready(self, timeout=120, noprint=False) -> bool:
+        """
+        wait until WDA back to normal
+
+        Returns:
+            bool (if wda works)
+        """
+        deadline = time.time() + timeout
+
+        def _dprint(message: str):
+            if noprint:
+                return
+            print("facebook-wda", time.ctime(), message)
+
+        _dprint("Wait ready (timeout={:.1f})".format(timeout))
+        while time.time() < deadline:
+            if await self.is_ready():
+                _dprint("device back online")
+                return True
+            _dprint("{!r} wait_ready left {:.1f} seconds".format(self.__wda_url, deadline - time.time()))
+            await asyncio.sleep(1.0)
+        _dprint("device still offline")
+        return False
+
+    async def status(self):
+        for tries_left in range(2, -1, -1):
+            try:
+                res = await self.http.get('status')
+                break
+            except WDAEmptyResponseError:
+                if not tries_left:
+                    raise
+                await asyncio.sleep(2)
+        res["value"]['sessionId'] = res.get("sessionId")
+        return res.value
+
+    async def home(self):
+        """Press home button"""
+        try:
+            await self.http.post('/wda/homescreen')
+        except WDARequestError as e:
+            if "Timeout waiting until SpringBoard is visible" in str(e):
+                return
+            raise
+
+    async def healthcheck(self):
+        """Hit healthcheck"""
+        return await self.http.get('/wda/healthcheck')
+
+    async def locked(self) -> bool:
+        """ returns locked status, true or false """
+        return (await self.http.get("/wda/locked")).value
+
+    async def lock(self):
+        return await self.http.post('/wda/lock')
+
+    async def unlock(self):
+        """ unlock screen, double press home """
+        return await self.http.post('/wda/unlock')
+
+    async def sleep(self, secs: float):
+        """ same as asyncio.sleep """
+        await asyncio.sleep(secs)
+
+    async def app_current(self) -> dict:
+        for tries_left in range(2, -1, -1):
+            try:
+                return (await self.http.get("/wda/activeAppInfo")).value
+            except WDAUnknownError:
+                if not tries_left:
+                    raise
+                await asyncio.sleep(.5)
+
+    async def source(self, format='xml', accessible=False):
+        """
+        Args:
+            format (str): only 'xml' and 'json' source types are supported
+            accessible (bool): when set to true, format is always 'json'
+        """
+        if accessible:
+            return (await self.http.get('/wda/accessibleSource')).value
+        return (await self.http.get('source?format=' + format)).value
+
+    async def screenshot(self, png_filename=None, format='pillow'):
+        """
+        Screenshot with PNG format, same as wda.Client.screenshot
+
+        Returns:
+            PIL.Image or raw png data
+        """
+        value = (await self.http.get('screenshot')).value
+        raw_value = base64.b64decode(value)
+        png_header = b"\x89PNG\r\n\x1a\n"
+        if not raw_value.startswith(png_header) and png_filename:
+            raise WDARequestError(-1, "screenshot png format error")
+
+        if png_filename:
+            with open(png_filename, 'wb') as f:
+                f.write(raw_value)
+
+        if format == 'raw':
+            return raw_value
+        elif format == 'pillow':
+            from PIL import Image
+            im = Image.open(io.BytesIO(raw_value))
+            return im.convert("RGB")
+        else:
+            raise ValueError("unknown format")
+
+    async def session(self,
+                      bundle_id=None,
+                      arguments: Optional[list] = None,
+                      environment: Optional[dict] = None,
+                      alert_action: Optional[AlertAction] = None) -> "AsyncClient":
+        """
+        Launch app in a session, see wda.Client.session
+        """
+        payload = _session_payload(bundle_id, arguments, environment, alert_action)
+
+        # when device is Locked, it is unable to start app
+        if await self.locked():
+            await self.unlock()
+        try:
+            res = await self.http.post('session', payload)
+        except WDAEmptyResponseError:
+            res = await (await self.session()).app_state(bundle_id)
+            if res.value != 4:
+                raise
+        client = AsyncClient(self.__wda_url, _session_id=res.sessionId)
+        client.__timeout = self.__timeout
+        return client
+
+    async def close(self):
+        '''Close created session which session id saved in class ctx.'''
+        try:
+            return await self._session_http.delete('/')
+        except WDARequestError as e:
+            if not isinstance(e, (WDAInvalidSessionIdError, WDAPossiblyCrashedError)):
+                raise
+
+    async def __aenter__(self):
+        """
+        Usage example:
+            async with await c.session("com.example.app") as app:
+                # do something
+        """
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def get_session_id(self) -> str:
+        if self.__session_id:
+            return self.__session_id
+        current_sid = (await self.status())['sessionId']
+        if current_sid:
+            self.__session_id = current_sid  # store old session id to reduce request count
+            return current_sid
+        return await (await self.session()).get_session_id()
+
+    def set_session_id(self, value):
+        self.__session_id = value
+
+    async def scale(self) -> int:
+        """ UIKit scale factor, cached after the first call """
+        if self.__scale is None:
+            try:
+                self.__scale = (await self._session_http.get("/wda/screen")).value['scale']
+            except (KeyError, WDARequestError):
+                v = max((await self.screenshot()).size) / max(await self.window_size())
+                self.__scale = round(v)
+        return self.__scale
+
+    async def bundle_id(self):
+        """ the session matched bundle id """
+        v = (await self._session_http.get("/")).value
+        return v['capabilities'].get('CFBundleIdentifier')
+
+    def implicitly_wait(self, seconds):
+        """
+        set default element search timeout
+        """
+        assert isinstance(seconds, (int, float))
+        self.__timeout = seconds
+
+    async def battery_info(self):
+        return (await self._session_http.get("/wda/batteryInfo")).value
+
+    async def device_info(self):
+        return (await self._session_http.get("/wda/device/info")).value
+
+    @property
+    def info(self):
+        return self.device_info()
+
+    async def set_clipboard(self, content, content_type="plaintext"):
+        """ set clipboard """
+        await self._session_http.post(
+            "/wda/setPasteboard", {
+                "content": base64.b64encode(content.encode()).decode(),
+                "contentType": content_type
+            })
+
+    async def app_launch(self,
+                         bundle_id,
+                         arguments=[],
+                         environment={},
+                         wait_for_quiescence=False):
+        assert isinstance(arguments, (tuple, list))
+        assert isinstance(environment, dict)
+
+        # When device is locked, it is unable to launch
+        if await self.locked():
+            await self.unlock()
+
+        return await self._session_http.post(
+            "/wda/apps/launch", {
+                "bundleId": bundle_id,
+                "arguments": arguments,
+                "environment": environment,
+                "shouldWaitForQuiescence": wait_for_quiescence,
+            })
+
+    async def app_activate(self, bundle_id):
+        return await self._session_http.post("/wda/apps/launch", {
+            "bundleId": bundle_id,
+        })
+
+    async def app_terminate(self, bundle_id):
+        return await self._session_http.post("/wda/apps/terminate", {
+            "bundleId": bundle_id,
+        })
+
+    async def app_state(self, bundle_id):
+        return await self._session_http.post("/wda/apps/state", {
+            "bundleId": bundle_id,
+        })
+
+    async def app_start(self,
+                        bundle_id,
+                        arguments=[],
+                        environment={},
+                        wait_for_quiescence=False):
+        """ alias for app_launch """
+        return await self.app_launch(bundle_id, arguments, environment,
+                                     wait_for_quiescence)
+
+    async def app_stop(self, bundle_id: str):
+        """ alias for app_terminate """
+        await self.app_terminate(bundle_id)
+
+    async def app_list(self):
+        return (await self._session_http.get("/wda/apps/list")).value
+
+    async def open_url(self, url):
+        if os.getenv("TMQ_ORIGIN") == "civita": # MDS platform
+            return await self.http.post("/mds/openurl", {"url": url})
+        return await self._session_http.post('url', {'url': url})
+
+    async def deactivate(self, duration):
+        return await self._session_http.post('/wda/deactivateApp',
+                                             dict(duration=duration))
+
+    async def tap(self, x, y):
+        # Support WDA `BREAKING CHANGES`, see wda.Client.tap
+        try:
+            return await self._session_http.post('/wda/tap', dict(x=x, y=y))
+        except WDARequestError as e:
+            if not capabilities.is_unsupported(e):
+                raise
+            return await self._session_http.post('/wda/tap/0', dict(x=x, y=y))
+
+    async def _percent2pos(self, x, y, window_size=None):
+        if any(isinstance(v, float) for v in [x, y]):
+            w, h = window_size or await self.window_size()
+            x = int(x * w) if isinstance(x, float) else x
+            y = int(y * h) if isinstance(y, float) else y
+            assert w >= x >= 0
+            assert h >= y >= 0
+        return (x, y)
+
+    async def click(self, x, y, duration: Optional[float] = None):
+        """
+        Combine tap and tap_hold
+
+        Args:
+            x, y: can be float(percent) or int
+            duration (optional): tap_hold duration
+        """
+        x, y = await self._percent2pos(x, y)
+        if duration:
+            return await self.tap_hold(x, y, duration)
+        return await self.tap(x, y)
+
+    async def double_tap(self, x, y):
+        x, y = await self._percent2pos(x, y)
+        return await self._session_http.post('/wda/doubleTap', dict(x=x, y=y))
+
+    async def tap_hold(self, x, y, duration=1.0):
+        x, y = await self._percent2pos(x, y)
+        data = {'x': x, 'y': y, 'duration': duration}
+        return await self._session_http.post('/wda/touchAndHold', data=data)
+
+    async def swipe(self, x1, y1, x2, y2, duration=0):
+        if any(isinstance(v, float) for v in [x1, y1, x2, y2]):
+            size = await self.window_size()
+            x1, y1 = await self._percent2pos(x1, y1, size)
+            x2, y2 = await self._percent2pos(x2, y2, size)
+
+        data = dict(fromX=x1, fromY=y1, toX=x2, toY=y2, duration=duration)
+        return await self._session_http.post('/wda/dragfromtoforduration', data=data)
+
+    async def _fast_swipe(self, x1, y1, x2, y2, velocity: int = 500):
+        data = dict(fromX=x1, fromY=y1, toX=x2, toY=y2, velocity=velocity)
+        return await self._session_http.post('/wda/drag', data=data)
+
+    async def swipe_left(self):
+        """ swipe right to left """
+        w, h = await self.window_size()
+        return await self.swipe(w, h // 2, 1, h // 2)
+
+    async def swipe_right(self):
+        """ swipe left to right """
+        w, h = await self.window_size()
+        return await self.swipe(1, h // 2, w, h // 2)
+
+    async def swipe_up(self):
+        """ swipe from center to top """
+        w, h = await self.window_size()
+        return await self.swipe(w // 2, h // 2, w // 2, 1)
+
+    async def swipe_down(self):
+        """ swipe from center to bottom """
+        w, h = await self.window_size()
+        return await self.swipe(w // 2, h // 2, w // 2, h - 1)
+
+    @property
+    def orientation(self):
+        """
+        Awaitable, returns one of <PORTRAIT | LANDSCAPE>
+        """
+        return self._get_orientation()
+
+    async def _get_orientation(self):
+        for _ in range(3):
+            result = (await self._session_http.get('orientation')).value
+            if result:
+                return result
+            await asyncio.sleep(.5)
+
+    async def set_orientation(self, value):
+        """
+        Args:
+            - orientation(string): LANDSCAPE | PORTRAIT | UIA_DEVICE_ORIENTATION_LANDSCAPERIGHT |
+                    UIA_DEVICE_ORIENTATION_PORTRAIT_UPSIDEDOWN
+        """
+        return await self._session_http.post('orientation',
+                                             data={'orientation': value})
+
+    async def window_size(self):
+        """
+        Returns:
+            namedtuple: eg
+                Size(width=320, height=568)
+        """
+        size = await self._unsafe_window_size()
+        if min(size) > 0:
+            return size
+
+        # get orientation, handle alert
+        await self.orientation
+        alert = AsyncAlert(self)
+        if await alert.exists:
+            await alert.accept()
+            await asyncio.sleep(.1)
+
+        size = await self._unsafe_window_size()
+        if min(size) > 0:
+            return size
+
+        logger.warning("unable to get window_size(), try to to create a new session")
+        async with await self.session("com.apple.Preferences") as app:
+            size = await app._unsafe_window_size()
+            assert min(size) > 0, "unable to get window_size"
+            return size
+
+    async def _unsafe_window_size(self):
+        value = (await self._session_http.get('/window/size')).value
+        return _Size(roundint(value['width']), roundint(value['height']))
+
+    async def send_keys(self, value):
+        if isinstance(value, six.string_types):
+            value = list(value)
+        for tries_left in range(2, -1, -1):
+            try:
+                return await self._session_http.post('/wda/keys', data={'value': value})
+            except WDAKeyboardNotPresentError:
+                if not tries_left:
+                    raise
+                await asyncio.sleep(1.0)
+
+    async def press(self, name: str):
+        """
+        Args:
+            name: one of <home|volumeUp|volumeDown>
+        """
+        valid_names = ("home", "volumeUp", "volumeDown")
+        if name not in valid_names:
+            raise ValueError(
+                f"Invalid name: {name}, should be one of {valid_names}")
+        await self._session_http.post("/wda/pressButton", {"name": name})
+
+    async def press_duration(self, name: str, duration: float):
+        """ see wda.Client.press_duration """
+        hid_usages = {
+            "home": 0x40,
+            "volumeup": 0xE9,
+            "volumedown": 0xEA,
+            "power": 0x30,
+            "snapshot": 0x65,
+            "power+home": 0x65
+        }
+        name = name.lower()
+        if name not in hid_usages:
+            raise ValueError("Invalid name:", name)
+        hid_usage = hid_usages[name]
+        return await self._session_http.post("/wda/performIoHidEvent",
+                                             {"page": 0x0C, "usage": hid_usage, "duration": duration})
+
+    async def appium_settings(self, value: Optional[dict] = None) -> dict:
+        """
+        Get and set /session/$sessionId/appium/settings
+        """
+        if value is None:
+            return (await self._session_http.get("/appium/settings")).value
+        return (await self._session_http.post("/appium/settings",
+                                              data={"settings": value})).value
+
+    def xpath(self, value):
+        return AsyncSelector(self, xpath=value)
+
+    def __call__(self, *args, **kwargs):
+        if 'timeout' not in kwargs:
+            kwargs['timeout'] = self.__timeout
+        return AsyncSelector(self, *args, **kwargs)
+
+
+class AsyncAlert(object):
+    DEFAULT_ACCEPT_BUTTONS = wda.Alert.DEFAULT_ACCEPT_BUTTONS
+
+    def __init__(self, client: AsyncBaseClient):
+        self._c = client
+        self.http = client._session_http
+
+    @property
+    def exists(self):
+        """ awaitable bool """
+        return self._exists()
+
+    async def _exists(self) -> bool:
+        try:
+            await self.text
+            return True
+        except WDARequestError:
+            return False
+
+    @property
+    def text(self):
+        """ awaitable str """
+        return self._text()
+
+    async def _text(self):
+        return (await self.http.get('/alert/text')).value
+
+    async def set_text(self, text: str):
+        return await self.http.post('/alert/text', data={'value': text})
+
+    async def wait(self, timeout=20.0):
+        start_time = time.time()
+        while time.time() - start_time < timeout:
+            if await self.exists:
+                return True
+            await asyncio.sleep(0.2)
+        return False
+
+    async def accept(self):
+        return await self.http.post('/alert/accept')
+
+    async def dismiss(self):
+        return await self.http.post('/alert/dismiss')
+
+    async def buttons(self):
+        return (await self.http.get('/wda/alert/buttons')).value
+
+    async def click(self, button_name: Optional[Union[str, list]] = None):
+        """
+        Returns:
+            button_name being clicked
+
+        Raises:
+            ValueError when button_name is not in avaliable button names
+        """
+        if isinstance(button_name, str):
+            await self.http.post('/alert/accept', data={"name": button_name})
+            return button_name
+
+        avaliable_names = await self.buttons()
+        for bname in button_name:
+            if bname in avaliable_names:
+                return await self.click(bname)
+        raise ValueError("Only these buttons can be clicked", avaliable_names)
+
+    async def click_exists(self, buttons: Optional[Union[str, list]] = None):
+        try:
+            return await self.click(buttons)
+        except (ValueError, WDARequestError):
+            return None
+
+    @contextlib.asynccontextmanager
+    async def watch_and_click(self,
+                              buttons: Optional[list] = None,
+                              interval: float = 2.0):
+        """ watch and click button in a background task
+        Args:
+            buttons: buttons name which need to click
+            interval: check interval
+        """
+        if not buttons:
+            buttons = self.DEFAULT_ACCEPT_BUTTONS
+
+        async def _inner():
+            while True:
+                try:
+                    alert_buttons = await self.buttons()
+                    logger.info("Alert detected, buttons: %s", alert_buttons)
+                    for btn_name in buttons:
+                        if btn_name in alert_buttons:
+                            logger.info("Alert click: %s", btn_name)
+                            await self.click(btn_name)
+                            break
+                    else:
+                        logger.warning("Alert not handled")
+                except WDARequestError:
+                    pass
+                await asyncio.sleep(interval)
+
+        task = asyncio.ensure_future(_inner())
+        try:
+            yield None
+        finally:
+            task.cancel()
+
+
+class AsyncClient(AsyncBaseClient):
+    @property
+    def alert(self) -> AsyncAlert:
+        return AsyncAlert(self)
+
+
+AsyncSession = AsyncClient
+
+
+class AsyncSelector(Selector):
+    """
+    Same query arguments as wda.Selector, methods which send requests are coroutines
+
+    Only the query building of wda.Selector is inherited, every method which sends a request is
+    overridden here (checked by tests/test_aio.py), set_timeout() and [index] are synchronous
+    """
+    _session_type = AsyncBaseClient
+
+    async def _wdasearch(self, using, value):
+        element_ids = []
+        for v in (await self.http.post('/elements', {
+                'using': using,
+                'value': value
+        })).value:
+            element_ids.append(v['ELEMENT'])
+        return element_ids
+
+    async def find_element_ids(self):
+        for tries_left in range(2, -1, -1):
+            try:
+                return await self._find_element_ids()
+            except WDAStaleElementReferenceError:
+                if not tries_left:
+                    raise
+                await asyncio.sleep(.5)
+
+    async def _find_element_ids(self):
+        if self._id:
+            return await self._wdasearch('id', self._id)
+        if self._predicate:
+            return await self._wdasearch('predicate string', self._predicate)
+        if self._xpath:
+            return await self._wdasearch('xpath', self._xpath)
+        if self._class_chain:
+            return await self._wdasearch('class chain', self._class_chain)
+
+        chain = '**' + ''.join(
+            self._parent_class_chains) + self._gen_class_chain()
+        return await self._wdasearch('class chain', chain)
+
+    async def find_elements(self):
+        """
+        Returns:
+            AsyncElement (list): all the elements
+        """
+        return [AsyncElement(self._session, element_id) for element_id in await self.find_element_ids()]
+
+    async def count(self):
+        return len(await self.find_element_ids())
+
+    async def get(self, timeout=None, raise_error=True):
+        """
+        Returns:
+            AsyncElement: UI Element
+
+        Raises:
+            WDAElementNotFoundError if raise_error is True else None
+        """
+        start_time = time.time()
+        if timeout is None:
+            timeout = self._timeout
+        while True:
+            elems = await self.find_elements()
+            if len(elems) > 0:
+                return elems[0]
+            if start_time + timeout < time.time():
+                break
+            await asyncio.sleep(0.5)
+
+        if raise_error:
+            raise WDAElementNotFoundError("element not found",
+                                          "timeout %.1f" % timeout)
+
+    def __getattr__(self, oper):
+        raise AttributeError("%r object has no attribute %r, use (await selector.get()).%s instead"
+                             % (type(self).__name__, oper, oper))
+
+    def child(self, *args, **kwargs):
+        chain = self._gen_class_chain()
+        kwargs['parent_class_chains'] = self._parent_class_chains + [chain]
+        return AsyncSelector(self._session, *args, **kwargs)
+
+    @property
+    def exists(self):
+        """ awaitable bool """
+        return self._exists()
+
+    async def _exists(self) -> bool:
+        return len(await self.find_element_ids()) > self._index
+
+    async def click(self, timeout: Optional[float] = None):
+        e = await self.get(timeout=timeout)
+        await e.click()
+
+    async def click_exists(self, timeout=0):
+        e = await self.get(timeout=timeout, raise_error=False)
+        if e is None:
+            return False
+        await e.click()
+        return True
+
+    async def wait(self, timeout=None, raise_error=False):
+        return await self.get(timeout=timeout, raise_error=raise_error)
+
+    async def wait_gone(self, timeout=None, raise_error=True):
+        start_time = time.time()
+        if timeout is None or timeout <= 0:
+            timeout = self._timeout
+        while start_time + timeout > time.time():
+            if not await self.exists:
+                return True
+        if not raise_error:
+            return False
+        raise WDAElementNotDisappearError("element not gone")
+
+
+class AsyncElement(Element):
+    """
+    Properties (label, text, value, bounds ...) return awaitables
+
+    Every method of wda.Element which sends a request is overridden here (checked by tests/test_aio.py)
+    """
+
+    def __repr__(self):
+        return '<wda.aio.AsyncElement(id="{}")>'.format(self._id)
+
+    async def _req(self, method, url, data=None):
+        return await self.http.fetch(method, '/element/' + self._id + url, data)
+
+    async def _wda_req(self, method, url, data=None):
+        return await self.http.fetch(method, '/wda/element/' + self._id + url, data)
+
+    async def _prop(self, key):
+        return (await self._req('GET', '/' + key.lstrip('/'))).value
+
+    async def _wda_prop(self, key):
+        return (await self.http.get('/wda/element/%s/%s' % (self._id, key))).value
+
+    @property
+    def info(self):
+        return self._info()
+
+    async def _info(self):
+        keys = ["label", "value", "text", "name", "className", "enabled", "displayed",
+                "visible", "accessible", "accessibility_container"]
+        values = await asyncio.gather(*[getattr(self, key) for key in keys])
+        info = dict(zip(keys, values))
+        info["accessibilityContainer"] = info.pop("accessibility_container")
+        info["id"] = self._id
+        return info
+
+    @property
+    def label(self):
+        return self._prop('attribute/label')
+
+    @property
+    def className(self):
+        return self._prop('attribute/type')
+
+    @property
+    def text(self):
+        return self._prop('text')
+
+    @property
+    def name(self):
+        return self._prop('name')
+
+    @property
+    def displayed(self):
+        return self._prop('displayed')
+
+    @property
+    def enabled(self):
+        return self._prop('enabled')
+
+    @property
+    def accessible(self):
+        return self._wda_prop('accessible')
+
+    @property
+    def accessibility_container(self):
+        return self._wda_prop('accessibilityContainer')
+
+    @property
+    def value(self):
+        return self._prop('attribute/value')
+
+    @property
+    def visible(self):
+        return self._prop('attribute/visible')
+
+    @property
+    def bounds(self):
+        """ awaitable Rect """
+        return self._bounds()
+
+    async def _bounds(self) -> Rect:
+        value = await self._prop('rect')
+        x, y = value['x'], value['y']
+        w, h = value['width'], value['height']
+        return Rect(x, y, w, h)
+
+    async def tap(self):
+        return await self._req('post', '/click')
+
+    async def click(self):
+        """
+        Get element center position and do click
+        """
+        x, y = (await self.bounds).center
+        await self._session.click(x, y)
+
+    async def tap_hold(self, duration=1.0):
+        return await self._wda_req('post', '/touchAndHold', {'duration': duration})
+
+    async def scroll(self, direction='visible', distance=1.0):
+        if direction == 'visible':
+            await self._wda_req('post', '/scroll', {'toVisible': True})
+        elif direction in ['up', 'down', 'left', 'right']:
+            await self._wda_req('post', '/scroll', {
+                'direction': direction,
+                'distance': distance
+            })
+        else:
+            raise ValueError("Invalid direction")
+        return self
+
+    async def pickerwheel_select(self):
+        raise NotImplementedError()
+
+    async def pinch(self, scale, velocity):
+        return await self._wda_req('post', '/pinch', {'scale': scale, 'velocity': velocity})
+
+    async def set_text(self, value):
+        return await self._req('post', '/value', {'value': value})
+
+    async def clear_text(self):
+        return await self._req('post', '/clear')
+
+    async def selected(self):
+        return (await self._req('GET', '/selected')).value
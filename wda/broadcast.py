@@ -0,0 +1,212 @@
+# coding: utf-8
+#
+"""
+Send the same request to many devices at the same moment
+
+A serial loop over clients lets the devices drift apart by the sum of the round trips.
+Here every device gets its own thread, which resolves the session id and the coordinates,
+encodes the request and opens the connection first. Then all threads wait behind a
+threading.Barrier and only write the prepared bytes when it is released.
+
+Callbacks of the clients are not run for broadcast requests, retries neither. Like any other
+request, a broadcast one takes a slot of wda.device_slots from the prepare phase to its response.
+
+Usage:
+    from wda.broadcast import Broadcaster
+
+    b = Broadcaster([wda.Client(url) for url in urls])
+    b.warmup()
+    r = b.tap(0.5, 0.5)
+    print("dispatch spread %.1fms" % (r.spread * 1000))
+    pngs = b.screenshot().values
+"""
+
+import base64
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from wda import BaseClient, _handle_response, capabilities, device_slots, logger, metrics, retrying, urljoin
+from wda.usbmux import PreparedRequest
+
+Prepare = Callable[[BaseClient], tuple]  # client -> (method, urlpath, data)
+
+
+@dataclass
+class Dispatch:
+    url: str  # wda url of the client
+    value: Any = None
+    error: Optional[BaseException] = None
+    sent_at: Optional[float] = None  # time.perf_counter() when the request was written
+    elapsed: float = 0.0  # seconds from sent_at to the response
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class BroadcastResult:
+    dispatches: List[Dispatch] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return all(d.ok for d in self.dispatches)
+
+    @property
+    def values(self) -> List[Any]:
+        return [d.value for d in self.dispatches]
+
+    @property
+    def spread(self) -> float:
+        """ seconds between the first and the last request written """
+        sent = [d.sent_at for d in self.dispatches if d.sent_at is not None]
+        return max(sent) - min(sent) if sent else 0.0
+
+    @property
+    def offsets(self) -> Dict[str, float]:
+        """ seconds each request was written after the first one """
+        sent = [d.sent_at for d in self.dispatches if d.sent_at is not None]
+        first = min(sent) if sent else 0.0
+        return {d.url: d.sent_at - first for d in self.dispatches if d.sent_at is not None}
+
+
+class Broadcaster:
+    def __init__(self, clients: Iterable[BaseClient], timeout: float = 10.0):
+        """
+        Args:
+            clients: one client per device
+            timeout: seconds for preparing, and for every response
+        """
+        self.clients = list(clients)
+        self.timeout = timeout
+
+    def warmup(self):
+        """ create the sessions and open a keep-alive connection to every device """
+        def _warmup(client: BaseClient):
+            try:
+                client.session_id
+                client.status()
+            except Exception as e:
+                logger.warning("warmup %s: %s", client.wda_url, e)
+        self._parallel(_warmup, self.clients)
+
+    @staticmethod
+    def _parallel(fn: Callable, args: Iterable):
+        threads = [threading.Thread(target=fn, args=(arg,), name="wda-broadcast", daemon=True) for arg in args]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def broadcast(self, prepare: Prepare, with_session: bool = True) -> BroadcastResult:
+        """
+        Args:
+            prepare: called with every client before the barrier, returns (method, urlpath, data)
+            with_session: urlpath is relative to /session/:sid
+
+        Returns:
+            BroadcastResult, dispatches are in the order of clients
+        """
+        result = BroadcastResult([Dispatch(c.wda_url) for c in self.clients])
+        barrier = threading.Barrier(len(self.clients))
+
+        def _worker(index: int):
+            client = self.clients[index]
+            dispatch = result.dispatches[index]
+            request = None
+            slots = device_slots(retrying.device_key(client.wda_url))
+            slot_taken = False
+            try:
+                method, urlpath, data = prepare(client)
+                url = urljoin(client.wda_url, "session", client.session_id, urlpath) if with_session \
+                    else urljoin(client.wda_url, urlpath)
+                route = metrics.route_template("/session/:sid/" + urlpath.lstrip("/") if with_session else urlpath)
+                client.retry_policy.breaker(client.wda_url).before_request()
+                # taken after prepare(), which may send requests itself
+                slot_taken = slots.acquire(timeout=self.timeout)
+                if not slot_taken:
+                    raise TimeoutError("no free request slot of %s" % client.wda_url)
+                request = PreparedRequest(url, method, data, timeout=self.timeout)
+            except Exception as e:
+                dispatch.error = e
+            try:
+                try:
+                    barrier.wait(self.timeout)
+                except threading.BrokenBarrierError as e:
+                    dispatch.error = dispatch.error or e
+                if dispatch.error is not None:
+                    if request is not None:
+                        request.close()
+                    return
+                self._dispatch(client, request, dispatch, method, url, data, route)
+            finally:
+                if slot_taken:
+                    slots.release()
+
+        self._parallel(_worker, range(len(self.clients)))
+        return result
+
+    @staticmethod
+    def _dispatch(client: BaseClient, request: PreparedRequest, dispatch: Dispatch, method: str, url: str, data,
+                  route: str):
+        """ write the prepared request and read its response """
+        breaker = client.retry_policy.breaker(client.wda_url)
+        try:
+            request.send()
+            dispatch.sent_at = request.sent_at
+            response = request.response()
+            dispatch.elapsed = time.perf_counter() - request.sent_at
+            metrics.default_registry.add_bytes(method, route, response.bytes_sent, response.bytes_received)
+            dispatch.value = _handle_response(response, url, method, data, request.sent_at)
+        except Exception as e:
+            dispatch.error = e
+            breaker.record_failure(e)
+        else:
+            breaker.record_success()
+        metrics.default_registry.observe_request(method, route, time.perf_counter() - request.sent_at,
+                                                 dispatch.error)
+
+    def tap(self, x, y) -> BroadcastResult:
+        """
+        Args:
+            x, y: float(percent) or int, percents are converted with the window size of each device
+        """
+        def prepare(client: BaseClient):
+            px, py = client._percent2pos(x, y)
+            return "POST", client.capabilities.get(capabilities.TAP) or "/wda/tap", dict(x=px, y=py)
+
+        result = self.broadcast(prepare)
+        # WDA 6.0.0 renamed /wda/tap/0 to /wda/tap, an older WDA gets the tap a bit later, only the first time
+        failed = []
+        for i, d in enumerate(result.dispatches):
+            caps = self.clients[i].capabilities
+            route = caps.get(capabilities.TAP)
+            if d.ok:
+                if route is None:
+                    caps.set(capabilities.TAP, "/wda/tap")
+            elif capabilities.is_unsupported(d.error):
+                caps.set(capabilities.TAP, "/wda/tap" if route == "/wda/tap/0" else "/wda/tap/0")
+                failed.append(i)
+        if failed:
+            retry = Broadcaster([self.clients[i] for i in failed], self.timeout).broadcast(prepare)
+            for i, dispatch in zip(failed, retry.dispatches):
+                result.dispatches[i] = dispatch
+        return result
+
+    def swipe(self, x1, y1, x2, y2, duration: float = 0) -> BroadcastResult:
+        def prepare(client: BaseClient):
+            size = client.window_size()
+            fx, fy = client._percent2pos(x1, y1, size)
+            tx, ty = client._percent2pos(x2, y2, size)
+            return "POST", "/wda/dragfromtoforduration", dict(fromX=fx, fromY=fy, toX=tx, toY=ty, duration=duration)
+        return self.broadcast(prepare)
+
+    def screenshot(self) -> BroadcastResult:
+        """ values are png bytes """
+        result = self.broadcast(lambda client: ("GET", "/screenshot", None), with_session=False)
+        for d in result.dispatches:
+            if d.ok:
+                d.value = base64.b64decode(d.value.value)
+        return result
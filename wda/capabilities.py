@@ -0,0 +1,136 @@
+# coding: utf-8
+#
+"""
+What a WDA build supports, learned once and persisted per build and device
+
+A table is keyed by the "build" of /status and the device url (scheme://netloc), and saved
+as json in ~/.cache/facebook-wda/capabilities/ (or $WDA_CACHE_DIR/capabilities/), so a new
+process routes directly instead of paying the failed request of a fallback again.
+The device is part of the key because a WDA may report no build at all, and a
+forwarded port (eg: http://localhost:8100) can reach another device next time.
+A cached route answered with "unknown command" is probed again.
+
+Capabilities:
+- tap: "/wda/tap" (WDA >= 6.0.0) or "/wda/tap/0"
+- screen: whether GET /session/:sid/wda/screen is supported, otherwise scale is
+  computed from a screenshot
+
+Usage:
+    c = wda.Client()
+    print(c.capabilities.as_dict())  # {'tap': '/wda/tap', 'screen': True}
+    c.capabilities.clear()  # probe again, eg: after WDA is rebuilt without changing its build info
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+TAP = "tap"
+SCREEN = "screen"
+
+
+def cache_dir() -> str:
+    return os.environ.get("WDA_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "facebook-wda")
+
+
+def build_key(build: dict, device: str = "") -> str:
+    """ stable id of a WDA build on a device """
+    raw = json.dumps({"build": build or {}, "device": device}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def is_unsupported(err: BaseException) -> bool:
+    """ WDA answered "unknown command", the route does not exist in this build """
+    value = getattr(err, "value", None)
+    return isinstance(value, dict) and value.get("error") == "unknown command"
+
+
+class Capabilities:
+    def __init__(self, build: dict, path: Optional[str] = None, values: Optional[Dict[str, Any]] = None,
+                 device: str = ""):
+        """
+        Args:
+            build: "build" of /status
+            path: json file, None means not persisted
+            device: device url, scheme://netloc
+        """
+        self.build = dict(build or {})
+        self.device = device
+        self.path = path
+        self._values: Dict[str, Any] = dict(values or {})
+        self._lock = threading.Lock()
+
+    def get(self, name: str, default=None):
+        return self._values.get(name, default)
+
+    def set(self, name: str, value):
+        """ record a capability, saved when it changed """
+        with self._lock:
+            if self._values.get(name, object()) == value:
+                return
+            self._values[name] = value
+        self.save()
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+        self.save()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(self._values)
+
+    def save(self):
+        if not self.path:
+            return
+        data = {"build": self.build, "device": self.device, "capabilities": self.as_dict()}
+        tmp = "%s.%d.tmp" % (self.path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)  # other processes never read half a file
+        except OSError as e:
+            logger.warning("save capabilities %s: %s", self.path, e)
+
+
+class CapabilityStore:
+    def __init__(self, directory: Optional[str] = None):
+        """
+        Args:
+            directory: default is capabilities/ in cache_dir(), resolved on every load
+        """
+        self.directory = directory
+        self._tables: Dict[str, Capabilities] = {}
+        self._lock = threading.Lock()
+
+    def load(self, build: dict, device: str = "") -> Capabilities:
+        """ table of a build on a device, shared by all clients of the process """
+        directory = self.directory or os.path.join(cache_dir(), "capabilities")
+        path = os.path.join(directory, build_key(build, device) + ".json")
+        with self._lock:
+            table = self._tables.get(path)
+            if table is not None:
+                return table
+            values = {}
+            try:
+                with open(path, encoding="utf-8") as f:
+                    values = json.load(f).get("capabilities") or {}
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                logger.warning("load capabilities %s: %s", path, e)
+            table = self._tables[path] = Capabilities(build, path, values, device)
+            return table
+
+    def clear(self):
+        """ forget the tables loaded in memory, files are kept """
+        with self._lock:
+            self._tables.clear()
+
+
+default_store = CapabilityStore()
@@ -36,6 +36,14 @@ class WDAElementNotDisappearError(WDAError):
     """ element not disappera """
 
 
+class WDACircuitOpenError(WDAError):
+    """ WDA is known to be down, the request is not sent, see wda.retrying.CircuitBreaker """
+
+
+class WDAReplayError(WDAError):
+    """ request not found in the replayed trace, see wda.replay """
+
+
 class WDARequestError(WDAError):
     def __init__(self, status, value):
         self.status = status
@@ -0,0 +1,154 @@
+# coding: utf-8
+#
+"""
+Bootstrap WDA on many devices at once and run the same work on all of them
+
+Usage:
+    from wda.fleet import DeviceFleet
+
+    with DeviceFleet(max_workers=16) as fleet:
+        for udid, r in fleet.bootstrap().items():  # every USB device from list_devices()
+            print(udid, "ready" if r.ok else r.error)
+        results = fleet.run(lambda c: c.app_current())
+        results = fleet.run_command(["tidevice", "-u", "{udid}", "info"])
+"""
+
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from wda import Client, _ensure_wda
+from wda.usbmux.pyusbmux import device_directory
+
+
+@dataclass
+class FleetResult:
+    udid: str
+    value: Any = None
+    error: Optional[BaseException] = None
+    elapsed: float = 0.0  # seconds
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class DeviceFleet:
+    def __init__(self,
+                 udids: Optional[Iterable[str]] = None,
+                 port: int = 8100,
+                 wda_bundle_id: Optional[str] = None,
+                 max_workers: int = 16,
+                 ready_timeout: float = 20.0,
+                 connection_type: Optional[str] = "USB",
+                 usbmux_address: Optional[str] = None):
+        """
+        Args:
+            udids: devices to manage, default every device of list_devices() with connection_type
+            port: WDA port on device
+            wda_bundle_id: passed to tins2/tidevice xctest when WDA has to be started
+            max_workers: devices bootstrapped or driven at the same time
+            ready_timeout: seconds to wait for WDA of one device
+            connection_type: USB, Network or None for both
+        """
+        self.port = port
+        self.wda_bundle_id = wda_bundle_id
+        self.ready_timeout = ready_timeout
+        self.connection_type = connection_type
+        self._usbmux_address = usbmux_address
+        self._udids = list(udids) if udids is not None else None
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="wda-fleet")
+        self._lock = threading.Lock()
+        self.clients: Dict[str, Client] = {}
+
+    def discover(self) -> List[str]:
+        """ udids of attached devices, a device connected by USB and network is listed once """
+        udids = []
+        for device in device_directory(self._usbmux_address).devices(refresh=True):
+            if self.connection_type is not None and device.connection_type != self.connection_type:
+                continue
+            if device.serial not in udids:
+                udids.append(device.serial)
+        return udids
+
+    @property
+    def udids(self) -> List[str]:
+        if self._udids is None:
+            self._udids = self.discover()
+        return self._udids
+
+    def _bootstrap_one(self, udid: str) -> Client:
+        client = Client(f"http+usbmux://{udid}:{self.port}")
+        if not _ensure_wda(client, udid, self.wda_bundle_id, timeout=self.ready_timeout, noprint=True):
+            raise RuntimeError("WDA of %s is not ready in %.1f seconds" % (udid, self.ready_timeout))
+        with self._lock:
+            self.clients[udid] = client
+        return client
+
+    def _map(self, fn: Callable[[str], Any], udids: Iterable[str], timeout: Optional[float]) -> Dict[str, FleetResult]:
+        def _call(udid: str) -> FleetResult:
+            start = time.monotonic()
+            result = FleetResult(udid)
+            try:
+                result.value = fn(udid)
+            except Exception as e:
+                result.error = e
+            result.elapsed = time.monotonic() - start
+            return result
+
+        futures = {udid: self._executor.submit(_call, udid) for udid in udids}
+        deadline = None if timeout is None else time.monotonic() + timeout
+        results = {}
+        for udid, future in futures.items():
+            try:
+                left = None if deadline is None else max(0.0, deadline - time.monotonic())
+                results[udid] = future.result(left)
+            except Exception as e:  # timeout, the work keeps running in the pool
+                results[udid] = FleetResult(udid, error=e, elapsed=timeout)
+        return results
+
+    def bootstrap(self, timeout: Optional[float] = None) -> Dict[str, FleetResult]:
+        """
+        Make WDA ready on every device in parallel, value of a result is the Client
+
+        Returns:
+            {udid: FleetResult}
+        """
+        return self._map(self._bootstrap_one, self.udids, timeout)
+
+    def run(self, fn: Callable[[Client], Any], timeout: Optional[float] = None) -> Dict[str, FleetResult]:
+        """
+        Call fn(client) for every bootstrapped device in parallel
+
+        Returns:
+            {udid: FleetResult}, value is what fn returns
+        """
+        with self._lock:
+            clients = dict(self.clients)
+        return self._map(lambda udid: fn(clients[udid]), clients, timeout)
+
+    def run_command(self, args: List[str], timeout: Optional[float] = None) -> Dict[str, FleetResult]:
+        """
+        Run a command for every bootstrapped device, "{udid}" in args is replaced
+
+        Returns:
+            {udid: FleetResult}, value is subprocess.CompletedProcess
+        """
+        def _run(udid: str):
+            return subprocess.run([arg.replace("{udid}", udid) for arg in args], capture_output=True, text=True,
+                                  timeout=timeout, check=True)
+        with self._lock:
+            udids = list(self.clients)
+        return self._map(_run, udids, None)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
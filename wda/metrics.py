@@ -0,0 +1,256 @@
+# coding: utf-8
+#
+"""
+Request metrics: latency histograms per route, errors, retries and body bytes
+
+Session and element ids are replaced in routes, eg:
+    /session/6DB1C8F2-.../element/5A000000-.../rect -> /session/:sid/element/:id/rect
+
+Usage:
+    import wda.metrics
+    print(wda.metrics.render())  # Prometheus text format
+    wda.metrics.dump("/tmp/wda.prom")  # for node_exporter textfile collector
+    wda.metrics.serve(9100)  # GET http://127.0.0.1:9100/metrics
+"""
+
+import bisect
+import functools
+import os
+import re
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_ID_SEGMENT = re.compile(r"/(session|element)/[^/]+")
+_ID_NAMES = {"session": "/session/:sid", "element": "/element/:id"}
+
+
+@functools.lru_cache(maxsize=1024)
+def route_template(urlpath: str) -> str:
+    """
+    Args:
+        urlpath: path or full url, query string is dropped
+
+    Returns:
+        path with session and element ids normalized out
+    """
+    if "://" in urlpath:
+        urlpath = "/" + urlpath.split("://", 1)[1].partition("/")[2]
+    urlpath = urlpath.split("?", 1)[0]
+    if "/session/" not in urlpath and "/element/" not in urlpath:
+        return urlpath
+    return _ID_SEGMENT.sub(lambda m: _ID_NAMES[m.group(1)], urlpath)
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """ yield (le, count) pairs as Prometheus expects """
+        total = 0
+        for le, n in zip(self.buckets + (float("inf"),), self.counts):
+            total += n
+            yield le, total
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**kwargs) -> str:
+    return ",".join('{}="{}"'.format(k, _escape(str(v))) for k, v in kwargs.items())
+
+
+def _format_le(le: float) -> str:
+    return "+Inf" if le == float("inf") else repr(float(le))
+
+
+class MetricsRegistry:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.enabled = True
+        self._buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._latency: Dict[Tuple[str, str], Histogram] = {}
+            self._errors: Dict[Tuple[str, str, str], int] = defaultdict(int)
+            self._retries: Dict[Tuple[str, str], int] = defaultdict(int)
+            self._bytes_sent: Dict[Tuple[str, str], int] = defaultdict(int)
+            self._bytes_received: Dict[Tuple[str, str], int] = defaultdict(int)
+            self._policy_retries: Dict[Tuple[str, str], int] = defaultdict(int)
+            self._retries_rejected: Dict[Tuple[str, str], int] = defaultdict(int)
+            self._circuit_opened: Dict[str, int] = defaultdict(int)
+
+    def observe_request(self, method: str, route: str, seconds: float, error: Optional[BaseException] = None):
+        """
+        Args:
+            route: returned by route_template
+            error: the exception raised by the request if any
+        """
+        if not self.enabled:
+            return
+        key = (method, route)
+        with self._lock:
+            hist = self._latency.get(key)
+            if hist is None:
+                hist = self._latency[key] = Histogram(self._buckets)
+            hist.observe(seconds)
+            if error is not None:
+                self._errors[(method, route, type(error).__name__)] += 1
+
+    def add_bytes(self, method: str, route: str, sent: int, received: int):
+        if not self.enabled:
+            return
+        key = (method, route)
+        with self._lock:
+            self._bytes_sent[key] += sent
+            self._bytes_received[key] += received
+
+    def inc_retry(self, method: str, route: str):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._retries[(method, route)] += 1
+
+    def inc_policy_retry(self, operation: str, error: str):
+        """ retry made by wda.retrying, eg operation="status", error="WDAEmptyResponseError" """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._policy_retries[(operation, error)] += 1
+
+    def inc_retry_rejected(self, operation: str, reason: str):
+        """ retry not made, reason is budget or circuit """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._retries_rejected[(operation, reason)] += 1
+
+    def inc_circuit_open(self, device: str):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._circuit_opened[device] += 1
+
+    def histogram(self, method: str, route: str) -> Optional[Histogram]:
+        with self._lock:
+            return self._latency.get((method, route))
+
+    def errors(self) -> Dict[str, int]:
+        """ error count by exception class name """
+        result = defaultdict(int)
+        with self._lock:
+            for (_, _, name), n in self._errors.items():
+                result[name] += n
+        return dict(result)
+
+    def render(self) -> str:
+        """
+        Returns:
+            metrics in Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            lines.append("# HELP wda_request_duration_seconds WDA request latency")
+            lines.append("# TYPE wda_request_duration_seconds histogram")
+            for (method, route), hist in sorted(self._latency.items()):
+                for le, n in hist.cumulative():
+                    lines.append("wda_request_duration_seconds_bucket{%s} %d" % (
+                        _labels(method=method, route=route, le=_format_le(le)), n))
+                labels = _labels(method=method, route=route)
+                lines.append("wda_request_duration_seconds_sum{%s} %r" % (labels, hist.sum))
+                lines.append("wda_request_duration_seconds_count{%s} %d" % (labels, hist.count))
+
+            lines.append("# HELP wda_request_errors_total WDA request errors by exception class")
+            lines.append("# TYPE wda_request_errors_total counter")
+            for (method, route, name), n in sorted(self._errors.items()):
+                lines.append("wda_request_errors_total{%s} %d" % (_labels(method=method, route=route, error=name), n))
+
+            for name, help, values in (
+                    ("wda_request_retries_total", "WDA request retries", self._retries),
+                    ("wda_request_sent_bytes_total", "WDA request body bytes sent", self._bytes_sent),
+                    ("wda_response_received_bytes_total", "WDA response body bytes received", self._bytes_received)):
+                lines.append("# HELP {} {}".format(name, help))
+                lines.append("# TYPE {} counter".format(name))
+                for (method, route), n in sorted(values.items()):
+                    lines.append("%s{%s} %d" % (name, _labels(method=method, route=route), n))
+
+            for name, help, label_names, values in (
+                    ("wda_policy_retries_total", "Retries made by the retry policy", ("operation", "error"),
+                     self._policy_retries),
+                    ("wda_retries_rejected_total", "Retries refused by the retry budget or the circuit breaker",
+                     ("operation", "reason"), self._retries_rejected),
+                    ("wda_circuit_opened_total", "Times the circuit breaker of a device opened", ("device",),
+                     {(k,): v for k, v in self._circuit_opened.items()})):
+                lines.append("# HELP {} {}".format(name, help))
+                lines.append("# TYPE {} counter".format(name))
+                for key, n in sorted(values.items()):
+                    lines.append("%s{%s} %d" % (name, _labels(**dict(zip(label_names, key))), n))
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str):
+        """ write metrics to file atomically, the file can be scraped by node_exporter textfile collector """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def serve(self, port: int = 9100, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """
+        Serve GET /metrics in a daemon thread
+
+        Returns:
+            the server, call shutdown() to stop it
+        """
+        registry = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), _Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="wda-metrics", daemon=True).start()
+        return server
+
+
+default_registry = MetricsRegistry()
+
+
+def render() -> str:
+    return default_registry.render()
+
+
+def dump(path: str):
+    default_registry.dump(path)
+
+
+def serve(port: int = 9100, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    return default_registry.serve(port, host)
@@ -0,0 +1,230 @@
+# coding: utf-8
+#
+"""
+Record and replay the requests of a client, replay needs no device
+
+A trace is gzipped json lines, the first line is a header, then one line per request
+    {"method": "POST", "route": "/session/:sid/wda/tap", "path": "/session/6DB1.../wda/tap",
+     "data": {"x": 100, "y": 200}, "status": 0, "response": {...}, "error": None,
+     "sink": None, "elapsed": 0.132}
+
+error is {"type": "WDAStaleElementReferenceError", "args": [...]} when the request raised,
+sink is the base64 of the bytes written to value_sink (eg: screenshot).
+
+Usage:
+    c = wda.Client()
+    with wda.replay.Recorder("run.jsonl.gz") as recorder:
+        c.transport = recorder
+        s = c.session("com.apple.Preferences")
+        s(text="General").click()
+
+    # same calls again, answered from the trace, speed=0 means no waiting at all
+    c = wda.Client()
+    c.transport = wda.replay.Replayer("run.jsonl.gz", speed=0)
+"""
+
+import base64
+import gzip
+import io
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, Iterator, List, Tuple
+
+from wda import exceptions, httpdo
+from wda.exceptions import WDAError, WDAReplayError
+from wda.metrics import route_template
+from wda.usbmux import exceptions as usbmux_exceptions
+from wda.utils import AttrDict, convert
+
+TRACE_VERSION = 1
+
+
+def _request_key(method: str, url: str, data) -> Tuple[str, str, str]:
+    body = json.dumps(data, sort_keys=True, separators=(",", ":")) if data else ""
+    return method.upper(), route_template(url), body
+
+
+def _url_path(url: str) -> str:
+    if "://" in url:
+        url = "/" + url.split("://", 1)[1].partition("/")[2]
+    return url
+
+
+def _jsonable(v):
+    try:
+        json.dumps(v)
+        return v
+    except (TypeError, ValueError):
+        return str(v)
+
+
+def _dump_error(err: Exception) -> dict:
+    return {"type": type(err).__name__, "args": [_jsonable(a) for a in err.args]}
+
+
+def _load_error(error: dict) -> Exception:
+    cls = getattr(exceptions, error["type"], None) or getattr(usbmux_exceptions, error["type"], None)
+    if not (isinstance(cls, type) and issubclass(cls, Exception)):
+        return WDAError(error["type"], *error["args"])
+    try:
+        return cls(*error["args"])
+    except TypeError:
+        return WDAError(error["type"], *error["args"])
+
+
+class _TeeSink:
+    """ copy of everything written to value_sink """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.copy = io.BytesIO()
+
+    def write(self, b) -> int:
+        self.copy.write(b)
+        return self.sink.write(b)
+
+
+def read_trace(path: str) -> Iterator[dict]:
+    """ yield the entries of a trace, the header is skipped """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("version") != TRACE_VERSION:
+            raise WDAReplayError("unsupported trace: %s" % path)
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class Recorder:
+    """
+    Transport of BaseClient which sends requests with httpdo and writes them to a trace
+    """
+
+    def __init__(self, path: str, transport=httpdo):
+        """
+        Args:
+            path: trace filename, usually ends with .jsonl.gz
+            transport: the real transport, default wda.httpdo
+        """
+        self.path = path
+        self._transport = transport
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._write({"version": TRACE_VERSION, "created": time.time()})
+        self.count = 0
+
+    def _write(self, entry: dict):
+        with self._lock:
+            self._file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def __call__(self, url: str, method: str = "GET", data=None, timeout=None, value_sink=None,
+                 serialize: bool = False) -> AttrDict:
+        tee = _TeeSink(value_sink) if value_sink is not None else None
+        entry = {"method": method.upper(), "route": route_template(url), "path": _url_path(url),
+                 "data": data, "status": None, "response": None, "error": None, "sink": None}
+        start = time.perf_counter()
+        try:
+            response = self._transport(url, method, data, timeout, tee, serialize)
+            entry["status"] = response.get("status")
+            entry["response"] = response
+            return response
+        except Exception as err:
+            entry["error"] = _dump_error(err)
+            raise
+        finally:
+            entry["elapsed"] = round(time.perf_counter() - start, 6)
+            if tee is not None and tee.copy.tell():
+                entry["sink"] = base64.b64encode(tee.copy.getvalue()).decode()
+            self._write(entry)
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Replayer:
+    """
+    Transport of BaseClient which answers from a trace written by Recorder
+
+    Requests are matched by method, route template and body. Answers of the same
+    request are served in the recorded order, the last one is repeated when they
+    run out (eg: a wait loop polls more often at replay speed).
+    """
+
+    def __init__(self, path: str, speed: float = 0.0, strict: bool = False):
+        """
+        Args:
+            path: trace written by Recorder
+            speed: 1 waits as long as the recorded requests took, 10 is ten times faster, 0 never waits
+            strict: raise WDAReplayError instead of repeating the last answer
+        """
+        self.path = path
+        self.speed = speed
+        self.strict = strict
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._answers: Dict[Tuple[str, str, str], Deque[dict]] = defaultdict(deque)
+        self._last: Dict[Tuple[str, str, str], dict] = {}
+        self.entries: List[dict] = list(read_trace(path))
+        for entry in self.entries:
+            self._answers[_request_key(entry["method"], entry["route"], entry["data"])].append(entry)
+
+    def remaining(self) -> int:
+        """ number of recorded answers not served yet """
+        with self._lock:
+            return sum(len(v) for v in self._answers.values())
+
+    def _next(self, key: Tuple[str, str, str]) -> dict:
+        with self._lock:
+            answers = self._answers.get(key)
+            if answers:
+                entry = self._last[key] = answers.popleft()
+                return entry
+            entry = self._last.get(key)
+            self.misses += 1
+        if entry is None or self.strict:
+            raise WDAReplayError("no recorded answer for %s %s %s" % key)
+        return entry
+
+    def __call__(self, url: str, method: str = "GET", data=None, timeout=None, value_sink=None,
+                 serialize: bool = False) -> AttrDict:
+        entry = self._next(_request_key(method, url, data))
+        if self.speed > 0:
+            time.sleep(entry["elapsed"] / self.speed)
+        if entry["sink"] is not None and value_sink is not None:
+            value_sink.write(base64.b64decode(entry["sink"]))
+        if entry["error"] is not None:
+            raise _load_error(entry["error"])
+        return convert(entry["response"])
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="summary of a trace written by wda.replay.Recorder")
+    parser.add_argument("path")
+    args = parser.parse_args()
+
+    routes: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+    errors: Dict[Tuple[str, str], int] = defaultdict(int)
+    for entry in read_trace(args.path):
+        key = (entry["method"], entry["route"])
+        routes[key].append(entry["elapsed"])
+        if entry["error"] is not None:
+            errors[key] += 1
+    print("{:<7} {:<48} {:>6} {:>6} {:>10}".format("method", "route", "count", "errors", "seconds"))
+    for (method, route), elapsed in sorted(routes.items(), key=lambda kv: -sum(kv[1])):
+        print("{:<7} {:<48} {:>6} {:>6} {:>10.3f}".format(
+            method, route, len(elapsed), errors[(method, route)], sum(elapsed)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+# coding: utf-8
+#
+"""
+Retry policy: exponential backoff with jitter per exception class, a retry budget
+and a circuit breaker per device
+
+- Backoff: how often and how long to wait before retrying an exception class
+- RetryBudget: token bucket, at most `budget` retries per `window` seconds for one device,
+  so a sick device can not keep a worker busy with retries
+- CircuitBreaker: after `threshold` transport failures in a row, requests to the device
+  fail fast with WDACircuitOpenError for `cooldown` seconds, then one trial request is let through.
+  Opt-in, the default policy has no threshold
+
+Metrics of the policy are labeled with the operation, the name of the retried function
+(eg: status, app_current, _fetch for the retries asked by Callback.RET_RETRY)
+
+Usage:
+    c = wda.Client()
+    c.retry_policy = wda.retrying.RetryPolicy(budget=5, threshold=5, cooldown=30)
+
+    # retry a function with the rules of the policy
+    policy.call(fn, "http://localhost:8100", "my-operation", (WDAUnknownError,))
+"""
+
+import functools
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple, Type
+
+from wda import metrics
+from wda.exceptions import WDABadGateway, WDACircuitOpenError, WDAEmptyResponseError, \
+    WDAKeyboardNotPresentError, WDAStaleElementReferenceError, WDAUnknownError
+from wda.usbmux.exceptions import HTTPError, MuxError
+
+# exceptions which tell WDA can not be reached, counted by the circuit breaker
+TRANSPORT_ERRORS = (HTTPError, MuxError, WDABadGateway, ConnectionError)
+
+
+@dataclass(frozen=True)
+class Backoff:
+    tries: int = 3  # including the first call
+    delay: float = 0.5  # before the first retry
+    factor: float = 2.0
+    max_delay: float = 5.0
+    jitter: float = 0.2  # +- fraction of the delay
+
+    def delay_for(self, retry: int, rnd: Callable[[], float] = random.random) -> float:
+        """
+        Args:
+            retry: 1 for the first retry
+        """
+        delay = min(self.max_delay, self.delay * self.factor ** (retry - 1))
+        return max(0.0, delay * (1 + self.jitter * (2 * rnd() - 1)))
+
+
+# same waiting as the retry decorators used before
+DEFAULT_RULES: Dict[Type[BaseException], Backoff] = {
+    WDAEmptyResponseError: Backoff(tries=3, delay=2.0, factor=1.0, jitter=0.0),
+    WDAUnknownError: Backoff(tries=3, delay=.5, factor=1.0, jitter=.4),
+    WDAKeyboardNotPresentError: Backoff(tries=3, delay=1.0, factor=1.0, jitter=0.0),
+    WDAStaleElementReferenceError: Backoff(tries=3, delay=.5, factor=1.0, jitter=.4),
+}
+
+
+class RetryBudget:
+    """ token bucket of retries """
+
+    def __init__(self, budget: int, window: float, clock: Callable[[], float] = time.monotonic):
+        self.budget = budget
+        self.window = window
+        self._clock = clock
+        self._tokens = float(budget)
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        """ take one retry, returns False when the budget is used up """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.budget, self._tokens + (now - self._updated_at) * self.budget / self.window)
+            self._updated_at = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    @property
+    def available(self) -> int:
+        with self._lock:
+            return int(self._tokens)
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name: str, threshold: Optional[int], cooldown: float,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            threshold: transport failures in a row to open the circuit, None never opens it
+        """
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._clock = clock
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """
+        Raises:
+            WDACircuitOpenError
+        """
+        if self.state == self.CLOSED:
+            return
+        with self._lock:
+            if self.state == self.OPEN and self._clock() - self._opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self._trial_running = False
+            if self.state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return
+            if self.state == self.CLOSED:
+                return
+            left = max(0.0, self.cooldown - (self._clock() - self._opened_at))
+            raise WDACircuitOpenError(self.name, "WDA is down, retry after %.1f seconds" % left)
+
+    def record_success(self):
+        if self.state == self.CLOSED and not self._failures:
+            return
+        with self._lock:
+            self._failures = 0
+            self.state = self.CLOSED
+            self._trial_running = False
+
+    def reset(self):
+        """ close the circuit, eg: the port of WDA is reachable again """
+        self.record_success()
+
+    def record_failure(self, err: BaseException):
+        """ only transport errors count, a WDA error response means WDA is up """
+        if self.threshold is None:
+            return
+        if not isinstance(err, TRANSPORT_ERRORS):
+            self.record_success()
+            return
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self._failures >= self.threshold):
+                self.state = self.OPEN
+                self._opened_at = self._clock()
+                self._trial_running = False
+                metrics.default_registry.inc_circuit_open(self.name)
+
+
+def device_key(url: str) -> str:
+    """ scheme://netloc of url """
+    scheme, _, rest = url.partition("://")
+    return scheme + "://" + rest.split("/", 1)[0]
+
+
+class RetryPolicy:
+    def __init__(self,
+                 rules: Optional[Dict[Type[BaseException], Backoff]] = None,
+                 budget: int = 20,
+                 window: float = 60.0,
+                 threshold: Optional[int] = None,
+                 cooldown: float = 10.0,
+                 sleep: Callable[[float], None] = time.sleep,
+                 clock: Callable[[], float] = time.monotonic,
+                 rnd: Callable[[], float] = random.random):
+        """
+        Args:
+            rules: Backoff by exception class, subclasses use the rule of the nearest base class
+            budget: retries allowed per device in window seconds
+            threshold: transport failures in a row to open the circuit of a device, None disables the breaker
+            cooldown: seconds the circuit stays open
+        """
+        self.rules = dict(DEFAULT_RULES if rules is None else rules)
+        self.budget = budget
+        self.window = window
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._sleep = sleep
+        self._clock = clock
+        self._rnd = rnd
+        self._budgets: Dict[str, RetryBudget] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def rule_for(self, err: BaseException) -> Optional[Backoff]:
+        for cls in type(err).__mro__:
+            rule = self.rules.get(cls)
+            if rule is not None:
+                return rule
+        return None
+
+    def retry_budget(self, url: str) -> RetryBudget:
+        key = device_key(url)
+        budget = self._budgets.get(key)
+        if budget is None:
+            with self._lock:
+                budget = self._budgets.setdefault(key, RetryBudget(self.budget, self.window, self._clock))
+        return budget
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        key = device_key(url)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(key, CircuitBreaker(key, self.threshold, self.cooldown,
+                                                                        self._clock))
+        return breaker
+
+    def allow_retry(self, url: str, operation: str) -> bool:
+        """ check the circuit and take one retry from the budget of the device """
+        if self.breaker(url).state == CircuitBreaker.OPEN:
+            metrics.default_registry.inc_retry_rejected(operation, "circuit")
+            return False
+        if not self.retry_budget(url).acquire():
+            metrics.default_registry.inc_retry_rejected(operation, "budget")
+            return False
+        return True
+
+    def call(self, fn: Callable, url: str, operation: str, retry_on: Tuple[Type[BaseException], ...]):
+        """
+        Call fn, retry when it raises one of retry_on and the policy has a rule for it
+
+        Args:
+            url: device url, the budget and circuit breaker are per device
+            operation: name of the retried function, label in metrics
+        """
+        retry = 0
+        while True:
+            try:
+                return fn()
+            except retry_on as err:
+                rule = self.rule_for(err)
+                retry += 1
+                if rule is None or retry >= rule.tries or not self.allow_retry(url, operation):
+                    raise
+                metrics.default_registry.inc_policy_retry(operation, type(err).__name__)
+                self._sleep(rule.delay_for(retry, self._rnd))
+
+
+default_policy = RetryPolicy()
+
+
+def retry_on(*exceptions: Type[BaseException]):
+    """
+    Decorator of BaseClient and Selector methods, retried with the retry_policy of the client
+
+    Args:
+        exceptions: exception classes worth retrying for this method, the waiting is set by the policy
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def _inner(self, *args, **kwargs):
+            client = getattr(self, "_session", self)
+            return client.retry_policy.call(lambda: fn(self, *args, **kwargs), client.wda_url,
+                                            fn.__name__, exceptions)
+        return _inner
+    return decorator
@@ -0,0 +1,166 @@
+# coding: utf-8
+#
+"""
+Keep a ready session per bundle id, instead of locked() + POST /session (which relaunches the app)
+in every test case
+
+Reset strategies, applied when a pooled session is handed out again:
+- reuse: the app is left as it is
+- activate: the app is brought to the foreground when it is not
+- relaunch: the app is terminated and launched again, still cheaper than a new session
+
+A pooled session is validated with one POST /wda/apps/state, which fails when WDA dropped
+the session and tells whether the app is in the foreground. WDA keeps a single session,
+so a session created for another bundle id makes the pooled ones invalid, they are
+replaced on the next acquire.
+
+Usage:
+    pool = wda.sessions.SessionPool(wda.Client(), reset="activate")
+    with pool.session("com.apple.Preferences") as s:
+        s(text="General").click()
+"""
+
+import contextlib
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterator, Optional
+
+from wda import Client, state, urljoin
+from wda.exceptions import WDAError
+from wda.usbmux.exceptions import HTTPError
+
+REUSE = "reuse"
+ACTIVATE = "activate"
+RELAUNCH = "relaunch"
+
+_APP_RUNNING_FOREGROUND = 4
+
+
+@dataclass
+class SessionPoolStats:
+    created: int = 0  # POST /session
+    reused: int = 0  # handed out from the pool
+    invalid: int = 0  # pooled sessions dropped by the validation
+    resets: int = 0  # activate or relaunch sent
+
+    def as_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+class SessionPool:
+    def __init__(self, client: Client, reset: str = ACTIVATE, validate: bool = True):
+        """
+        Args:
+            client: Client of the device, sessions are created by client.session()
+            reset: reuse, activate or relaunch
+            validate: check a pooled session before handing it out
+        """
+        if reset not in (REUSE, ACTIVATE, RELAUNCH):
+            raise ValueError("unknown reset strategy: %r" % reset)
+        self.client = client
+        self.reset = reset
+        self.validate = validate
+        self._idle: Dict[str, Client] = {}
+        self._bundle_ids: Dict[str, str] = {}  # session id -> bundle id
+        self._lock = threading.Lock()
+        self.stats = SessionPoolStats()
+
+    def _send(self, session: Client, method: str, urlpath: str, data=None):
+        """ sent with the transport directly, the callbacks of the client would create a new session """
+        return session.transport(urljoin(session.wda_url, "session", session.session_id, urlpath), method, data)
+
+    def _app_state(self, session: Client, bundle_id: str) -> Optional[int]:
+        """
+        Returns:
+            state of the app, None when the session is gone
+        """
+        try:
+            return self._send(session, "POST", "/wda/apps/state", {"bundleId": bundle_id}).value
+        except (WDAError, HTTPError):
+            return None
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self.stats, name, getattr(self.stats, name) + 1)
+
+    def _forget(self, session: Client):
+        self._count("invalid")
+        with self._lock:
+            self._bundle_ids.pop(session.session_id, None)
+
+    def _reset(self, session: Client, bundle_id: str, app_state: Optional[int]):
+        """ sent with the transport too, so a dead session raises instead of being renewed by the callbacks """
+        if self.reset == RELAUNCH:
+            self._count("resets")
+            self._send(session, "POST", "/wda/apps/terminate", {"bundleId": bundle_id})
+            self._send(session, "POST", "/wda/apps/launch", {"bundleId": bundle_id})
+        elif self.reset == ACTIVATE and app_state != _APP_RUNNING_FOREGROUND:
+            self._count("resets")
+            self._send(session, "POST", "/wda/apps/launch", {"bundleId": bundle_id})
+        else:
+            return
+        session.state.invalidate(state.APP_CURRENT, state.ORIENTATION, state.WINDOW_SIZE)
+
+    def acquire(self, bundle_id: str, **kwargs) -> Client:
+        """
+        Args:
+            kwargs: passed to Client.session() when a session has to be created, eg: arguments, environment.
+                A pooled session is handed out as it was created
+
+        Returns:
+            session Client of bundle_id
+        """
+        with self._lock:
+            session = self._idle.pop(bundle_id, None)
+        if session is not None:
+            app_state = self._app_state(session, bundle_id) if self.validate or self.reset == ACTIVATE else None
+            if self.validate and app_state is None:
+                self._forget(session)
+            else:
+                try:
+                    self._reset(session, bundle_id, app_state)
+                except (WDAError, HTTPError):
+                    # without validate a dead session shows up here
+                    self._forget(session)
+                else:
+                    self._count("reused")
+                    return session
+
+        self._count("created")
+        session = self.client.session(bundle_id, **kwargs)
+        with self._lock:
+            self._bundle_ids[session.session_id] = bundle_id
+        return session
+
+    def release(self, session: Client):
+        """ give back a session returned by acquire(), it replaces the pooled one of the same bundle id """
+        with self._lock:
+            bundle_id = self._bundle_ids.get(session.session_id)
+            if bundle_id is not None:  # unknown after close()
+                self._idle[bundle_id] = session
+
+    def discard(self, bundle_id: str):
+        with self._lock:
+            self._idle.pop(bundle_id, None)
+
+    @contextlib.contextmanager
+    def session(self, bundle_id: str, **kwargs) -> Iterator[Client]:
+        """ acquire a session, released when the block finishes, not pooled again when it raised """
+        s = self.acquire(bundle_id, **kwargs)
+        try:
+            yield s
+        except BaseException:
+            with self._lock:
+                self._bundle_ids.pop(s.session_id, None)
+            raise
+        self.release(s)
+
+    def close(self):
+        """ delete the pooled sessions """
+        with self._lock:
+            sessions, self._idle, self._bundle_ids = list(self._idle.values()), {}, {}
+        for s in sessions:
+            try:
+                self._send(s, "DELETE", "/")
+            except (WDAError, HTTPError):
+                pass
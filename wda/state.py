@@ -0,0 +1,206 @@
+# coding: utf-8
+#
+"""
+Cached device state of a client: lock state, foreground app, session id and orientation,
+plus window size, scale and device info
+
+Values are updated from the responses of the client (eg: POST /wda/unlock sets locked=False,
+a tap makes app_current unknown) and expire after ttl seconds. Scale, device info and the WDA build seen in /status
+do not expire. The window size expires after ttl too, and is dropped with app_current (an app may rotate the screen)
+and when the orientation changes.
+All three are dropped when a session is created. Guards like the locked() check in session() and app_launch() read the
+cache instead of asking the device again.
+Explicit calls (c.locked(), c.app_current()) always send a request, and refresh the cache.
+
+Usage:
+    c = wda.Client()
+    c.state.ttl = 5.0
+    c.state.start_refresh(c, interval=2.0)  # optional, keeps the cache warm in background
+    print(c.state.peek("app_current"))
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LOCKED = "locked"
+APP_CURRENT = "app_current"
+SESSION_ID = "session_id"
+ORIENTATION = "orientation"
+WINDOW_SIZE = "window_size"
+SCALE = "scale"
+DEVICE_INFO = "device_info"
+BUILD = "build"  # "build" of /status, for wda.capabilities
+
+# counted as static_hits and static_misses
+STATIC = (WINDOW_SIZE, SCALE, DEVICE_INFO)
+
+# not expired by ttl
+_PERMANENT = (SCALE, DEVICE_INFO, BUILD)
+
+_SESSION_PREFIX = "/session/:sid"
+
+# POST routes which do not change the foreground app
+_READONLY_POSTS = {"/wda/getPasteboard", "/element", "/elements", "/appium/settings"}
+
+
+@dataclass
+class StateStats:
+    hits: int = 0  # guards answered from the cache
+    misses: int = 0  # guards which had to ask the device
+    refreshes: int = 0  # rounds of the background refresh
+    static_hits: int = 0  # window size, scale and device info answered from the cache
+    static_misses: int = 0
+
+
+class DeviceState:
+    def __init__(self, ttl: float = 2.0, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            ttl: seconds a value is trusted, 0 disables the cache
+        """
+        self.ttl = ttl
+        self._clock = clock
+        self._values: Dict[str, Tuple[Any, float]] = {}  # name -> (value, updated_at)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.stats = StateStats()
+
+    def set(self, name: str, value):
+        with self._lock:
+            self._values[name] = (value, self._clock())
+
+    def invalidate(self, *names: str):
+        """ forget names, or everything when no name is given """
+        with self._lock:
+            if not names:
+                self._values.clear()
+            for name in names:
+                self._values.pop(name, None)
+
+    def peek(self, name: str, default=None):
+        """ cached value of name, default when unknown or expired """
+        with self._lock:
+            item = self._values.get(name)
+        if item is None or self.ttl <= 0:
+            return default
+        if name not in _PERMANENT and self._clock() - item[1] >= self.ttl:
+            return default
+        return item[0]
+
+    def record_hit(self, name: str):
+        """ count a read of name answered from the cache """
+        with self._lock:
+            if name in STATIC:
+                self.stats.static_hits += 1
+            else:
+                self.stats.hits += 1
+
+    def record_miss(self, name: str):
+        """ count a read of name which had to ask the device """
+        with self._lock:
+            if name in STATIC:
+                self.stats.static_misses += 1
+            else:
+                self.stats.misses += 1
+
+    def get(self, name: str, fetch: Callable[[], Any]):
+        """ cached value of name, or fetch() when unknown or expired """
+        _missing = object()
+        value = self.peek(name, _missing)
+        if value is not _missing:
+            self.record_hit(name)
+            return value
+        self.record_miss(name)
+        value = fetch()
+        self.set(name, value)
+        return value
+
+    def observe(self, method: str, route: str, data, response):
+        """ update from the response of a request, route is a template, eg: /session/:sid/wda/tap """
+        if route.startswith(_SESSION_PREFIX):
+            path = route[len(_SESSION_PREFIX):].rstrip("/")
+            if method == "DELETE" and not path:
+                self.invalidate(SESSION_ID)
+                return
+        elif method == "POST" and route == "/session":
+            self.set(SESSION_ID, response.get("sessionId"))
+            self.set(LOCKED, False)  # session() unlocks before
+            self.invalidate(APP_CURRENT, ORIENTATION, *STATIC)
+            return
+        else:
+            path = route
+
+        if path == "/status":
+            self.set(SESSION_ID, response.get("sessionId"))
+            if isinstance(response.value, dict):
+                self.set(BUILD, response.value.get("build") or {})
+        elif path == "/wda/locked":
+            self.set(LOCKED, response.value)
+        elif path == "/wda/lock":
+            self.set(LOCKED, True)
+        elif path == "/wda/unlock":
+            self.set(LOCKED, False)
+        elif path == "/wda/activeAppInfo":
+            with self._lock:
+                old = self._values.get(APP_CURRENT)
+                self._values[APP_CURRENT] = (response.value, self._clock())
+                if old is not None and (old[0] or {}).get("bundleId") != (response.value or {}).get("bundleId"):
+                    self._values.pop(ORIENTATION, None)
+                    self._values.pop(WINDOW_SIZE, None)
+        elif path == "/orientation":
+            if method == "GET" and response.value:
+                with self._lock:
+                    old = self._values.get(ORIENTATION)
+                    self._values[ORIENTATION] = (response.value, self._clock())
+                    if old is not None and old[0] != response.value:
+                        self._values.pop(WINDOW_SIZE, None)
+            elif method == "POST":
+                self.invalidate(ORIENTATION, WINDOW_SIZE)
+        elif path.startswith("/wda/apps/") or path == "/wda/homescreen":
+            if path != "/wda/apps/state":
+                self.invalidate(APP_CURRENT, ORIENTATION, WINDOW_SIZE)
+        elif method == "POST" and path not in _READONLY_POSTS:
+            # eg: a tap can open another app, or make the app rotate
+            self.invalidate(APP_CURRENT, ORIENTATION, WINDOW_SIZE)
+
+    def start_refresh(self, client, interval: float = 1.0) -> "DeviceState":
+        """
+        Refresh lock state, foreground app, session id and orientation in a background thread,
+        interval should be less than ttl
+        """
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(name="wda-state", target=self._run, args=(client, interval),
+                                            daemon=True)
+            self._thread.start()
+        return self
+
+    def stop_refresh(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self, client, interval: float):
+        while not self._stopped.is_set():
+            try:
+                client.locked()
+                client.app_current()
+                session_id = client.status().get("sessionId")
+                if session_id:
+                    client.http.get("/session/%s/orientation" % session_id)
+                with self._lock:
+                    self.stats.refreshes += 1
+            except Exception as e:
+                logger.debug("refresh device state: %s", e)
+            self._stopped.wait(interval)
+
+    def snapshot(self) -> Dict[str, Optional[Any]]:
+        """ fresh values only """
+        return {name: self.peek(name) for name in (LOCKED, APP_CURRENT, SESSION_ID, ORIENTATION) + STATIC}
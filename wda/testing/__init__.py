@@ -0,0 +1,8 @@
+# coding: utf-8
+#
+"""
+Test doubles of WebDriverAgent and usbmuxd, to run tests and benchmarks without an iPhone
+"""
+
+from wda.testing.wdaserver import DEFAULT_SCENARIO, Fault, MockWDAServer, list_screen, make_png
+from wda.testing.usbmuxd import MockMuxDevice, MockUsbmuxd
@@ -0,0 +1,312 @@
+# coding: utf-8
+#
+"""
+Element queries of the mock WDA server: predicate string, class chain and a subset of xpath
+
+Nodes are dicts in the WDA json source format
+    {"type": "XCUIElementTypeButton", "name": "OK", "label": "OK", "value": None,
+     "enabled": True, "visible": True, "accessible": True, "selected": False, "children": [...]}
+
+Supported syntax
+    predicate: name == 'OK' AND label CONTAINS 'x' OR visible == true
+        operators: == != CONTAINS BEGINSWITH ENDSWITH MATCHES LIKE (with [c] flag), no parentheses
+    class chain: **/XCUIElementTypeCell[`name BEGINSWITH 'Row'`][2]/XCUIElementTypeButton
+    xpath: //XCUIElementTypeButton[@name="OK" and @enabled="true"][1]
+"""
+
+import fnmatch
+import re
+from typing import Callable, Iterator, List, Optional
+
+_ATTR_ALIASES = {
+    "wdName": "name", "wdLabel": "label", "wdValue": "value", "wdType": "type",
+    "wdEnabled": "enabled", "wdVisible": "visible", "wdAccessible": "accessible",
+    "wdSelected": "selected", "identifier": "name", "title": "label", "elementType": "type",
+    "isEnabled": "enabled", "isVisible": "visible", "isAccessible": "accessible",
+}
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<string>'(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*")
+      | (?P<op>==|!=|=|<=|>=|<|>)
+      | (?P<word>[A-Za-z_][\w.]*(?:\[[cd]+\])?)
+      | (?P<number>-?\d+(?:\.\d+)?)
+    )""", re.VERBOSE)
+
+_WORD_OPS = {"CONTAINS", "BEGINSWITH", "ENDSWITH", "MATCHES", "LIKE"}
+
+
+class QueryError(ValueError):
+    """ invalid selector """
+
+
+def attribute(node: dict, name: str):
+    name = _ATTR_ALIASES.get(name, name)
+    if name == "name":
+        return node.get("name") or node.get("label")
+    if name == "label":
+        return node.get("label") or ""
+    if name in ("enabled", "visible", "accessible"):
+        return node.get(name, name != "accessible" or node.get("visible", True))
+    if name == "selected":
+        return node.get("selected", False)
+    return node.get(name)
+
+
+def _unquote(s: str) -> str:
+    return re.sub(r"\\(.)", r"\1", s[1:-1])
+
+
+def _literal(kind: str, text: str):
+    if kind == "string":
+        return _unquote(text)
+    if kind == "number":
+        return float(text) if "." in text else int(text)
+    upper = text.upper()
+    if upper in ("TRUE", "YES"):
+        return True
+    if upper in ("FALSE", "NO"):
+        return False
+    if upper in ("NIL", "NULL"):
+        return None
+    raise QueryError("unexpected token: %s" % text)
+
+
+def _tokenize(predicate: str) -> List[tuple]:
+    tokens, pos = [], 0
+    predicate = predicate.strip()
+    while pos < len(predicate):
+        m = _TOKEN.match(predicate, pos)
+        if not m or m.end() == pos:
+            raise QueryError("invalid predicate near: %r" % predicate[pos:])
+        kind = m.lastgroup
+        tokens.append((kind, m.group(kind)))
+        pos = m.end()
+    return tokens
+
+
+def _compare(op: str, flags: str, left, right) -> bool:
+    if op in ("==", "="):
+        if isinstance(right, bool):
+            return bool(left) == right
+        return _text(left, flags) == _text(right, flags) if isinstance(right, str) else left == right
+    if op == "!=":
+        return not _compare("==", flags, left, right)
+    if op in ("<", ">", "<=", ">="):
+        try:
+            left, right = float(left), float(right)
+        except (TypeError, ValueError):
+            return False
+        return {"<": left < right, ">": left > right, "<=": left <= right, ">=": left >= right}[op]
+    if left is None:
+        return False
+    left, right = _text(left, flags), _text(right, flags)
+    if op == "CONTAINS":
+        return right in left
+    if op == "BEGINSWITH":
+        return left.startswith(right)
+    if op == "ENDSWITH":
+        return left.endswith(right)
+    if op == "MATCHES":
+        return re.fullmatch(right, left, re.DOTALL) is not None
+    if op == "LIKE":
+        return fnmatch.fnmatchcase(left, right)
+    raise QueryError("unsupported operator: %s" % op)
+
+
+def _text(v, flags: str) -> str:
+    v = "" if v is None else str(v)
+    return v.lower() if "c" in flags else v
+
+
+def compile_predicate(predicate: str) -> Callable[[dict], bool]:
+    """
+    Returns:
+        function(node) -> bool
+    """
+    tokens = _tokenize(predicate)
+    # split by OR, then by AND
+    alternatives, clauses, clause = [], [], []
+    for kind, text in tokens:
+        if kind == "word" and text.upper() in ("AND", "&&"):
+            clauses.append(clause)
+            clause = []
+        elif kind == "word" and text.upper() in ("OR", "||"):
+            clauses.append(clause)
+            alternatives.append(clauses)
+            clauses, clause = [], []
+        else:
+            clause.append((kind, text))
+    clauses.append(clause)
+    alternatives.append(clauses)
+
+    def _compile_clause(clause):
+        negate = False
+        if clause and clause[0][0] == "word" and clause[0][1].upper() == "NOT":
+            negate, clause = True, clause[1:]
+        if len(clause) == 1:  # bare literal: TRUEPREDICATE, true, false
+            word = clause[0][1].upper()
+            value = word == "TRUEPREDICATE" or (word != "FALSEPREDICATE" and _literal(*clause[0]))
+            return lambda node: bool(value) != negate
+        if len(clause) != 3:
+            raise QueryError("invalid predicate: %r" % predicate)
+        (_, name), (op_kind, op), right = clause
+        flags = ""
+        if op_kind == "word":
+            op, _, flags = op.upper().partition("[")
+            if op not in _WORD_OPS:
+                raise QueryError("unsupported operator: %s" % op)
+        value = _literal(*right)
+        return lambda node: _compare(op, flags, attribute(node, name), value) != negate
+
+    compiled = [[_compile_clause(c) for c in clauses] for clauses in alternatives]
+    return lambda node: any(all(c(node) for c in clauses) for clauses in compiled)
+
+
+def walk(node: dict) -> Iterator[dict]:
+    """ all descendants in document order, node itself excluded """
+    for child in node.get("children", ()):
+        yield child
+        yield from walk(child)
+
+
+def _pick(nodes: List[dict], index: Optional[int]) -> List[dict]:
+    if index is None:
+        return nodes
+    if index > 0:
+        return nodes[index - 1:index]
+    if index < 0:
+        return nodes[index:len(nodes) + index + 1]
+    raise QueryError("index starts from 1")
+
+
+_CHAIN_STEP = re.compile(r"(\*\*|[A-Za-z]+)((?:\[(?:`(?:[^`])*`|\$(?:[^$])*\$|-?\d+)\])*)")
+_CHAIN_FILTER = re.compile(r"\[(`(?:[^`])*`|\$(?:[^$])*\$|-?\d+)\]")
+
+
+def class_chain(root: dict, chain: str) -> List[dict]:
+    steps = []
+    descendant = False
+    for part in _split_chain(chain):
+        m = _CHAIN_STEP.fullmatch(part)
+        if not m:
+            raise QueryError("invalid class chain: %r" % chain)
+        if m.group(1) == "**":
+            descendant = True
+            continue
+        filters = _CHAIN_FILTER.findall(m.group(2))
+        steps.append((descendant, m.group(1), filters))
+        descendant = False
+    if descendant:
+        raise QueryError("class chain can not end with **")
+
+    current = [root]
+    for descendant, type_name, filters in steps:
+        found, seen = [], set()
+        for node in current:
+            candidates = walk(node) if descendant else node.get("children", ())
+            matched = [c for c in candidates if _type_match(c, type_name)]
+            for f in filters:
+                if f.startswith("`"):
+                    matched = [c for c in matched if compile_predicate(f[1:-1])(c)]
+                elif f.startswith("$"):
+                    match = compile_predicate(f[1:-1])
+                    matched = [c for c in matched if any(match(d) for d in walk(c))]
+                else:
+                    matched = _pick(matched, int(f))
+            for c in matched:
+                if id(c) not in seen:
+                    seen.add(id(c))
+                    found.append(c)
+        current = found
+    return current
+
+
+def _split_chain(chain: str) -> List[str]:
+    """ split by "/" outside of backticks """
+    parts, buf, quoted = [], "", None
+    for ch in chain:
+        if quoted:
+            quoted = None if ch == quoted else quoted
+        elif ch in "`$":
+            quoted = ch
+        elif ch == "/":
+            parts.append(buf)
+            buf = ""
+            continue
+        buf += ch
+    parts.append(buf)
+    return [p for p in parts if p]
+
+
+def _type_match(node: dict, type_name: str) -> bool:
+    return type_name in ("XCUIElementTypeAny", "*") or node.get("type") == type_name
+
+
+_XPATH_STEP = re.compile(r"(//|/)([\w*]+)((?:\[[^\]]*\])*)")
+_XPATH_ATTR = re.compile(r"""@(\w+)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+
+
+def xpath(root: dict, expr: str) -> List[dict]:
+    """ subset of xpath: absolute steps with @attr="value" filters joined by "and", and indexes """
+    pos, current = 0, [{"children": [root]}]
+    while pos < len(expr):
+        m = _XPATH_STEP.match(expr, pos)
+        if not m:
+            raise QueryError("unsupported xpath: %r" % expr)
+        pos = m.end()
+        axis, type_name, filters = m.groups()
+        found, seen = [], set()
+        for node in current:
+            candidates = walk(node) if axis == "//" else node.get("children", ())
+            matched = [c for c in candidates if _type_match(c, type_name)]
+            for f in re.findall(r"\[([^\]]*)\]", filters):
+                f = f.strip()
+                if re.fullmatch(r"-?\d+", f):
+                    matched = _pick(matched, int(f))
+                    continue
+                conditions = [c.strip() for c in re.split(r"\band\b", f)]
+                checks = []
+                for cond in conditions:
+                    am = _XPATH_ATTR.fullmatch(cond)
+                    if not am:
+                        raise QueryError("unsupported xpath filter: %r" % cond)
+                    checks.append((am.group(1), am.group(2) if am.group(2) is not None else am.group(3)))
+                matched = [c for c in matched if all(_xpath_value(c, k) == v for k, v in checks)]
+            for c in matched:
+                if id(c) not in seen:
+                    seen.add(id(c))
+                    found.append(c)
+        current = found
+    return current
+
+
+def _xpath_value(node: dict, name: str) -> str:
+    v = attribute(node, name)
+    if isinstance(v, bool):
+        return "true" if v else "false"
+    return "" if v is None else str(v)
+
+
+def find(root: dict, using: str, value: str) -> List[dict]:
+    """
+    Args:
+        using: id, name, accessibility id, class name, predicate string, class chain, xpath
+
+    Raises:
+        QueryError
+    """
+    if using in ("id", "name", "accessibility id", "link text"):
+        return [n for n in walk(root) if attribute(n, "name") == value]
+    if using == "partial link text":
+        return [n for n in walk(root) if value in (attribute(n, "name") or "")]
+    if using == "class name":
+        return [n for n in walk(root) if n.get("type") == value]
+    if using == "predicate string":
+        match = compile_predicate(value)
+        return [n for n in walk(root) if match(n)]
+    if using == "class chain":
+        return class_chain(root, value)
+    if using == "xpath":
+        return xpath(root, value)
+    raise QueryError("unsupported locator strategy: %s" % using)
@@ -0,0 +1,393 @@
+# coding: utf-8
+#
+"""
+Mock usbmuxd daemon over a unix socket, no iPhone is required
+
+It speaks the BINARY and PLIST protocols of usbmuxd: ListDevices, Listen
+(Attached/Detached events), ReadBUID, ReadPairRecord and Connect. A Connect
+to a device port is relayed to a local TCP address, eg a MockWDAServer.
+
+Usage:
+    from wda.testing import MockUsbmuxd, MockWDAServer
+    from wda.usbmux import pyusbmux
+
+    with MockWDAServer() as wda_server, MockUsbmuxd() as usbmuxd:
+        usbmuxd.add_device("00008030-000A1B2C3D4E", ports={8100: wda_server.address})
+        device = pyusbmux.select_device("00008030-000A1B2C3D4E", usbmux_address=usbmuxd.address)
+        sock = device.connect(8100, usbmux_address=usbmuxd.address)
+
+    # or route every http+usbmux:// url of the process through it
+    os.environ["USBMUXD_SOCKET_ADDRESS"] = "UNIX:" + usbmuxd.address
+
+protocol="BINARY" emulates an old usbmuxd which answers plist requests with BADVERSION,
+protocol="PLIST" accepts both like a recent one.
+"""
+
+import os
+import plistlib
+import shutil
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Union
+
+from wda.usbmux.pyusbmux import usbmuxd_msgtype, usbmuxd_request, usbmuxd_response, usbmuxd_result, \
+    usbmuxd_version
+
+Address = Tuple[str, int]
+
+PRODUCT_ID = 0x12a8
+RELAY_BUFFER_SIZE = 256 * 1024
+
+
+@dataclass
+class MockMuxDevice:
+    device_id: int
+    serial: str
+    connection_type: str = "USB"
+    ports: Dict[int, Address] = field(default_factory=dict)  # device port -> local tcp address
+
+    def properties(self) -> dict:
+        props = {"DeviceID": self.device_id, "SerialNumber": self.serial, "ConnectionType": self.connection_type}
+        if self.connection_type == "USB":
+            props.update({"ProductID": PRODUCT_ID, "LocationID": self.device_id, "ConnectionSpeed": 480000000,
+                          "USBSerialNumber": self.serial.replace("-", "")})
+        else:
+            props.update({"EscapedFullServiceName": self.serial + "._apple-mobdev2._tcp.local",
+                          "InterfaceIndex": 4, "NetworkAddress": bytes(128)})
+        return props
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> Optional[bytes]:
+    buf = bytearray(size)
+    view = memoryview(buf)
+    pos = 0
+    while pos < size:
+        n = sock.recv_into(view[pos:])
+        if not n:
+            return None
+        pos += n
+    return bytes(buf)
+
+
+def _pipe(src: socket.socket, dst: socket.socket, counter: list):
+    buf = bytearray(RELAY_BUFFER_SIZE)
+    view = memoryview(buf)
+    try:
+        while True:
+            n = src.recv_into(buf)
+            if not n:
+                break
+            dst.sendall(view[:n])
+            counter[0] += n
+    except OSError:
+        pass
+    finally:
+        try:
+            dst.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+class MockUsbmuxd:
+    def __init__(self,
+                 address: Optional[str] = None,
+                 protocol: str = "PLIST",
+                 latency: float = 0.0,
+                 buid: Optional[str] = None):
+        """
+        Args:
+            address: unix socket path, default a new file in a temporary directory
+            protocol: PLIST or BINARY
+            latency: seconds added before every reply
+            buid: SystemBUID returned by ReadBUID
+        """
+        if protocol not in ("PLIST", "BINARY"):
+            raise ValueError("protocol should be PLIST or BINARY")
+        self._tmpdir = None
+        if address is None:
+            self._tmpdir = tempfile.mkdtemp(prefix="usbmuxd-")
+            address = os.path.join(self._tmpdir, "usbmuxd")
+        self.address = address
+        self.protocol = protocol
+        self.latency = latency
+        self.buid = buid or str(uuid.uuid4()).upper()
+        self.devices: Dict[int, MockMuxDevice] = {}
+        self.pair_records: Dict[str, bytes] = {}
+        self.stats = {"connections": 0, "messages": 0, "tunnels": 0, "relayed_bytes": 0}
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._listeners: List["_Client"] = []
+        self._server = socketserver.ThreadingUnixStreamServer(address, self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "MockUsbmuxd":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-usbmuxd", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            for client in self._listeners:
+                client.close()
+            self._listeners.clear()
+        if self._tmpdir:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+        elif os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def add_device(self, serial: Optional[str] = None, ports: Optional[Dict[int, Union[int, Address]]] = None,
+                   connection_type: str = "USB") -> MockMuxDevice:
+        """
+        Attach a device, listeners receive an Attached event
+
+        Args:
+            serial: udid, default a random one
+            ports: device port -> local tcp port or (host, port), eg {8100: mock_wda.address}
+            connection_type: USB or Network
+        """
+        ports = {p: (("127.0.0.1", a) if isinstance(a, int) else tuple(a)) for p, a in (ports or {}).items()}
+        with self._lock:
+            device = MockMuxDevice(self._next_id, serial or "00008030-%016X" % uuid.uuid4().int,
+                                   connection_type, ports)
+            self._next_id += 1
+            self.devices[device.device_id] = device
+            for client in list(self._listeners):
+                client.send_attached(device)
+        return device
+
+    def remove_device(self, device_id: int):
+        """ detach a device, listeners receive a Detached event """
+        with self._lock:
+            if self.devices.pop(device_id, None) is None:
+                return
+            for client in list(self._listeners):
+                client.send_detached(device_id)
+
+    def _handler_class(self):
+        daemon = self
+
+        class _Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                with daemon._lock:
+                    daemon.stats["connections"] += 1
+                _Client(daemon, self.request).serve()
+
+        return _Handler
+
+
+class _Client:
+    """ one connection to the daemon, control messages until Listen or Connect """
+
+    def __init__(self, daemon: MockUsbmuxd, sock: socket.socket):
+        self.daemon = daemon
+        self.sock = sock
+        self.version = None
+        self._send_lock = threading.Lock()
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def serve(self):
+        while True:
+            head = _recv_exactly(self.sock, 4)
+            if head is None:
+                return
+            length = struct.unpack("<I", head)[0]
+            rest = _recv_exactly(self.sock, length - 4) if length > 4 else b""
+            if rest is None:
+                return
+            request = usbmuxd_request.parse(head + rest)
+            with self.daemon._lock:
+                self.daemon.stats["messages"] += 1
+            if self.daemon.latency:
+                time.sleep(self.daemon.latency)
+            if not self._dispatch(request):
+                return
+
+    def _dispatch(self, request) -> bool:
+        """ returns False when the socket is no longer a control connection """
+        header = request.header
+        tag = header.tag
+        if header.message == usbmuxd_msgtype.PLIST:
+            if self.daemon.protocol == "BINARY":
+                # an old usbmuxd answers plist requests in the binary protocol
+                self.version = usbmuxd_version.BINARY
+                self.send_result(tag, usbmuxd_result.BADVERSION)
+                return True
+            self.version = usbmuxd_version.PLIST
+            return self._dispatch_plist(tag, plistlib.loads(request.data))
+
+        self.version = usbmuxd_version.BINARY
+        if header.message == usbmuxd_msgtype.LISTEN:
+            self._listen(tag)
+            return False
+        if header.message == usbmuxd_msgtype.CONNECT:
+            self._connect(tag, request.data.device_id, request.data.port)
+            return False
+        self.send_result(tag, usbmuxd_result.BADCOMMAND)
+        return True
+
+    def _dispatch_plist(self, tag: int, message: dict) -> bool:
+        message_type = message.get("MessageType")
+        daemon = self.daemon
+        if message_type == "ListDevices":
+            with daemon._lock:
+                devices = [self._attached_plist(d) for d in daemon.devices.values()]
+            self.send_plist(tag, {"DeviceList": devices})
+        elif message_type == "ReadBUID":
+            self.send_plist(tag, {"BUID": daemon.buid})
+        elif message_type == "ReadPairRecord":
+            record = daemon.pair_records.get(message.get("PairRecordID"))
+            if record is None:
+                self.send_result(tag, usbmuxd_result.BADDEV)
+            else:
+                self.send_plist(tag, {"PairRecordData": record})
+        elif message_type == "SavePairRecord":
+            daemon.pair_records[message["PairRecordID"]] = message["PairRecordData"]
+            self.send_result(tag, usbmuxd_result.OK)
+        elif message_type == "Listen":
+            self._listen(tag)
+            return False
+        elif message_type == "Connect":
+            self._connect(tag, message.get("DeviceID"), message.get("PortNumber", 0))
+            return False
+        else:
+            self.send_result(tag, usbmuxd_result.BADCOMMAND)
+        return True
+
+    # replies
+    def _send(self, message: int, tag: int, data):
+        packet = usbmuxd_response.build({"header": {"version": self.version, "message": message, "tag": tag},
+                                         "data": data})
+        with self._send_lock:
+            self.sock.sendall(packet)
+
+    def send_plist(self, tag: int, payload: dict):
+        self._send(usbmuxd_msgtype.PLIST, tag, plistlib.dumps(payload))
+
+    def send_result(self, tag: int, result):
+        if self.version == usbmuxd_version.PLIST:
+            self.send_plist(tag, {"MessageType": "Result", "Number": int(result)})
+        else:
+            self._send(usbmuxd_msgtype.RESULT, tag, {"result": result})
+
+    @staticmethod
+    def _attached_plist(device: MockMuxDevice) -> dict:
+        return {"MessageType": "Attached", "DeviceID": device.device_id, "Properties": device.properties()}
+
+    def send_attached(self, device: MockMuxDevice):
+        try:
+            if self.version == usbmuxd_version.PLIST:
+                self.send_plist(0, self._attached_plist(device))
+            else:
+                self._send(usbmuxd_msgtype.ADD, 0, {"device_id": device.device_id, "product_id": PRODUCT_ID,
+                                                    "serial_number": device.serial, "location": device.device_id})
+        except OSError:
+            pass
+
+    def send_detached(self, device_id: int):
+        try:
+            if self.version == usbmuxd_version.PLIST:
+                self.send_plist(0, {"MessageType": "Detached", "DeviceID": device_id})
+            else:
+                self._send(usbmuxd_msgtype.REMOVE, 0, {"device_id": device_id})
+        except OSError:
+            pass
+
+    # long lived requests
+    def _listen(self, tag: int):
+        daemon = self.daemon
+        with daemon._lock:
+            self.send_result(tag, usbmuxd_result.OK)
+            for device in daemon.devices.values():
+                self.send_attached(device)
+            daemon._listeners.append(self)
+        try:
+            while self.sock.recv(4096):
+                pass  # nothing is expected from a listener, wait for it to hang up
+        except OSError:
+            pass
+        finally:
+            with daemon._lock:
+                if self in daemon._listeners:
+                    daemon._listeners.remove(self)
+
+    def _connect(self, tag: int, device_id: int, port: int):
+        # clients send the port in network byte order
+        port = socket.ntohs(port)
+        daemon = self.daemon
+        device = daemon.devices.get(device_id)
+        if device is None:
+            self.send_result(tag, usbmuxd_result.BADDEV)
+            return
+        address = device.ports.get(port)
+        try:
+            if address is None:
+                raise ConnectionRefusedError(port)
+            upstream = socket.create_connection(address)
+        except OSError:
+            self.send_result(tag, usbmuxd_result.CONNREFUSED)
+            return
+        upstream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.send_result(tag, usbmuxd_result.OK)
+        with daemon._lock:
+            daemon.stats["tunnels"] += 1
+
+        sent, received = [0], [0]
+        t = threading.Thread(target=_pipe, args=(self.sock, upstream, sent), daemon=True)
+        t.start()
+        _pipe(upstream, self.sock, received)
+        t.join()
+        upstream.close()
+        with daemon._lock:
+            daemon.stats["relayed_bytes"] += sent[0] + received[0]
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="mock usbmuxd daemon")
+    parser.add_argument("--address", help="unix socket path, default a temporary file")
+    parser.add_argument("--protocol", choices=("PLIST", "BINARY"), default="PLIST")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added before every reply")
+    parser.add_argument("-d", "--device", action="append", default=[],
+                        help="udid=device_port:local_port, eg 00008030-000A1B2C3D4E=8100:8100")
+    args = parser.parse_args()
+
+    usbmuxd = MockUsbmuxd(args.address, args.protocol, args.latency)
+    for spec in args.device:
+        serial, _, ports = spec.partition("=")
+        device_port, _, local_port = ports.partition(":")
+        ports = {int(device_port): int(local_port or device_port)} if device_port else {}
+        usbmuxd.add_device(serial, ports)
+    print("mock usbmuxd listening on", usbmuxd.address)
+    print("export USBMUXD_SOCKET_ADDRESS=UNIX:" + usbmuxd.address)
+    usbmuxd.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        usbmuxd.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1002 @@
+# coding: utf-8
+#
+"""
+Mock WebDriverAgent HTTP server, no iPhone is required
+
+It implements the FBRoute endpoints used by wda.Client on top of a scriptable
+UI hierarchy, with configurable latency, payload sizes and fault injection.
+
+Usage:
+    from wda.testing import MockWDAServer
+
+    with MockWDAServer(latency=0.02) as server:
+        c = wda.Client(server.url)
+        s = c.session("com.test.cert.TestCert")
+        s(text="ENABLED_BTN").click()
+
+    # command line, serve on http://127.0.0.1:8100
+    python -m wda.testing.wdaserver --port 8100 --latency 0.05
+
+Scenario format (json compatible), see DEFAULT_SCENARIO
+    {
+        "device": {"width": 414, "height": 896, "scale": 2},
+        "apps": {
+            "<bundle id>": {"name": "...", "start": "<screen>", "screens": {"<screen>": <node>}}
+        }
+    }
+
+Node
+    {"type": "Button", "name": "OK", "label": "OK", "value": None, "rect": [x, y, w, h],
+     "enabled": True, "visible": True, "accessible": True, "selected": False,
+     "scrollable": False, "lazy": False, "children": [...],
+     "onTap": <action>, "onDoubleTap": <action>, "onLongPress": <action>}
+
+    type is prefixed with XCUIElementType when needed, rect is relative to the screen.
+    Children of a scrollable node move with its scroll offset, children of a lazy node
+    are not in the hierarchy while they are off screen (like table cells).
+
+Action, or a list of actions
+    {"alert": {"title": "Confirmation", "message": "Do you accept?", "buttons": ["Reject", "Accept"],
+               "input": False}}
+    {"screen": "<screen name>"}
+    {"clear": "<element name>"}
+    {"set": {"name": "<element name>", "value": "..."}}
+"""
+
+import argparse
+import base64
+import copy
+import gzip
+import json
+import random
+import re
+import socket
+import struct
+import threading
+import time
+import uuid
+import zlib
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qsl
+
+from wda.metrics import route_template
+from wda.testing import query
+
+SPRINGBOARD = "com.apple.springboard"
+TEST_BUNDLE_ID = "com.test.cert.TestCert"
+
+LANDSCAPE = "LANDSCAPE"
+PORTRAIT = "PORTRAIT"
+
+
+def _button(name: str, y: int, **kwargs) -> dict:
+    node = {"type": "Button", "name": name, "label": name, "rect": [20, y, 200, 40]}
+    node.update(kwargs)
+    return node
+
+
+def list_screen(rows: int = 50, row_height: int = 44, top: int = 100, height: int = 796) -> dict:
+    """ screen with a lazy scrollable list of cells named Row1..RowN, also used to generate big sources """
+    return {
+        "type": "Application", "name": "facebookwdae2e", "children": [
+            {"type": "NavigationBar", "name": "ListView", "rect": [0, 44, 414, 56], "children": [
+                _button("Back", 50, rect=[0, 50, 80, 44], onTap={"screen": "main"}),
+            ]},
+            {"type": "Table", "name": "LIST_CONTAINER", "label": "LIST_CONTAINER", "rect": [0, top, 414, height],
+             "scrollable": True, "lazy": True, "children": [
+                {"type": "Cell", "name": "Row%d" % i, "label": "Row%d" % i,
+                 "rect": [0, top + (i - 1) * row_height, 414, row_height], "children": [
+                    {"type": "StaticText", "name": "Row%d" % i, "label": "Row%d" % i,
+                     "rect": [20, top + (i - 1) * row_height + 12, 200, 20]}]}
+                for i in range(1, rows + 1)]},
+        ]}
+
+
+# Mirrors the e2e_benchmarks/app/facebookwdae2e test app
+DEFAULT_SCENARIO = {
+    "device": {"width": 414, "height": 896, "scale": 2, "name": "iPhone", "model": "iPhone",
+               "version": "16.3.1", "sdkVersion": "16.4"},
+    "apps": {
+        SPRINGBOARD: {"name": "SpringBoard", "start": "home", "screens": {"home": {
+            "type": "Application", "name": "SpringBoard", "children": [
+                {"type": "Icon", "name": "Settings", "label": "Settings", "rect": [20, 60, 64, 64]},
+                {"type": "Icon", "name": "facebookwdae2e", "label": "facebookwdae2e", "rect": [110, 60, 64, 64]},
+            ]}}},
+        "com.apple.Preferences": {"name": "Settings", "start": "main", "screens": {"main": {
+            "type": "Application", "name": "Settings", "children": [
+                {"type": "NavigationBar", "name": "Settings", "rect": [0, 44, 414, 96]},
+                {"type": "Cell", "name": "General", "label": "General", "rect": [0, 200, 414, 44]},
+            ]}}},
+        TEST_BUNDLE_ID: {"name": "facebookwdae2e", "start": "main", "screens": {
+            "main": {"type": "Application", "name": "facebookwdae2e", "children": [
+                _button("ENABLED_BTN", 100),
+                _button("DISABLED_BTN", 150, enabled=False),
+                _button("HIDDEN_BTN", 200, visible=False, accessible=False),
+                _button("CHECKED_BTN", 250, selected=True),
+                _button("UNCHECKED_BTN", 300),
+                {"type": "Image", "name": "IMG_BTN", "label": "applogo", "rect": [240, 100, 100, 100]},
+                {"type": "TextField", "name": "INPUT_FIELD", "value": "", "rect": [20, 350, 300, 40]},
+                _button("CLEAR_INPUT_BTN", 400, onTap={"clear": "INPUT_FIELD"}),
+                _button("ACCEPT_OR_REJECT_ALERT", 450, onTap={"alert": {
+                    "title": "Confirmation", "message": "Do you accept?", "buttons": ["Reject", "Accept"]}}),
+                _button("INPUT_ALERT", 500, onTap={"alert": {
+                    "title": "Input", "message": "Please input", "buttons": ["Cancel", "OK"], "input": True}}),
+                _button("LONG_TAP_ALERT", 550, onLongPress={"alert": {
+                    "title": "LONG_TAP_ALERT", "buttons": ["LONG_TAP_ALERT_OK"]}}),
+                _button("DOUBLE_TAP_ALERT", 600, onDoubleTap={"alert": {
+                    "title": "DOUBLE_TAP_ALERT", "buttons": ["DOUBLE_TAP_ALERT_OK"]}}),
+                _button("ListView", 650, onTap={"screen": "list"}),
+                _button("Go to List", 700, onTap={"screen": "list"}),
+            ]},
+            "list": list_screen(),
+        }},
+    },
+}
+
+
+def make_png(width: int, height: int, noise: bool = False, seed: int = 0) -> bytes:
+    """
+    Args:
+        noise: random pixels, the png is about width*height*3 bytes, otherwise a tiny solid image
+    """
+    def _chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+    if noise:
+        rnd = random.Random(seed)
+        raw = b"".join(b"\x00" + rnd.randbytes(width * 3) for _ in range(height))
+        level = 0
+    else:
+        raw = (b"\x00" + b"\xf0\xf0\xf0" * width) * height
+        level = 9
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + _chunk(b"IHDR", ihdr) + _chunk(b"IDAT", zlib.compress(raw, level)) + _chunk(b"IEND", b"")
+
+
+@dataclass
+class Fault:
+    """
+    kind:
+        error: WDA json error, params error="unknown error", message="..."
+        invalid_session, stale_element, crashed, keyboard: shortcuts of error
+        empty: 200 with an empty body
+        status: raw http status, params status=502, body=""
+        disconnect: close the connection without response
+        delay: sleep params seconds=1.0 before the normal response
+    """
+    route: str  # route template (eg: /session/:sid/wda/tap), or "*"
+    kind: str
+    times: Optional[int] = 1  # None means forever
+    probability: float = 1.0
+    params: Dict[str, Any] = field(default_factory=dict)
+    method: Optional[str] = None
+    hits: int = 0
+
+    def match(self, method: str, route: str, rnd: random.Random) -> bool:
+        if self.times is not None and self.hits >= self.times:
+            return False
+        if self.method and self.method != method:
+            return False
+        if self.route != "*" and self.route != route:
+            return False
+        return rnd.random() < self.probability
+
+
+_ERROR_SHORTCUTS = {
+    "invalid_session": ("invalid session id", "Session does not exist"),
+    "stale_element": ("stale element reference", "The previously found element is not present in the current view anymore"),
+    "crashed": ("unknown error", "The application under test with bundle id is not running, possibly crashed"),
+    "keyboard": ("invalid element state", "The on-screen keyboard must be present to send keys"),
+}
+
+_ERROR_STATUS = {
+    "invalid session id": 404, "no such element": 404, "no such alert": 404, "stale element reference": 404,
+    "unknown command": 404, "invalid element state": 400, "invalid argument": 400, "invalid selector": 400,
+}
+
+
+class WDAResponseError(Exception):
+    def __init__(self, error: str, message: str = ""):
+        super().__init__(error, message)
+        self.error = error
+        self.message = message
+
+
+class _App:
+    def __init__(self, bundle_id: str, spec: dict, pid: int):
+        self.bundle_id = bundle_id
+        self.spec = spec
+        self.pid = pid
+        self.screen_name = spec.get("start") or next(iter(spec["screens"]))
+        self.screens = copy.deepcopy(spec["screens"])
+        self.state = 4
+
+    @property
+    def root(self) -> dict:
+        return self.screens[self.screen_name]
+
+
+class MockDevice:
+    """ UI state of the mock device, all methods are called with self.lock held """
+
+    def __init__(self, scenario: Optional[dict] = None):
+        self.scenario = scenario or DEFAULT_SCENARIO
+        dev = self.scenario.get("device", {})
+        self.width = dev.get("width", 414)
+        self.height = dev.get("height", 896)
+        self.scale = dev.get("scale", 2)
+        self.info = dev
+        self.lock = threading.RLock()
+        self.session_id: Optional[str] = None
+        self.session_bundle_id: Optional[str] = None
+        self.orientation = PORTRAIT
+        self.locked = False
+        self.pasteboard = b""
+        self.settings = dict(_DEFAULT_SETTINGS)
+        self.alert: Optional[dict] = None
+        self.focused: Optional[dict] = None
+        self.apps: Dict[str, _App] = {}
+        self._pid = 1000
+        self._element_ids: Dict[int, str] = {}
+        self._elements: Dict[str, dict] = {}
+        self._snapshot: Optional[List[dict]] = None
+        self.current: Optional[_App] = None
+        self.launch(SPRINGBOARD)
+
+    # apps
+    def launch(self, bundle_id: str, relaunch: bool = False) -> _App:
+        spec = self.scenario["apps"].get(bundle_id)
+        if spec is None:
+            raise WDAResponseError("unknown error", "Application '%s' is not installed on the device" % bundle_id)
+        app = self.apps.get(bundle_id)
+        if app is None or relaunch or app.state == 1:
+            self._pid += 1
+            app = self.apps[bundle_id] = _App(bundle_id, spec, self._pid)
+        self.activate(app)
+        return app
+
+    def activate(self, app: _App):
+        if self.current not in (None, app) and self.current.bundle_id != SPRINGBOARD:
+            self.current.state = 3
+        app.state = 4
+        self.current = app
+        self.alert = None
+        self.focused = None
+        self.changed()
+
+    def terminate(self, bundle_id: str) -> bool:
+        app = self.apps.get(bundle_id)
+        if app is None or app.state == 1:
+            return False
+        if self.current is app:
+            self.activate(self.apps[SPRINGBOARD])
+        app.state = 1
+        return True
+
+    def app_state(self, bundle_id: str) -> int:
+        app = self.apps.get(bundle_id)
+        return app.state if app else 1
+
+    def changed(self):
+        self._snapshot = None
+
+    # hierarchy
+    @property
+    def window_size(self) -> Tuple[int, int]:
+        if self.orientation == PORTRAIT:
+            return self.width, self.height
+        return self.height, self.width
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            the visible hierarchy: copies of nodes with absolute rect, computed visible and "_node" refs
+        """
+        if self._snapshot is None:
+            root = self._render(self.current.root, 0, True)
+            if self.alert is not None:
+                root["children"].append(self._alert_node())
+            self._snapshot = [root]
+        return self._snapshot[0]
+
+    def _render(self, node: dict, offset: int, parent_visible: bool) -> dict:
+        x, y, w, h = node.get("rect") or [0, 0, *self.window_size]
+        y -= offset
+        sw, sh = self.window_size
+        on_screen = x < sw and y < sh and x + w > 0 and y + h > 0
+        visible = parent_visible and node.get("visible", True) and on_screen
+        out = {
+            "type": _full_type(node.get("type", "Other")),
+            "name": node.get("name") or node.get("label"),
+            "label": node.get("label") or "",
+            "value": node.get("value"),
+            "rect": {"x": x, "y": y, "width": w, "height": h},
+            "enabled": node.get("enabled", True),
+            "visible": visible,
+            "accessible": node.get("accessible", visible),
+            "selected": node.get("selected", False),
+            "_node": node,
+            "children": [],
+        }
+        child_offset = offset + node.get("_scroll", 0)
+        for child in node.get("children", ()):
+            if node.get("lazy"):
+                cx, cy, cw, ch = child["rect"]
+                cy -= child_offset
+                if not (cy < sh and cy + ch > 0):
+                    continue
+            out["children"].append(self._render(child, child_offset, visible))
+        return out
+
+    def _alert_node(self) -> dict:
+        alert = self.alert
+        sw, sh = self.window_size
+        top = sh // 2 - 100
+        children = [{"type": "XCUIElementTypeStaticText", "name": alert.get("title"), "label": alert.get("title") or "",
+                     "rect": {"x": 40, "y": top + 20, "width": sw - 80, "height": 20}},
+                    {"type": "XCUIElementTypeStaticText", "name": alert.get("message"), "label": alert.get("message") or "",
+                     "rect": {"x": 40, "y": top + 50, "width": sw - 80, "height": 20}}]
+        if alert.get("input"):
+            children.append({"type": "XCUIElementTypeTextField", "name": "ALERT_INPUT", "label": "",
+                             "value": alert.get("text", ""), "_node": alert,
+                             "rect": {"x": 40, "y": top + 80, "width": sw - 80, "height": 30}})
+        buttons = alert.get("buttons") or ["OK"]
+        bw = (sw - 80) // len(buttons)
+        for i, name in enumerate(buttons):
+            children.append({"type": "XCUIElementTypeButton", "name": name, "label": name,
+                             "rect": {"x": 40 + i * bw, "y": top + 140, "width": bw, "height": 44},
+                             "_node": alert.setdefault("_buttons", {}).setdefault(name, {"alertButton": name})})
+        for c in children:
+            c.setdefault("value", None)
+            c.update(enabled=True, visible=True, accessible=True, selected=False, children=[])
+            c.setdefault("_node", c)
+        return {"type": "XCUIElementTypeAlert", "name": alert.get("title"), "label": alert.get("title") or "",
+                "value": None, "rect": {"x": 20, "y": top, "width": sw - 40, "height": 200},
+                "enabled": True, "visible": True, "accessible": True, "selected": False,
+                "_node": alert, "children": children}
+
+    def element_id(self, node: dict) -> str:
+        ref = node["_node"]
+        eid = self._element_ids.get(id(ref))
+        if eid is None:
+            eid = str(uuid.uuid4()).upper()
+            self._element_ids[id(ref)] = eid
+            self._elements[eid] = ref
+        return eid
+
+    def element(self, eid: str) -> dict:
+        """
+        Returns:
+            the rendered node of the element
+
+        Raises:
+            WDAResponseError: stale element reference
+        """
+        ref = self._elements.get(eid)
+        if ref is not None:
+            for node in query.walk({"children": [self.snapshot()]}):
+                if node["_node"] is ref:
+                    return node
+        raise WDAResponseError("stale element reference",
+                               "The previously found element \"%s\" is not present in the current view anymore" % eid)
+
+    def find(self, using: str, value: str) -> List[dict]:
+        try:
+            return query.find({"children": [self.snapshot()]}, using, value)
+        except query.QueryError as e:
+            raise WDAResponseError("invalid selector", str(e))
+
+    def hit_test(self, x: float, y: float, gesture: str) -> Optional[dict]:
+        """ topmost visible node under the point which handles the gesture """
+        nodes = list(query.walk({"children": [self.snapshot()]}))
+        if self.alert is not None:
+            nodes = [n for n in nodes if n.get("_node") is self.alert or "alertButton" in n["_node"]]
+        for node in reversed(nodes):
+            r = node["rect"]
+            if not node["visible"] or not (r["x"] <= x < r["x"] + r["width"] and r["y"] <= y < r["y"] + r["height"]):
+                continue
+            ref = node["_node"]
+            if "alertButton" in ref or ref.get(gesture) or (gesture == "onTap" and node["type"].endswith("TextField")):
+                return node
+        return None
+
+    # gestures
+    def gesture(self, x: float, y: float, gesture: str = "onTap"):
+        node = self.hit_test(x, y, gesture)
+        if node is None:
+            return
+        ref = node["_node"]
+        if not node["enabled"]:
+            return
+        if "alertButton" in ref:
+            self.alert = None
+            self.changed()
+            return
+        if node["type"].endswith("TextField"):
+            self.focused = ref
+        action = ref.get(gesture)
+        if action:
+            self.run_action(action)
+
+    def run_action(self, action: Union[dict, list]):
+        for act in (action if isinstance(action, list) else [action]):
+            if "alert" in act:
+                self.alert = dict(act["alert"], text="")
+            if "screen" in act:
+                self.current.screen_name = act["screen"]
+                self.focused = None
+            if "clear" in act:
+                for node in self._nodes_by_name(act["clear"]):
+                    node["value"] = ""
+            if "set" in act:
+                for node in self._nodes_by_name(act["set"]["name"]):
+                    node["value"] = act["set"]["value"]
+        self.changed()
+
+    def _nodes_by_name(self, name: str) -> List[dict]:
+        root = self.current.root
+        return [n for n in query.walk(root) if (n.get("name") or n.get("label")) == name]
+
+    def drag(self, x1, y1, x2, y2):
+        dy = y1 - y2
+        scrollables = [n for n in query.walk({"children": [self.snapshot()]}) if n["_node"].get("scrollable")]
+        target = None
+        for node in scrollables:
+            r = node["rect"]
+            if r["x"] <= x1 < r["x"] + r["width"] and r["y"] <= y1 < r["y"] + r["height"]:
+                target = node
+        if target is None and scrollables:
+            target = scrollables[0]  # gesture started outside, still scroll the main list
+        if target is None:
+            return
+        ref = target["_node"]
+        content_bottom = max((c["rect"][1] + c["rect"][3] for c in ref.get("children", ())), default=0)
+        max_scroll = max(0, content_bottom - (ref["rect"][1] + ref["rect"][3]))
+        ref["_scroll"] = min(max(ref.get("_scroll", 0) + dy, 0), max_scroll)
+        self.changed()
+
+    def type_text(self, text: str, node: Optional[dict] = None):
+        target = node if node is not None else self.focused
+        if target is None:
+            raise WDAResponseError("invalid element state", "The on-screen keyboard must be present to send keys")
+        target["value"] = (target.get("value") or "") + text
+        self.changed()
+
+
+_DEFAULT_SETTINGS = {
+    "mjpegFixOrientation": False, "boundElementsByIndex": False, "mjpegServerFramerate": 10,
+    "screenshotOrientation": "auto", "reduceMotion": False, "elementResponseAttributes": "type,label",
+    "screenshotQuality": 3, "mjpegScalingFactor": 100, "keyboardPrediction": 0,
+    "defaultActiveApplication": "auto", "mjpegServerScreenshotQuality": 25, "defaultAlertAction": "",
+    "keyboardAutocorrection": 0, "useFirstMatch": False, "shouldUseCompactResponses": True,
+    "customSnapshotTimeout": 15, "dismissAlertButtonSelector": "", "activeAppDetectionPoint": "64.00,64.00",
+    "snapshotMaxDepth": 50, "waitForIdleTimeout": 10, "includeNonModalElements": False,
+    "acceptAlertButtonSelector": "", "animationCoolOffTimeout": 2,
+}
+
+
+def _full_type(t: str) -> str:
+    return t if t.startswith("XCUIElementType") else "XCUIElementType" + t
+
+
+def _xml_escape(s: str) -> str:
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+
+def _source_xml(node: dict, indent: int = 0) -> str:
+    attrs = [("type", node["type"])]
+    for key in ("name", "label", "value"):
+        if node.get(key) not in (None, ""):
+            attrs.append((key, str(node[key])))
+    attrs += [("enabled", str(node["enabled"]).lower()), ("visible", str(node["visible"]).lower()),
+              ("accessible", str(node["accessible"]).lower())]
+    attrs += [(k, str(int(v))) for k, v in node["rect"].items()]
+    head = " " * indent + "<" + node["type"] + "".join(' %s="%s"' % (k, _xml_escape(v)) for k, v in attrs)
+    if not node["children"]:
+        return head + "/>\n"
+    return head + ">\n" + "".join(_source_xml(c, indent + 2) for c in node["children"]) + \
+        " " * indent + "</" + node["type"] + ">\n"
+
+
+def _source_json(node: dict, accessible_only: bool = False) -> dict:
+    out = {
+        "type": node["type"][len("XCUIElementType"):], "name": node["name"], "label": node["label"] or None,
+        "value": node["value"], "rect": node["rect"], "isEnabled": node["enabled"], "isVisible": node["visible"],
+        "isAccessible": node["accessible"], "rawIdentifier": node["name"],
+    }
+    children = [_source_json(c, accessible_only) for c in node["children"]]
+    if accessible_only:
+        children = [c for c in children if c["isAccessible"] or c["children"]]
+    out["children"] = children
+    return out
+
+
+Handler = Callable[..., Any]
+
+
+class MockWDAServer:
+    def __init__(self,
+                 scenario: Optional[dict] = None,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 latency: Union[float, Tuple[float, float]] = 0.0,
+                 route_latency: Optional[Dict[str, float]] = None,
+                 screenshot_size: Optional[int] = None,
+                 compress: bool = False,
+                 unsupported_routes: Tuple[str, ...] = (),
+                 build: Optional[dict] = None,
+                 seed: int = 0):
+        """
+        Args:
+            scenario: apps and screens, default DEFAULT_SCENARIO
+            port: 0 picks a free port, see .url
+            latency: seconds added to every response, or (min, max) for a uniform random latency
+            route_latency: per route template latency, eg {"/screenshot": 0.2}
+            screenshot_size: approximate png size in bytes, default a tiny png of the window size
+            compress: gzip responses when the client sends Accept-Encoding: gzip
+            unsupported_routes: route templates answered with "unknown command", eg ("/session/:sid/wda/tap",)
+                to emulate an older WDA
+            build: "build" of /status, eg {"time": "...", "productBundleIdentifier": "...", "version": "6.0.0"}
+        """
+        self.device = MockDevice(scenario)
+        self.latency = latency
+        self.route_latency = dict(route_latency or {})
+        self.screenshot_size = screenshot_size
+        self.compress = compress
+        self.unsupported_routes = set(unsupported_routes)
+        self.build = build or {"time": "Mar 18 2024 11:29:21",
+                               "productBundleIdentifier": "com.facebook.WebDriverAgentRunner"}
+        self.faults: List[Fault] = []
+        self.requests: Dict[str, int] = {}  # "METHOD route" -> count
+        self._rnd = random.Random(seed)
+        self._screenshot_cache: Dict[tuple, str] = {}
+        self._stats_lock = threading.Lock()
+        self._connections = set()
+        self._routes = self._build_routes()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    @property
+    def url(self) -> str:
+        return "http://%s:%d" % self.address
+
+    def start(self) -> "MockWDAServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-wda", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ stop serving, keep-alive connections are closed too like a killed WDA """
+        self._server.shutdown()
+        self._server.server_close()
+        with self._stats_lock:
+            for conn in self._connections:
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def add_fault(self, route: str, kind: str, times: Optional[int] = 1, probability: float = 1.0,
+                  method: Optional[str] = None, **params) -> Fault:
+        """
+        Inject a fault, eg: server.add_fault("/session/:sid/wda/tap", "error", times=2)
+
+        Returns:
+            Fault, whose hits tells how many times it happened
+        """
+        fault = Fault(route, kind, times, probability, params, method)
+        with self._stats_lock:
+            self.faults.append(fault)
+        return fault
+
+    def clear_faults(self):
+        with self._stats_lock:
+            self.faults.clear()
+
+    def request_count(self, route: str, method: str = "GET") -> int:
+        return self.requests.get(method + " " + route, 0)
+
+    # routing
+    def _build_routes(self) -> List[Tuple[str, re.Pattern, Handler]]:
+        d = self.device
+        routes = [
+            ("GET", "/status", self._status),
+            ("GET", "/health", lambda: "I-AM-ALIVE"),
+            ("GET", "/wda/healthcheck", lambda: None),
+            ("GET", "/wda/locked", lambda: d.locked),
+            ("POST", "/wda/lock", lambda: setattr(d, "locked", True)),
+            ("POST", "/wda/unlock", lambda: setattr(d, "locked", False)),
+            ("POST", "/wda/homescreen", lambda: d.activate(d.launch(SPRINGBOARD))),
+            ("GET", "/wda/activeAppInfo", self._active_app_info),
+            ("GET", "/source", self._source),
+            ("GET", "/wda/accessibleSource", lambda: _source_json(d.snapshot(), accessible_only=True)),
+            ("GET", "/screenshot", self._screenshot),
+            ("POST", "/session", self._create_session),
+            ("GET", "", self._session_info),
+            ("DELETE", "", self._delete_session),
+            ("GET", "/wda/screen", lambda: {"statusBarSize": {"width": d.window_size[0], "height": 44},
+                                            "scale": d.scale}),
+            ("GET", "/wda/batteryInfo", lambda: {"level": 0.58, "state": 2}),
+            ("GET", "/wda/device/info", self._device_info),
+            ("POST", "/wda/setPasteboard", self._set_pasteboard),
+            ("POST", "/wda/getPasteboard", lambda: base64.b64encode(d.pasteboard).decode()),
+            ("POST", "/wda/apps/launch", self._app_launch),
+            ("POST", "/wda/apps/activate", lambda data: d.activate(d.launch(data["bundleId"]))),
+            ("POST", "/wda/apps/terminate", lambda data: d.terminate(data["bundleId"])),
+            ("POST", "/wda/apps/state", lambda data: d.app_state(data["bundleId"])),
+            ("GET", "/wda/apps/list", lambda: [{"pid": d.current.pid, "bundleId": d.current.bundle_id}]),
+            ("POST", "/wda/deactivateApp", lambda data: None),
+            ("POST", "/wda/tap", lambda data: d.gesture(data["x"], data["y"])),
+            ("POST", r"/wda/tap/(?P<eid>[^/]+)", self._tap_legacy),
+            ("POST", "/wda/doubleTap", lambda data: d.gesture(data["x"], data["y"], "onDoubleTap")),
+            ("POST", "/wda/touchAndHold", lambda data: d.gesture(data["x"], data["y"], "onLongPress")),
+            ("POST", "/wda/dragfromtoforduration",
+             lambda data: d.drag(data["fromX"], data["fromY"], data["toX"], data["toY"])),
+            ("POST", "/wda/drag", lambda data: d.drag(data["fromX"], data["fromY"], data["toX"], data["toY"])),
+            ("GET", "/orientation", lambda: d.orientation),
+            ("POST", "/orientation", self._set_orientation),
+            ("GET", "/window/size", lambda: dict(zip(("width", "height"), d.window_size))),
+            ("POST", "/wda/keys", lambda data: d.type_text("".join(data["value"]))),
+            ("POST", "/wda/pressButton", lambda data: None),
+            ("POST", "/wda/keyboard/dismiss", self._keyboard_dismiss),
+            ("GET", "/appium/settings", lambda: dict(d.settings)),
+            ("POST", "/appium/settings", self._update_settings),
+            ("GET", "/alert/text", self._alert_text),
+            ("POST", "/alert/text", self._set_alert_text),
+            ("POST", "/alert/accept", lambda data=None: self._close_alert(data, accept=True)),
+            ("POST", "/alert/dismiss", lambda data=None: self._close_alert(data, accept=False)),
+            ("GET", "/wda/alert/buttons", lambda: self._require_alert().get("buttons") or ["OK"]),
+            ("POST", "/elements", lambda data: [self._element_ref(n) for n in d.find(data["using"], data["value"])]),
+            ("POST", "/element", self._find_element),
+            ("GET", r"/element/(?P<eid>[^/]+)/rect", lambda eid: d.element(eid)["rect"]),
+            ("GET", r"/element/(?P<eid>[^/]+)/text",
+             lambda eid: d.element(eid)["label"] or d.element(eid)["value"]),
+            ("GET", r"/element/(?P<eid>[^/]+)/name", lambda eid: d.element(eid)["type"]),
+            ("GET", r"/element/(?P<eid>[^/]+)/displayed", lambda eid: d.element(eid)["visible"]),
+            ("GET", r"/element/(?P<eid>[^/]+)/enabled", lambda eid: d.element(eid)["enabled"]),
+            ("GET", r"/element/(?P<eid>[^/]+)/selected", lambda eid: d.element(eid)["selected"]),
+            ("GET", r"/element/(?P<eid>[^/]+)/attribute/(?P<name>\w+)",
+             lambda eid, name: query.attribute(d.element(eid), name)),
+            ("POST", r"/element/(?P<eid>[^/]+)/click", self._tap_element),
+            ("POST", r"/element/(?P<eid>[^/]+)/value", self._set_value),
+            ("POST", r"/element/(?P<eid>[^/]+)/clear", self._clear),
+            ("GET", r"/wda/element/(?P<eid>[^/]+)/accessible", lambda eid: d.element(eid)["accessible"]),
+            ("GET", r"/wda/element/(?P<eid>[^/]+)/accessibilityContainer", lambda eid: d.element(eid).get("accessibilityContainer", False)),
+            ("POST", r"/wda/element/(?P<eid>[^/]+)/touchAndHold", lambda eid, data=None: self._element_gesture(eid, "onLongPress")),
+            ("POST", r"/wda/element/(?P<eid>[^/]+)/doubleTap", lambda eid, data=None: self._element_gesture(eid, "onDoubleTap")),
+        ]
+        return [(method, re.compile(pattern + "$"), handler) for method, pattern, handler in routes]
+
+    def _dispatch(self, method: str, path: str, data) -> Tuple[Any, Optional[str]]:
+        """
+        Returns:
+            (value, session id of the response)
+        """
+        d = self.device
+        path, _, qs = path.partition("?")
+        m = re.match(r"/session/([^/]+)(/.*)?$", path)
+        sid = None
+        if m:
+            sid, path = m.group(1), (m.group(2) or "").rstrip("/")
+            if sid != d.session_id:
+                raise WDAResponseError("invalid session id", "Session does not exist")
+        for route_method, pattern, handler in self._routes:
+            if route_method != method:
+                continue
+            rm = pattern.match(path)
+            if rm is None or (pattern.pattern == "$" and sid is None):
+                continue
+            kwargs = rm.groupdict()
+            arg_names = handler.__code__.co_varnames[:handler.__code__.co_argcount]
+            if "data" in arg_names:
+                kwargs["data"] = data or {}
+            if "params" in arg_names:
+                kwargs["params"] = dict(parse_qsl(qs))
+            return handler(**kwargs), d.session_id
+        raise WDAResponseError("unknown command", "Unhandled endpoint: %s -- http://%s with parameters {\n}" % (
+            path, self._server.server_address[0]))
+
+    # handlers
+    def _status(self):
+        info = self.device.info
+        return {
+            "build": dict(self.build),
+            "os": {"testmanagerdVersion": 28, "name": "iOS", "sdkVersion": info.get("sdkVersion", "16.4"),
+                   "version": info.get("version", "16.3.1")},
+            "device": "iphone",
+            "ios": {"ip": "127.0.0.1"},
+            "message": "WebDriverAgent is ready to accept commands",
+            "state": "success",
+            "ready": True,
+        }
+
+    def _active_app_info(self):
+        app = self.device.current
+        return {"processArguments": {"env": {}, "args": []}, "name": "", "pid": app.pid,
+                "bundleId": app.bundle_id}
+
+    def _device_info(self):
+        info = self.device.info
+        return {"timeZone": "GMT+0800", "currentLocale": "en_US", "model": info.get("model", "iPhone"),
+                "uuid": "25E3142B-303E-41FE-9F6A-2C303CB66FBC", "thermalState": 1, "userInterfaceIdiom": 0,
+                "userInterfaceStyle": "light", "name": info.get("name", "iPhone"), "isSimulator": False}
+
+    def _source(self, params):
+        snapshot = self.device.snapshot()
+        if params.get("format") == "json":
+            return _source_json(snapshot)
+        return '<?xml version="1.0" encoding="UTF-8"?>\n' + _source_xml(snapshot)
+
+    def _screenshot(self):
+        w, h = self.device.window_size
+        w, h = w * self.device.scale, h * self.device.scale
+        key = (w, h, self.screenshot_size)
+        if key not in self._screenshot_cache:
+            if self.screenshot_size:
+                png = make_png(w, max(1, self.screenshot_size // (w * 3 + 1)), noise=True)
+            else:
+                png = make_png(w, h)
+            self._screenshot_cache[key] = base64.b64encode(png).decode()
+        return self._screenshot_cache[key]
+
+    def _create_session(self, data):
+        d = self.device
+        caps = (data.get("capabilities") or {}).get("alwaysMatch") or data.get("desiredCapabilities") or {}
+        bundle_id = caps.get("bundleId")
+        if bundle_id:
+            d.launch(bundle_id, relaunch=True)
+        d.session_id = str(uuid.uuid4()).upper()
+        d.session_bundle_id = bundle_id
+        return {"sessionId": d.session_id, "capabilities": {
+            "device": "iphone", "browserName": d.current.spec.get("name", ""),
+            "sdkVersion": d.info.get("sdkVersion", "16.4"), "CFBundleIdentifier": d.current.bundle_id}}
+
+    def _session_info(self):
+        d = self.device
+        return {"sessionId": d.session_id, "capabilities": {"CFBundleIdentifier": d.session_bundle_id}}
+
+    def _delete_session(self):
+        self.device.session_id = None
+        self.device.session_bundle_id = None
+        return None
+
+    def _set_pasteboard(self, data):
+        self.device.pasteboard = base64.b64decode(data.get("content", ""))
+
+    def _app_launch(self, data):
+        self.device.launch(data["bundleId"])
+
+    def _set_orientation(self, data):
+        value = data.get("orientation")
+        if value not in (PORTRAIT, LANDSCAPE):
+            raise WDAResponseError("unknown error", "Unable To Rotate Device")
+        self.device.orientation = value
+        self.device.changed()
+
+    def _keyboard_dismiss(self):
+        if self.device.focused is None:
+            raise WDAResponseError("invalid element state", "The keyboard cannot be dismissed")
+        self.device.focused = None
+
+    def _update_settings(self, data):
+        self.device.settings.update(data.get("settings") or {})
+        return dict(self.device.settings)
+
+    def _require_alert(self) -> dict:
+        if self.device.alert is None:
+            raise WDAResponseError("no such alert",
+                                   "An attempt was made to operate on a modal dialog when one was not open")
+        return self.device.alert
+
+    def _alert_text(self):
+        alert = self._require_alert()
+        return "\n".join(s for s in (alert.get("title"), alert.get("message")) if s)
+
+    def _set_alert_text(self, data):
+        alert = self._require_alert()
+        if not alert.get("input"):
+            raise WDAResponseError("unknown error", "The alert does not have a text field")
+        value = data.get("value")
+        alert["text"] = "".join(value) if isinstance(value, list) else value
+
+    def _close_alert(self, data, accept: bool):
+        alert = self._require_alert()
+        buttons = alert.get("buttons") or ["OK"]
+        name = (data or {}).get("name")
+        if name and name not in buttons:
+            raise WDAResponseError("invalid element state", "Failed to find button with label '%s'" % name)
+        self.device.alert = None
+        self.device.changed()
+
+    def _element_ref(self, node: dict) -> dict:
+        eid = self.device.element_id(node)
+        return {"ELEMENT": eid, "element-6066-11e4-a52e-4f735466cecf": eid}
+
+    def _find_element(self, data):
+        nodes = self.device.find(data["using"], data["value"])
+        if not nodes:
+            raise WDAResponseError("no such element", "unable to find an element using '%s', value '%s'" % (
+                data["using"], data["value"]))
+        return self._element_ref(nodes[0])
+
+    def _element_gesture(self, eid: str, gesture: str):
+        r = self.device.element(eid)["rect"]
+        self.device.gesture(r["x"] + r["width"] / 2, r["y"] + r["height"] / 2, gesture)
+
+    def _tap_legacy(self, eid: str, data):
+        """ WDA before 6.0: /wda/tap/0 taps x, y of the screen, otherwise x, y is relative to the element """
+        if eid == "0":
+            self.device.gesture(data["x"], data["y"])
+            return
+        r = self.device.element(eid)["rect"]
+        self.device.gesture(r["x"] + data.get("x", r["width"] / 2), r["y"] + data.get("y", r["height"] / 2))
+
+    def _tap_element(self, eid: str, data=None):
+        self._element_gesture(eid, "onTap")
+
+    def _set_value(self, eid: str, data):
+        node = self.device.element(eid)
+        value = data.get("value", data.get("text", ""))
+        if isinstance(value, list):
+            value = "".join(value)
+        self.device.focused = node["_node"]
+        self.device.type_text(value, node["_node"])
+
+    def _clear(self, eid: str, data=None):
+        node = self.device.element(eid)
+        node["_node"]["value"] = ""
+        self.device.changed()
+
+    # http
+    def _delay(self, route: str):
+        latency = self.route_latency.get(route, self.latency)
+        if isinstance(latency, (tuple, list)):
+            latency = self._rnd.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+    def _take_fault(self, method: str, route: str) -> Optional[Fault]:
+        with self._stats_lock:
+            key = method + " " + route
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for fault in self.faults:
+                if fault.match(method, route, self._rnd):
+                    fault.hits += 1
+                    return fault
+        return None
+
+    def handle(self, method: str, path: str, data) -> Tuple[int, Optional[bytes]]:
+        """
+        Returns:
+            (http status, body), body None means close the connection without response
+        """
+        route = route_template(path)
+        fault = self._take_fault(method, route)
+        self._delay(route)
+        if fault is not None:
+            if fault.kind == "disconnect":
+                return 0, None
+            if fault.kind == "empty":
+                return 200, b""
+            if fault.kind == "status":
+                return fault.params.get("status", 502), fault.params.get("body", "").encode()
+            if fault.kind == "delay":
+                time.sleep(fault.params.get("seconds", 1.0))
+            else:
+                error, message = _ERROR_SHORTCUTS.get(fault.kind, (None, None))
+                error = fault.params.get("error", error or "unknown error")
+                message = fault.params.get("message", message or "injected fault")
+                return self._error_body(error, message)
+        if route in self.unsupported_routes:
+            return self._error_body("unknown command", "Unhandled endpoint: %s" % path)
+
+        with self.device.lock:
+            try:
+                value, sid = self._dispatch(method, path, data)
+            except WDAResponseError as e:
+                return self._error_body(e.error, e.message)
+            except (KeyError, TypeError) as e:
+                return self._error_body("invalid argument", "missing or invalid parameter: %s" % e)
+        if route == "/screenshot" or route == "/session/:sid/screenshot":
+            # NSJSONSerialization escapes "/"
+            return 200, ('{"value":"%s","sessionId":%s}' % (value.replace("/", "\\/"), json.dumps(sid))).encode()
+        return 200, json.dumps({"value": value, "sessionId": sid}).encode()
+
+    def _error_body(self, error: str, message: str) -> Tuple[int, bytes]:
+        body = {"value": {"error": error, "message": message, "traceback": ""},
+                "sessionId": self.device.session_id}
+        return _ERROR_STATUS.get(error, 500), json.dumps(body).encode()
+
+    def _handler_class(self):
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            server_version = "WebDriverAgent/1.0"
+            disable_nagle_algorithm = True  # headers and body are written separately
+
+            def _serve(self, method: str):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                try:
+                    data = json.loads(raw) if raw else None
+                except ValueError:
+                    data = None
+                status, body = server.handle(method, self.path, data)
+                if body is None:
+                    self.close_connection = True
+                    return
+                headers = {"Content-Type": "application/json;charset=UTF-8"}
+                if server.compress and body and "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body, 1)
+                    headers["Content-Encoding"] = "gzip"
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._serve("GET")
+
+            def do_POST(self):
+                self._serve("POST")
+
+            def do_DELETE(self):
+                self._serve("DELETE")
+
+            def setup(self):
+                super().setup()
+                with server._stats_lock:
+                    server._connections.add(self.connection)
+
+            def finish(self):
+                with server._stats_lock:
+                    server._connections.discard(self.connection)
+                super().finish()
+
+            def log_message(self, format, *args):
+                pass
+
+        return _Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="mock WebDriverAgent server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--screenshot-size", type=int, help="approximate png size in bytes")
+    parser.add_argument("--scenario", help="scenario json file, default is the e2e test app")
+    parser.add_argument("--gzip", action="store_true", help="gzip responses when accepted")
+    args = parser.parse_args()
+
+    scenario = None
+    if args.scenario:
+        with open(args.scenario, "r", encoding="utf-8") as f:
+            scenario = json.load(f)
+    server = MockWDAServer(scenario, args.host, args.port, latency=args.latency,
+                           screenshot_size=args.screenshot_size, compress=args.gzip)
+    print("mock WDA listening on", server.url)
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -5,14 +5,26 @@
 """
 
 import json
-from http.client import HTTPConnection, HTTPSConnection, HTTPResponse
+import socket
+from typing import BinaryIO, Optional
+import time
+from http.client import HTTPConnection, HTTPSConnection, HTTPResponse, IncompleteRead, RemoteDisconnected
 from urllib.parse import urlparse
 
+from wda.usbmux.compression import ACCEPT_ENCODING, DecodingReader, TransferStats, decode_body, should_compress
 from wda.usbmux.exceptions import HTTPError, MuxConnectError, MuxError
+from wda.usbmux.pool import ConnectionPool
 from wda.usbmux.pyusbmux import select_device
+from wda.usbmux.streaming import read_base64_value
 
 _DEFAULT_CHUNK_SIZE = 4096
 
+# errors raised when the server closed an idle keep-alive connection
+_STALE_CONNECTION_ERRORS = (ConnectionError, RemoteDisconnected)
+
+# requests which can be sent again after WDA may have received them
+_IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+
 def http_create(url: str) -> HTTPConnection:
     u = urlparse(url)
     if u.scheme == "http+usbmux":
@@ -27,53 +39,293 @@ def http_create(url: str) -> HTTPConnection:
         raise ValueError(f"unknown scheme: {u.scheme}")
 
 
+_pool = ConnectionPool(http_create)
+
+
+def probe(url: str, timeout: float = 1.0) -> bool:
+    """
+    cheap check whether something listens on the port of url, no HTTP request is sent.
+    A tcp connect for http(s), a usbmuxd Connect to the device port for http+usbmux
+    """
+    u = urlparse(url)
+    try:
+        if u.scheme == "http+usbmux":
+            udid, device_wda_port = u.netloc.split(":")
+            device = select_device(udid)
+            if device is None:
+                return False
+            sock = device.connect(int(device_wda_port))
+        else:
+            sock = socket.create_connection((u.hostname, u.port or (443 if u.scheme == "https" else 80)), timeout)
+    except (OSError, MuxError):
+        return False
+    sock.close()
+    return True
+
+
+def connection_stats() -> dict:
+    """ counters of the keep-alive connection pool: created, reused, reconnects, discarded """
+    return _pool.stats.as_dict()
+
+
+_transfer_stats = TransferStats()
+
+
+def transfer_stats() -> dict:
+    """ response body bytes on the wire vs decoded, see wda.usbmux.compression """
+    return _transfer_stats.as_dict()
+
+
+def close_connections(url: str = None):
+    """ close idle keep-alive connections of url's endpoint, or all if url is None """
+    _pool.clear(url)
+
+
 class HTTPResponseWrapper:
-    def __init__(self, content: bytes, status_code: int):
-        self.content = content
+    def __init__(self, content: bytes, status_code: int, bytes_sent: int = 0, bytes_received: int = 0):
+        """
+        Args:
+            bytes_sent, bytes_received: body size on the wire
+        """
+        self._content = content
         self.status_code = status_code
-    
+        self.bytes_sent = bytes_sent
+        self.bytes_received = bytes_received
+        self._text = None
+
+    @property
+    def content(self) -> bytes:
+        if self._content is None:
+            self._content = self._text.encode("utf-8")
+        return self._content
+
     def json(self):
-        return json.loads(self.content)
+        # json.loads decodes bytes to str anyway. Decode once and drop the raw buffer before parsing,
+        # so a big body (eg: screenshot) costs 2x its size at peak instead of 3x
+        text = self.text
+        self._content = None
+        return json.loads(text)
 
     @property
     def text(self) -> str:
-        return self.content.decode("utf-8")
+        if self._text is None:
+            self._text = self._content.decode("utf-8")
+        return self._text
 
     def getcode(self) -> int:
         return self.status_code
     
 
-def fetch(url: str, method="GET", data=None, timeout=None, chunk_size: int = _DEFAULT_CHUNK_SIZE) -> HTTPResponseWrapper:
+def fetch(url: str, method="GET", data=None, timeout=None, chunk_size: int = _DEFAULT_CHUNK_SIZE,
+          value_sink: Optional[BinaryIO] = None, compress: Optional[bool] = None) -> HTTPResponseWrapper:
     """
     thread safe http request
 
+    Args:
+        value_sink: when set, the base64 string "value" of the response is decoded into it while
+            receiving, and the returned json contains "value": "" instead (eg: screenshot)
+        compress: send Accept-Encoding: gzip, deflate. Default is decided by url path,
+            see wda.usbmux.compression.COMPRESSED_PATHS
+
     Raises:
         HTTPError
     """
     try:
         method = method.upper()
-        conn = http_create(url)
-        conn.timeout = timeout
         u = urlparse(url)
         urlpath = url[len(u.scheme) + len(u.netloc) + 3:]
 
-        if not data:
-            conn.request(method, urlpath)
+        body, headers = None, {}
+        if data:
+            body = json.dumps(data)
+            headers["Content-Type"] = "application/json"
+        if should_compress(urlpath) if compress is None else compress:
+            headers["Accept-Encoding"] = ACCEPT_ENCODING
+
+        while True:
+            conn, reused = _pool.acquire(url)
+            written = False
+            try:
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                conn.request(method, urlpath, body, headers=headers)
+                written = True
+                response = conn.getresponse()
+            except _STALE_CONNECTION_ERRORS:
+                _pool.discard(conn)
+                if not reused or (written and method not in _IDEMPOTENT_METHODS):
+                    raise  # WDA may have run it, a tap must not run twice
+                # idle keep-alive connection was closed by server, retry with another one
+                _pool.mark_reconnect()
+                continue
+            except BaseException:
+                _pool.discard(conn)
+                raise
+            break
+
+        try:
+            encoding = response.getheader("Content-Encoding", "").strip().lower()
+            if encoding == "identity":
+                encoding = ""
+            if value_sink is not None:
+                reader = DecodingReader(response, encoding)
+                content = read_base64_value(reader, value_sink)
+                wire_size = reader.wire_bytes
+                _transfer_stats.add(wire_size, reader.decoded_bytes, bool(encoding))
+            else:
+                content = _read_response(response, chunk_size)
+                wire_size = len(content)
+                if encoding:
+                    content = decode_body(content, encoding)
+                _transfer_stats.add(wire_size, len(content), bool(encoding))
+        except BaseException:
+            _pool.discard(conn)
+            raise
+        if response.will_close:
+            _pool.discard(conn)
         else:
-            conn.request(method, urlpath, json.dumps(data), headers={"Content-Type": "application/json"})
-        response = conn.getresponse()
-        content = _read_response(response, chunk_size)
-        resp = HTTPResponseWrapper(content, response.status)
-        return resp
+            _pool.release(url, conn)
+        return HTTPResponseWrapper(content, response.status, len(body) if body else 0, wire_size)
     except Exception as e:
         raise HTTPError(e)
 
 
-def _read_response(response:HTTPResponse, chunk_size: int = _DEFAULT_CHUNK_SIZE) -> bytearray:
-    content = bytearray()
-    while True:
-        chunk = response.read(chunk_size)
-        if len(chunk) == 0:
-            break
-        content.extend(chunk)
+class PreparedRequest:
+    """
+    A request encoded ahead of time on an open keep-alive connection of the pool,
+    send() only writes the bytes, see wda.broadcast
+    """
+
+    def __init__(self, url: str, method: str = "GET", data=None, timeout: Optional[float] = None):
+        """
+        Raises:
+            HTTPError
+        """
+        self.url = url
+        self.method = method.upper()
+        self.timeout = timeout
+        u = urlparse(url)
+        body = json.dumps(data).encode("utf-8") if data else b""
+        lines = ["%s %s HTTP/1.1" % (self.method, url[len(u.scheme) + len(u.netloc) + 3:] or "/"),
+                 "Host: " + u.netloc, "Accept-Encoding: identity"]
+        if body:
+            lines.append("Content-Type: application/json")
+        if body or self.method in ("POST", "PUT", "PATCH"):
+            lines.append("Content-Length: %d" % len(body))
+        self.body_size = len(body)
+        self.raw = ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8") + body
+        self.sent_at: Optional[float] = None  # time.perf_counter() when the first byte was written
+        self._conn = None
+        self._reused = False
+        try:
+            self._connect()
+        except Exception as e:
+            raise HTTPError(e)
+
+    def _connect(self):
+        self._conn, self._reused = _pool.acquire(self.url)
+        self._conn.timeout = self.timeout
+        if self._conn.sock is None:
+            self._conn.connect()
+        self._conn.sock.settimeout(self.timeout)
+
+    def send(self) -> float:
+        """
+        Returns:
+            time.perf_counter() before writing
+
+        Raises:
+            HTTPError
+        """
+        written = 0
+        try:
+            self.sent_at = time.perf_counter()
+            view = memoryview(self.raw)
+            while written < len(view):
+                written += self._conn.sock.send(view[written:])
+        except _STALE_CONNECTION_ERRORS as e:
+            self._reconnect(e, written)
+        except Exception as e:
+            self.close()
+            raise HTTPError(e)
+        return self.sent_at
+
+    def _reconnect(self, err: Exception, written: int):
+        """
+        idle keep-alive connection was closed by server, send again on a new one.
+        A request which may have reached WDA is only sent again when it is idempotent, a tap must not run twice
+        """
+        self.close()
+        if not self._reused or (written and self.method not in _IDEMPOTENT_METHODS):
+            raise HTTPError(err)
+        _pool.mark_reconnect()
+        try:
+            self._connect()
+            self._conn.sock.sendall(self.raw)
+        except Exception as e:
+            self.close()
+            raise HTTPError(e)
+        self._reused = False
+
+    def response(self) -> HTTPResponseWrapper:
+        """
+        Raises:
+            HTTPError
+        """
+        try:
+            response = HTTPResponse(self._conn.sock, method=self.method)
+            response.begin()
+        except _STALE_CONNECTION_ERRORS as e:
+            self._reconnect(e, len(self.raw))
+            return self.response()
+        except Exception as e:
+            self.close()
+            raise HTTPError(e)
+        try:
+            content = _read_response(response)
+        except Exception as e:
+            self.close()
+            raise HTTPError(e)
+        finally:
+            response.close()  # the socket stays open, only the file object is closed
+        _transfer_stats.add(len(content), len(content), False)
+        conn, self._conn = self._conn, None
+        if response.will_close:
+            _pool.discard(conn)
+        else:
+            _pool.release(self.url, conn)
+        return HTTPResponseWrapper(content, response.status, self.body_size, len(content))
+
+    def close(self):
+        """ drop the connection, the request can not be sent any more """
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            _pool.discard(conn)
+
+
+def _read_response(response: HTTPResponse, chunk_size: int = _DEFAULT_CHUNK_SIZE) -> bytearray:
+    """
+    When Content-Length is known, the body is read into a preallocated buffer without extra copies.
+    Otherwise (eg: chunked encoding) it is read chunk by chunk.
+    """
+    length = response.length
+    if length is None:
+        content = bytearray()
+        while True:
+            chunk = response.read(chunk_size)
+            if len(chunk) == 0:
+                break
+            content.extend(chunk)
+        return content
+
+    content = bytearray(length)
+    view = memoryview(content)
+    pos = 0
+    while pos < length:
+        n = response.readinto(view[pos:])
+        if not n:
+            raise IncompleteRead(bytes(view[:pos]), length - pos)
+        pos += n
+    view.release()
     return content
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+asyncio version of the usbmux transport
+
+- AsyncMuxConnection: usbmuxd client over asyncio streams (BINARY and PLIST protocol)
+- fetch: HTTP/1.1 request over http, https and http+usbmux urls with keep-alive connections
+"""
+
+import asyncio
+import json
+import plistlib
+import socket
+import weakref
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from wda.usbmux import _IDEMPOTENT_METHODS, HTTPResponseWrapper
+from wda.usbmux.exceptions import BadCommandError, BadDevError, HTTPError, MuxConnectError, \
+    MuxConnectToUsbmuxdError, MuxError, MuxVersionError
+from wda.usbmux.pyusbmux import MuxConnection, MuxDevice, _protocol_versions, _select_from, \
+    device_directory, usbmuxd_msgtype, usbmuxd_request, usbmuxd_response, usbmuxd_result, usbmuxd_version
+
+Streams = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+async def _open_usbmux_streams(usbmux_address: Optional[str] = None) -> Streams:
+    address, family = MuxConnection.resolve_address(usbmux_address)
+    try:
+        if family == socket.AF_UNIX:
+            return await asyncio.open_unix_connection(address)
+        return await asyncio.open_connection(*address)
+    except (ConnectionRefusedError, FileNotFoundError):
+        raise MuxConnectToUsbmuxdError()
+
+
+async def _read_packet(reader: asyncio.StreamReader):
+    """ read one length prefixed usbmuxd packet """
+    head = await reader.readexactly(4)
+    length = int.from_bytes(head, "little")
+    if length < 16:
+        raise MuxError(f"invalid usbmuxd packet length: {length}")
+    return usbmuxd_response.parse(head + await reader.readexactly(length - 4))
+
+
+class AsyncMuxConnection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, version,
+                 usbmux_address: Optional[str] = None):
+        self._reader = reader
+        self._writer = writer
+        self._version = version
+        self._usbmux_address = usbmux_address
+        self._tag = 1
+        self._connected = False
+
+    @staticmethod
+    async def probe_version(usbmux_address: Optional[str] = None):
+        """ same as MuxConnection.probe_version """
+        reader, writer = await _open_usbmux_streams(usbmux_address)
+        try:
+            writer.write(usbmuxd_request.build({
+                'header': {'version': usbmuxd_version.PLIST, 'message': usbmuxd_msgtype.PLIST, 'tag': 1},
+                'data': plistlib.dumps({'MessageType': 'ReadBUID'})
+            }))
+            await writer.drain()
+            response = await _read_packet(reader)
+        finally:
+            writer.close()
+        if response.header.version not in (usbmuxd_version.BINARY, usbmuxd_version.PLIST):
+            raise MuxVersionError(f'usbmuxd returned unsupported version: {response.header.version}')
+        return response.header.version
+
+    @classmethod
+    async def create(cls, usbmux_address: Optional[str] = None) -> "AsyncMuxConnection":
+        # shares the protocol version cache with MuxConnection.create
+        usbmux_address = MuxConnection.address_key(usbmux_address)
+        version = _protocol_versions.get(usbmux_address)
+        if version is None:
+            version = await cls.probe_version(usbmux_address)
+            _protocol_versions[usbmux_address] = version
+        reader, writer = await _open_usbmux_streams(usbmux_address)
+        return cls(reader, writer, version, usbmux_address)
+
+    @property
+    def is_plist(self) -> bool:
+        return self._version == usbmuxd_version.PLIST
+
+    def close(self):
+        self._writer.close()
+
+    async def _send(self, message, data=b''):
+        if self._connected:
+            raise MuxError('Mux is connected, cannot issue control packets')
+        if self.is_plist:
+            request = {'ClientVersionString': 'qt4i-usbmuxd', 'ProgName': 'pymobiledevice3', 'kLibUSBMuxVersion': 3}
+            request.update(message)
+            message, data = usbmuxd_msgtype.PLIST, plistlib.dumps(request)
+        self._writer.write(usbmuxd_request.build({
+            'header': {'version': self._version, 'message': message, 'tag': self._tag},
+            'data': data,
+        }))
+        self._tag += 1
+        await self._writer.drain()
+
+    async def _receive(self):
+        response = await _read_packet(self._reader)
+        if response.header.version != self._version:
+            MuxConnection.forget_version(self._usbmux_address)
+            raise MuxVersionError(f'usbmuxd replied with version {response.header.version}, '
+                                  f'expected {self._version}')
+        if self.is_plist:
+            if response.header.message != usbmuxd_msgtype.PLIST:
+                raise MuxError(f'Received non-plist type {response}')
+            return plistlib.loads(response.data)
+        return response
+
+    def _check_result(self, response, what: str):
+        if self.is_plist:
+            if response.get('MessageType') != 'Result':
+                raise MuxError(f'got an invalid message: {response}')
+            number = response['Number']
+        else:
+            if response.header.message != usbmuxd_msgtype.RESULT:
+                raise MuxError(f'unexpected message type received: {response}')
+            number = int(response.data.result)
+        if number != 0:
+            exception = {
+                int(usbmuxd_result.BADCOMMAND): BadCommandError,
+                int(usbmuxd_result.BADDEV): BadDevError,
+                int(usbmuxd_result.CONNREFUSED): MuxConnectError,
+                int(usbmuxd_result.BADVERSION): MuxVersionError,
+            }.get(number, MuxError)
+            if exception is MuxVersionError:
+                MuxConnection.forget_version(self._usbmux_address)
+            elif exception is BadDevError:
+                device_directory(self._usbmux_address).invalidate()
+            raise exception(f'{what} failed: {response}')
+
+    async def list_devices(self, timeout: float = 0.1) -> List[MuxDevice]:
+        if self.is_plist:
+            await self._send({'MessageType': 'ListDevices'})
+            devices = []
+            for item in (await self._receive())['DeviceList']:
+                if item['MessageType'] == 'Attached':
+                    devices.append(MuxDevice(item['DeviceID'], item['Properties']['SerialNumber'],
+                                             item['Properties']['ConnectionType']))
+            return devices
+
+        # binary protocol: listen and collect the device records pushed during timeout
+        await self._send(usbmuxd_msgtype.LISTEN)
+        self._check_result(await self._receive(), 'Listen')
+        devices: Dict[int, MuxDevice] = {}
+        loop = asyncio.get_running_loop()
+        end = loop.time() + timeout
+        while True:
+            left = end - loop.time()
+            if left <= 0:
+                break
+            try:
+                response = await asyncio.wait_for(self._receive(), left)
+            except asyncio.TimeoutError:
+                break
+            if response.header.message == usbmuxd_msgtype.ADD:
+                devices[response.data.device_id] = MuxDevice(response.data.device_id,
+                                                             response.data.serial_number, 'USB')
+            elif response.header.message == usbmuxd_msgtype.REMOVE:
+                devices.pop(response.data.device_id, None)
+        return list(devices.values())
+
+    async def connect(self, device: MuxDevice, port: int) -> Streams:
+        """ after connect, the streams are a tunnel to port on device """
+        if self.is_plist:
+            await self._send({'MessageType': 'Connect', 'DeviceID': device.devid, 'PortNumber': socket.htons(port)})
+        else:
+            await self._send(usbmuxd_msgtype.CONNECT, {'device_id': device.devid, 'port': socket.htons(port)})
+        response = await self._receive()
+        try:
+            self._check_result(response, f'Connect to {device.serial}:{port}')
+        except MuxError:
+            self.close()
+            raise
+        self._connected = True
+        return self._reader, self._writer
+
+
+async def list_devices(usbmux_address: Optional[str] = None) -> List[MuxDevice]:
+    mux = await AsyncMuxConnection.create(usbmux_address)
+    try:
+        return await mux.list_devices()
+    finally:
+        mux.close()
+
+
+async def select_device(udid: str = None, connection_type: str = None,
+                        usbmux_address: Optional[str] = None) -> Optional[MuxDevice]:
+    """ same as pyusbmux.select_device, shares the process-wide DeviceDirectory """
+    directory = device_directory(usbmux_address)
+    device = directory.peek(udid, connection_type)
+    if device is not None:
+        return device
+    devices = await list_devices(usbmux_address)
+    directory.update(devices)
+    return _select_from(devices, udid, connection_type)
+
+
+async def _open_connection(url: str) -> Streams:
+    u = urlparse(url)
+    if u.scheme == "http+usbmux":
+        udid, device_wda_port = u.netloc.split(":")
+        device = await select_device(udid)
+        if device is None:
+            raise MuxError(f"device {udid} not found")
+        mux = await AsyncMuxConnection.create()
+        return await mux.connect(device, int(device_wda_port))
+    elif u.scheme == "http":
+        return await asyncio.open_connection(u.hostname, u.port or 80)
+    elif u.scheme == "https":
+        return await asyncio.open_connection(u.hostname, u.port or 443, ssl=True,
+                                             server_hostname=u.hostname)
+    else:
+        raise ValueError(f"unknown scheme: {u.scheme}")
+
+
+class _AsyncConnectionPool:
+    """ idle keep-alive streams of one event loop, keyed by scheme://netloc """
+
+    def __init__(self, max_idle: int = 4):
+        self._max_idle = max_idle
+        self._idle: Dict[str, List[Streams]] = {}
+
+    async def acquire(self, key: str, url: str) -> Tuple[Streams, bool]:
+        idle = self._idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return (reader, writer), True
+            writer.close()
+        return await _open_connection(url), False
+
+    def release(self, key: str, streams: Streams):
+        idle = self._idle.setdefault(key, [])
+        if len(idle) < self._max_idle:
+            idle.append(streams)
+        else:
+            streams[1].close()
+
+    def clear(self):
+        for idle in self._idle.values():
+            for _, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+
+_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _AsyncConnectionPool]" = weakref.WeakKeyDictionary()
+
+
+def _get_pool() -> _AsyncConnectionPool:
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = _AsyncConnectionPool()
+    return pool
+
+
+def close_connections():
+    """ close idle connections of the running event loop """
+    _get_pool().clear()
+
+
+async def _read_response(reader: asyncio.StreamReader) -> Tuple[int, bytes, bool]:
+    """
+    Returns:
+        (status, body, keep_alive)
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError("server closed connection")
+    version, status, _ = status_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+
+    keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass  # skip trailers
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        body = b"".join(chunks)
+    elif "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    else:
+        body = await reader.read()
+        keep_alive = False
+    return int(status), body, keep_alive
+
+
+async def _fetch(url: str, method: str, data) -> HTTPResponseWrapper:
+    u = urlparse(url)
+    key = u.scheme + "://" + u.netloc
+    urlpath = url[len(u.scheme) + len(u.netloc) + 3:] or "/"
+    body = json.dumps(data).encode() if data else b""
+    host = "localhost" if u.scheme == "http+usbmux" else u.netloc
+    head = [f"{method} {urlpath} HTTP/1.1", f"Host: {host}", "Accept-Encoding: identity",
+            f"Content-Length: {len(body)}"]
+    if body:
+        head.append("Content-Type: application/json")
+    request = ("\r\n".join(head) + "\r\n\r\n").encode() + body
+
+    pool = _get_pool()
+    while True:
+        (reader, writer), reused = await pool.acquire(key, url)
+        written = False
+        try:
+            writer.write(request)
+            await writer.drain()
+            written = True
+            status, content, keep_alive = await _read_response(reader)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            if not reused or (written and method not in _IDEMPOTENT_METHODS):
+                raise  # WDA may have run it, a tap must not run twice
+            continue  # idle keep-alive connection was closed by server
+        except BaseException:
+            writer.close()
+            raise
+        if keep_alive:
+            pool.release(key, (reader, writer))
+        else:
+            writer.close()
+        return HTTPResponseWrapper(content, status, len(body), len(content))
+
+
+async def fetch(url: str, method="GET", data=None, timeout=None) -> HTTPResponseWrapper:
+    """
+    asyncio version of wda.usbmux.fetch
+
+    Raises:
+        HTTPError
+    """
+    try:
+        return await asyncio.wait_for(_fetch(url, method.upper(), data), timeout)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        raise HTTPError(e)
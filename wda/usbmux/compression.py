@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Accept-Encoding negotiation for large responses (source, screenshot)
+
+Servers which do not compress just ignore the header, responses without
+Content-Encoding are passed through untouched.
+"""
+
+import threading
+import zlib
+from dataclasses import dataclass
+
+ACCEPT_ENCODING = "gzip, deflate"
+
+# url paths (without query) which ask for a compressed response
+COMPRESSED_PATHS = ("/source", "/wda/accessibleSource", "/screenshot")
+
+
+def should_compress(urlpath: str) -> bool:
+    return urlpath.split("?", 1)[0].rstrip("/").endswith(COMPRESSED_PATHS)
+
+
+@dataclass
+class TransferStats:
+    wire_bytes: int = 0  # response body bytes received, compressed or not
+    decoded_bytes: int = 0  # response body bytes after decoding
+    compressed_responses: int = 0
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def add(self, wire: int, decoded: int, compressed: bool):
+        with self._lock:
+            self.wire_bytes += wire
+            self.decoded_bytes += decoded
+            self.compressed_responses += int(compressed)
+
+    def as_dict(self) -> dict:
+        return dict(wire_bytes=self.wire_bytes, decoded_bytes=self.decoded_bytes,
+                    compressed_responses=self.compressed_responses)
+
+
+class _Decoder:
+    def __init__(self, encoding: str):
+        if encoding not in ("gzip", "x-gzip", "deflate"):
+            raise ValueError(f"unsupported Content-Encoding: {encoding}")
+        # 32 + MAX_WBITS detects gzip and zlib headers
+        self._obj = zlib.decompressobj(32 + zlib.MAX_WBITS)
+        self._raw_deflate = encoding == "deflate"
+        self._first = True
+
+    def decompress(self, data: bytes) -> bytes:
+        if self._first and data:
+            self._first = False
+            if self._raw_deflate:
+                try:
+                    return self._obj.decompress(data)
+                except zlib.error:
+                    # some servers send deflate without the zlib header
+                    self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._obj.decompress(data)
+
+    def flush(self) -> bytes:
+        return self._obj.flush()
+
+
+def decode_body(content, encoding: str) -> bytes:
+    decoder = _Decoder(encoding)
+    return decoder.decompress(content) + decoder.flush()
+
+
+class DecodingReader:
+    """
+    Wrap http.client.HTTPResponse, readinto() returns decoded bytes
+    """
+
+    def __init__(self, response, encoding: str = None, chunk_size: int = 64 * 1024):
+        self._response = response
+        self._decoder = _Decoder(encoding) if encoding else None
+        self._chunk_size = chunk_size
+        self._buffer = b""
+        self._pos = 0
+        self._eof = False
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+
+    def readinto(self, b) -> int:
+        if self._decoder is None:
+            n = self._response.readinto(b)
+            self.wire_bytes += n
+            self.decoded_bytes += n
+            return n
+        while self._pos >= len(self._buffer) and not self._eof:
+            data = self._response.read(self._chunk_size)
+            self.wire_bytes += len(data)
+            if data:
+                self._buffer = self._decoder.decompress(data)
+            else:
+                self._buffer = self._decoder.flush()
+                self._eof = True
+            self._pos = 0
+        n = min(len(b), len(self._buffer) - self._pos)
+        b[:n] = self._buffer[self._pos:self._pos + n]
+        self._pos += n
+        self.decoded_bytes += n
+        return n
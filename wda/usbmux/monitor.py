@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Keep one usbmuxd Listen connection open and the device table up to date,
+instead of polling list_devices()
+
+While the monitor is connected, the process-wide DeviceDirectory of its usbmux
+address is pinned: select_device() and USBMuxHTTPConnection never ask usbmuxd
+for the device list.
+
+Usage:
+    from wda.usbmux.monitor import DeviceMonitor
+
+    monitor = DeviceMonitor()
+    monitor.on_attach(lambda device: print("attached", device.serial))
+    monitor.on_detach(lambda device: print("detached", device.serial))
+    monitor.start().wait_synced(5)
+    print(monitor.devices())
+    monitor.stop()
+"""
+
+import logging
+import socket
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from wda.usbmux.pyusbmux import MuxConnection, MuxDevice, MuxEvent, create_mux, device_directory, list_devices
+
+logger = logging.getLogger(__name__)
+
+DeviceCallback = Callable[[MuxDevice], None]
+
+
+@dataclass
+class MonitorStats:
+    connects: int = 0  # Listen connections opened, more than 1 means usbmuxd went away
+    attached: int = 0  # attach callbacks fired
+    detached: int = 0  # detach callbacks fired
+    callback_errors: int = 0
+
+
+class DeviceMonitor:
+    def __init__(self, usbmux_address: Optional[str] = None, reconnect_interval: float = 1.0):
+        """
+        Args:
+            reconnect_interval: first delay before connecting to usbmuxd again, doubled up to 30s
+        """
+        # resolved once, a later change of USBMUXD_SOCKET_ADDRESS does not move the monitor
+        self._usbmux_address = MuxConnection.address_key(usbmux_address)
+        self._directory = device_directory(self._usbmux_address)
+        self.reconnect_interval = reconnect_interval
+        self._devices: Dict[int, MuxDevice] = {}
+        self._lock = threading.Lock()
+        self._attach_callbacks: List[DeviceCallback] = []
+        self._detach_callbacks: List[DeviceCallback] = []
+        self._synced = threading.Event()
+        self._stopped = threading.Event()
+        self._mux: Optional[MuxConnection] = None
+        self._thread = None
+        self.stats = MonitorStats()
+
+    def on_attach(self, fn: DeviceCallback) -> DeviceCallback:
+        """ fn(device) is called from the monitor thread, can be used as a decorator """
+        self._attach_callbacks.append(fn)
+        return fn
+
+    def on_detach(self, fn: DeviceCallback) -> DeviceCallback:
+        self._detach_callbacks.append(fn)
+        return fn
+
+    def devices(self) -> List[MuxDevice]:
+        with self._lock:
+            return list(self._devices.values())
+
+    @property
+    def connected(self) -> bool:
+        return self._synced.is_set()
+
+    def wait_synced(self, timeout: Optional[float] = None) -> bool:
+        """ wait until the device table is filled after (re)connecting to usbmuxd """
+        return self._synced.wait(timeout)
+
+    def start(self) -> "DeviceMonitor":
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(name="usbmux-monitor", target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _wakeup(self):
+        """ unblock the thread waiting for events """
+        mux = self._mux
+        if mux is not None:
+            try:
+                mux._sock.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _fire(self, callbacks: List[DeviceCallback], device: MuxDevice):
+        for fn in callbacks:
+            try:
+                fn(device)
+            except Exception:
+                self.stats.callback_errors += 1
+                logger.exception("device monitor callback %r failed", fn)
+
+    def _sync(self, devices: List[MuxDevice]):
+        """ replace the table with a fresh device list, fire callbacks for the differences """
+        with self._lock:
+            old, self._devices = self._devices, {device.devid: device for device in devices}
+            self._directory.pin(devices)
+        for devid, device in old.items():
+            if devid not in self._devices:
+                self.stats.detached += 1
+                self._fire(self._detach_callbacks, device)
+        for devid, device in self._devices.items():
+            if devid not in old:
+                self.stats.attached += 1
+                self._fire(self._attach_callbacks, device)
+
+    def _handle(self, event: MuxEvent):
+        directory = self._directory
+        with self._lock:
+            if event.kind == 'Attached':
+                known = event.device_id in self._devices
+                device = self._devices[event.device_id] = event.device
+                directory.attach(device)
+            else:
+                device = self._devices.pop(event.device_id, None)
+                known = device is not None
+                directory.detach(event.device_id)
+        if event.kind == 'Attached' and not known:
+            self.stats.attached += 1
+            self._fire(self._attach_callbacks, device)
+        elif event.kind == 'Detached' and known:
+            self.stats.detached += 1
+            self._fire(self._detach_callbacks, device)
+
+    def _run(self):
+        backoff = self.reconnect_interval
+        while not self._stopped.is_set():
+            mux = None
+            try:
+                mux = create_mux(usbmux_address=self._usbmux_address)
+                mux.listen()
+                self._mux = mux
+                if self._stopped.is_set():
+                    break
+                # events after listen() are buffered in the socket, so none is lost while listing
+                self._sync(list_devices(usbmux_address=self._usbmux_address))
+                self.stats.connects += 1
+                self._synced.set()
+                backoff = self.reconnect_interval
+                while not self._stopped.is_set():
+                    self._handle(mux.receive_event())
+            except Exception as e:
+                if self._stopped.is_set():
+                    break
+                logger.debug("usbmuxd listen connection lost: %s", e)
+            finally:
+                self._mux = None
+                self._synced.clear()
+                self._directory.unpin()
+                if mux is not None:
+                    mux.close()
+            self._stopped.wait(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+
+_monitors: Dict[str, DeviceMonitor] = {}  # keyed by MuxConnection.address_key
+_monitors_lock = threading.Lock()
+
+
+def start_monitor(usbmux_address: Optional[str] = None) -> DeviceMonitor:
+    """ process-wide DeviceMonitor of usbmux_address, started on first call """
+    key = MuxConnection.address_key(usbmux_address)
+    with _monitors_lock:
+        monitor = _monitors.get(key)
+        if monitor is None:
+            monitor = _monitors[key] = DeviceMonitor(key).start()
+        return monitor
+
+
+def stop_monitor(usbmux_address: Optional[str] = None):
+    with _monitors_lock:
+        monitor = _monitors.pop(MuxConnection.address_key(usbmux_address), None)
+    if monitor:
+        monitor.stop()
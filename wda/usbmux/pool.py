@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Keep-alive connection pool used by wda.usbmux.fetch
+
+Connections are keyed by scheme://netloc, so http, https and http+usbmux
+endpoints each keep their own set of idle HTTP/1.1 connections.
+"""
+
+import select
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from http.client import HTTPConnection
+from typing import Callable, Dict, List, Tuple
+
+
+@dataclass
+class PoolStats:
+    created: int = 0  # new connections opened
+    reused: int = 0  # requests served by an idle keep-alive connection
+    reconnects: int = 0  # reused connections found half-closed and reopened
+    discarded: int = 0  # connections closed instead of returned to the pool
+
+    def as_dict(self) -> dict:
+        return dict(created=self.created, reused=self.reused,
+                    reconnects=self.reconnects, discarded=self.discarded)
+
+
+def is_connection_dropped(conn: HTTPConnection) -> bool:
+    """
+    An idle HTTP connection must have nothing to read.
+    If the socket is readable, the peer either closed it (EOF) or sent garbage,
+    both mean the connection can not be reused.
+    """
+    sock = conn.sock
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):  # closed file descriptor
+        return True
+    return bool(readable)
+
+
+class ConnectionPool:
+    def __init__(self, factory: Callable[[str], HTTPConnection], max_idle: int = 4):
+        """
+        Args:
+            factory: create a new connection from url
+            max_idle: max idle connections kept for every endpoint
+        """
+        self._factory = factory
+        self._max_idle = max_idle
+        self._idle: Dict[str, List[HTTPConnection]] = defaultdict(list)
+        self._lock = threading.Lock()
+        self.stats = PoolStats()
+
+    @staticmethod
+    def endpoint_key(url: str) -> str:
+        scheme, _, rest = url.partition("://")
+        return scheme + "://" + rest.split("/", 1)[0]
+
+    def acquire(self, url: str) -> Tuple[HTTPConnection, bool]:
+        """
+        Returns:
+            (connection, reused)
+        """
+        key = self.endpoint_key(url)
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                conn = idle.pop() if idle else None
+            if conn is None:
+                break
+            if not is_connection_dropped(conn):
+                with self._lock:
+                    self.stats.reused += 1
+                return conn, True
+            conn.close()
+            with self._lock:
+                self.stats.reconnects += 1
+        conn = self._factory(url)
+        with self._lock:
+            self.stats.created += 1
+        return conn, False
+
+    def release(self, url: str, conn: HTTPConnection):
+        """ give back a connection whose response has been fully read """
+        key = self.endpoint_key(url)
+        with self._lock:
+            idle = self._idle[key]
+            if conn.sock is not None and len(idle) < self._max_idle:
+                idle.append(conn)
+                return
+            self.stats.discarded += 1
+        conn.close()
+
+    def discard(self, conn: HTTPConnection):
+        conn.close()
+        with self._lock:
+            self.stats.discarded += 1
+
+    def mark_reconnect(self):
+        with self._lock:
+            self.stats.reconnects += 1
+
+    def clear(self, url: str = None):
+        """ close idle connections of url's endpoint, or all of them if url is None """
+        with self._lock:
+            if url is None:
+                conns = [c for idle in self._idle.values() for c in idle]
+                self._idle.clear()
+            else:
+                conns = self._idle.pop(self.endpoint_key(url), [])
+        for conn in conns:
+            conn.close()
+
+    def idle_count(self, url: str) -> int:
+        with self._lock:
+            return len(self._idle.get(self.endpoint_key(url), []))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Keep spare usbmux tunnels open, so USBMuxHTTPConnection.connect() can skip
+the usbmuxd handshake and the Connect packet.
+
+Usage:
+    from wda.usbmux import prewarm
+
+    prewarm.enable_prewarm("00008030-xxxx", port=8100, size=2)
+    # ... USBMuxHTTPConnection to this device and port now take spare tunnels
+    prewarm.disable_prewarm("00008030-xxxx", port=8100)
+"""
+
+import logging
+import select
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from wda.usbmux.exceptions import MuxError
+from wda.usbmux.pyusbmux import MuxConnection, MuxDevice, select_device
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PrewarmStats:
+    opened: int = 0  # tunnels created by the background thread
+    taken: int = 0  # tunnels handed to a connection
+    misses: int = 0  # take() found no spare tunnel
+    recycled: int = 0  # tunnels closed by health check or age limit
+    errors: int = 0  # failed attempts to open a tunnel
+
+
+def _is_tunnel_alive(sock: socket.socket) -> bool:
+    """ WDA never sends data without a request, a readable idle tunnel is closed or broken """
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+
+class TunnelPrewarmer:
+    def __init__(self, udid: str, port: int = 8100, size: int = 2, max_idle: float = 30.0,
+                 interval: float = 1.0, usbmux_address: Optional[str] = None):
+        """
+        Args:
+            udid: device udid
+            port: WDA port on device
+            size: spare tunnels to keep open
+            max_idle: seconds before an unused tunnel is recycled
+            interval: seconds between health checks
+        """
+        self.udid = udid
+        self.port = port
+        self.size = size
+        self.max_idle = max_idle
+        self.interval = interval
+        self._usbmux_address = usbmux_address
+        self._idle: List[Tuple[socket.socket, float]] = []
+        self._cond = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.stats = PrewarmStats()
+
+    def start(self) -> "TunnelPrewarmer":
+        if self._thread is None:
+            self._thread = threading.Thread(name=f"prewarm-{self.udid}:{self.port}",
+                                            target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        with self._cond:
+            self._cond.notify_all()
+            idle, self._idle = self._idle, []
+        for sock, _ in idle:
+            sock.close()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def take(self) -> Optional[socket.socket]:
+        """ returns a connected tunnel or None if no healthy one is ready """
+        with self._cond:
+            while self._idle:
+                sock, _ = self._idle.pop()
+                if _is_tunnel_alive(sock):
+                    self.stats.taken += 1
+                    self._cond.notify_all()  # wake up the refill loop
+                    return sock
+                sock.close()
+                self.stats.recycled += 1
+            self.stats.misses += 1
+            self._cond.notify_all()
+            return None
+
+    def _open_tunnel(self) -> socket.socket:
+        device = select_device(self.udid, usbmux_address=self._usbmux_address)
+        if device is None:
+            raise MuxError(f"device {self.udid} not found")
+        return device.connect(self.port, usbmux_address=self._usbmux_address)
+
+    def _recycle_locked(self):
+        deadline = time.monotonic() - self.max_idle
+        keep = []
+        for sock, created_at in self._idle:
+            if created_at > deadline and _is_tunnel_alive(sock):
+                keep.append((sock, created_at))
+            else:
+                sock.close()
+                self.stats.recycled += 1
+        self._idle = keep
+
+    def _run(self):
+        backoff = self.interval
+        while not self._stopped.is_set():
+            with self._cond:
+                self._recycle_locked()
+                missing = self.size - len(self._idle)
+                if missing <= 0:
+                    self._cond.wait(self.interval)
+                    continue
+            try:
+                sock = self._open_tunnel()
+            except Exception as e:
+                self.stats.errors += 1
+                logger.debug("prewarm tunnel to %s:%d failed: %s", self.udid, self.port, e)
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+            backoff = self.interval
+            with self._cond:
+                if self._stopped.is_set():
+                    sock.close()
+                    break
+                self._idle.append((sock, time.monotonic()))
+                self.stats.opened += 1
+
+
+_prewarmers: Dict[Tuple[str, int, str], TunnelPrewarmer] = {}  # (udid, port, MuxConnection.address_key)
+_prewarmers_lock = threading.Lock()
+
+
+def _prewarm_key(udid: str, port: int, usbmux_address: Optional[str]) -> Tuple[str, int, str]:
+    return udid.replace('-', ''), port, MuxConnection.address_key(usbmux_address)
+
+
+def enable_prewarm(udid: str, port: int = 8100, size: int = 2, max_idle: float = 30.0,
+                   usbmux_address: Optional[str] = None) -> TunnelPrewarmer:
+    """ start keeping size spare tunnels open to device udid at port """
+    key = _prewarm_key(udid, port, usbmux_address)
+    with _prewarmers_lock:
+        prewarmer = _prewarmers.get(key)
+        if prewarmer is None:
+            prewarmer = TunnelPrewarmer(udid, port, size, max_idle, usbmux_address=usbmux_address)
+            _prewarmers[key] = prewarmer.start()
+        return prewarmer
+
+
+def disable_prewarm(udid: str, port: int = 8100, usbmux_address: Optional[str] = None):
+    with _prewarmers_lock:
+        prewarmer = _prewarmers.pop(_prewarm_key(udid, port, usbmux_address), None)
+    if prewarmer:
+        prewarmer.stop()
+
+
+def take_tunnel(device: MuxDevice, port: int, usbmux_address: Optional[str] = None) -> Optional[socket.socket]:
+    """ used by USBMuxHTTPConnection.connect, returns None when prewarm is not enabled """
+    with _prewarmers_lock:
+        if not _prewarmers:
+            return None
+        prewarmer = _prewarmers.get(_prewarm_key(device.serial, port, usbmux_address))
+    if prewarmer is None:
+        return None
+    return prewarmer.take()
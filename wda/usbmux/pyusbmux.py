@@ -4,13 +4,15 @@ Copy from https://github.com/doronz88/pymobiledevice3
 Add http.client.HTTPConnection
 """
 import abc
+import os
 import plistlib
 import socket
 import sys
+import threading
 import time
 from dataclasses import dataclass
 from http.client import HTTPConnection
-from typing import List, Mapping, Optional
+from typing import Dict, List, Mapping, Optional
 
 from construct import Const, CString, Enum, FixedSized, GreedyBytes, Int16ul, Int32ul, Padding, Prefixed, StreamError, \
     Struct, Switch, this
@@ -94,6 +96,11 @@ class MuxDevice:
         mux = create_mux(usbmux_address=usbmux_address)
         try:
             return mux.connect(self, port)
+        except BadDevError:
+            # device id is gone, the cached device list is outdated
+            mux.close()
+            device_directory(usbmux_address).invalidate()
+            raise
         except:  # noqa: E722
             mux.close()
             raise
@@ -113,6 +120,13 @@ class MuxDevice:
         return USBMuxHTTPConnection(self, port)
 
 
+@dataclass
+class MuxEvent:
+    kind: str  # Attached or Detached
+    device_id: int
+    device: Optional[MuxDevice] = None  # set when Attached
+
+
 class SafeStreamSocket:
     """ wrapper to native python socket object to be used with construct as a stream """
 
@@ -121,19 +135,35 @@ class SafeStreamSocket:
         self.sock = socket.socket(family, socket.SOCK_STREAM)
         self.sock.connect(address)
 
+    @classmethod
+    def wrap(cls, sock: socket.socket) -> "SafeStreamSocket":
+        """ wrap an already connected socket """
+        self = cls.__new__(cls)
+        self._offset = 0
+        self.sock = sock
+        return self
+
     def send(self, msg: bytes) -> int:
         self._offset += len(msg)
         self.sock.sendall(msg)
         return len(msg)
 
-    def recv(self, size: int) -> bytes:
-        msg = b''
-        while len(msg) < size:
-            chunk = self.sock.recv(size - len(msg))
-            self._offset += len(chunk)
-            if not chunk:
+    def readinto(self, buffer) -> int:
+        """ fill the whole buffer, recv_into keeps it linear in message size """
+        view = memoryview(buffer).cast('B')
+        size = len(view)
+        pos = 0
+        while pos < size:
+            n = self.sock.recv_into(view[pos:], size - pos)
+            if not n:
                 raise MuxError('socket connection broken')
-            msg += chunk
+            pos += n
+        self._offset += size
+        return size
+
+    def recv(self, size: int) -> bytearray:
+        msg = bytearray(size)
+        self.readinto(msg)
         return msg
 
     def close(self) -> None:
@@ -152,6 +182,10 @@ class SafeStreamSocket:
     write = send
 
 
+# MuxConnection.address_key -> protocol version detected by MuxConnection.probe_version
+_protocol_versions: Dict[str, str] = {}
+
+
 class MuxConnection:
     # used on Windows
     ITUNES_HOST = ('127.0.0.1', 27015)
@@ -159,53 +193,85 @@ class MuxConnection:
     # used for macOS and Linux
     USBMUXD_PIPE = '/var/run/usbmuxd'
 
+    @staticmethod
+    def resolve_address(usbmux_address: Optional[str] = None):
+        """
+        returns (address, socket family) of usbmuxd
+
+        USBMUXD_SOCKET_ADDRESS (same as libusbmuxd, eg UNIX:/tmp/usbmuxd or 127.0.0.1:27015)
+        overrides the default address
+        """
+        if usbmux_address is None:
+            usbmux_address = os.environ.get('USBMUXD_SOCKET_ADDRESS') or None
+            if usbmux_address and usbmux_address.startswith('UNIX:'):
+                usbmux_address = usbmux_address[len('UNIX:'):]
+        if usbmux_address is not None:
+            if ':' in usbmux_address:
+                # assume tcp address
+                hostname, port = usbmux_address.split(':')
+                return (hostname, int(port)), socket.AF_INET
+            # assume unix domain address
+            return usbmux_address, socket.AF_UNIX
+        if sys.platform in ['win32', 'cygwin']:
+            return MuxConnection.ITUNES_HOST, socket.AF_INET
+        return MuxConnection.USBMUXD_PIPE, socket.AF_UNIX
+
+    @staticmethod
+    def address_key(usbmux_address: Optional[str] = None) -> str:
+        """ resolved address as string, caches are keyed by it so USBMUXD_SOCKET_ADDRESS can change """
+        address, family = MuxConnection.resolve_address(usbmux_address)
+        if family == socket.AF_INET:
+            return "%s:%d" % address
+        return address
+
     @staticmethod
     def create_usbmux_socket(usbmux_address: Optional[str] = None) -> SafeStreamSocket:
         try:
-            if usbmux_address is not None:
-                if ':' in usbmux_address:
-                    # assume tcp address
-                    hostname, port = usbmux_address.split(':')
-                    port = int(port)
-                    address = (hostname, port)
-                    family = socket.AF_INET
-                else:
-                    # assume unix domain address
-                    address = usbmux_address
-                    family = socket.AF_UNIX
-            else:
-                if sys.platform in ['win32', 'cygwin']:
-                    address = MuxConnection.ITUNES_HOST
-                    family = socket.AF_INET
-                else:
-                    address = MuxConnection.USBMUXD_PIPE
-                    family = socket.AF_UNIX
+            address, family = MuxConnection.resolve_address(usbmux_address)
             return SafeStreamSocket(address, family)
         except ConnectionRefusedError:
             raise MuxConnectToUsbmuxdError()
 
     @staticmethod
-    def create(usbmux_address: Optional[str] = None):
-        # first attempt to connect with possibly the wrong version header (plist protocol)
+    def probe_version(usbmux_address: Optional[str] = None):
+        """ send a ReadBUID with the plist header, the reply header tells which protocol usbmuxd speaks """
         sock = MuxConnection.create_usbmux_socket(usbmux_address=usbmux_address)
+        try:
+            message = usbmuxd_request.build({
+                'header': {'version': usbmuxd_version.PLIST, 'message': usbmuxd_msgtype.PLIST, 'tag': 1},
+                'data': plistlib.dumps({'MessageType': 'ReadBUID'})
+            })
+            sock.send(message)
+            response = usbmuxd_response.parse_stream(sock)
+        finally:
+            # if we sent a bad request, the socket is useless for the real connection
+            sock.close()
+
+        if response.header.version not in (usbmuxd_version.BINARY, usbmuxd_version.PLIST):
+            raise MuxVersionError(f'usbmuxd returned unsupported version: {response.header.version}')
+        return response.header.version
 
-        message = usbmuxd_request.build({
-            'header': {'version': usbmuxd_version.PLIST, 'message': usbmuxd_msgtype.PLIST, 'tag': 1},
-            'data': plistlib.dumps({'MessageType': 'ReadBUID'})
-        })
-        sock.send(message)
-        response = usbmuxd_response.parse_stream(sock)
+    @staticmethod
+    def create(usbmux_address: Optional[str] = None):
+        # the protocol is probed only once per address, see probe_version
+        usbmux_address = MuxConnection.address_key(usbmux_address)
+        version = _protocol_versions.get(usbmux_address)
+        if version is None:
+            version = MuxConnection.probe_version(usbmux_address)
+            _protocol_versions[usbmux_address] = version
 
-        # if we sent a bad request, we should re-create the socket in the correct version this time
-        sock.close()
         sock = MuxConnection.create_usbmux_socket(usbmux_address=usbmux_address)
+        if version == usbmuxd_version.BINARY:
+            mux = BinaryMuxConnection(sock)
+        else:
+            mux = PlistMuxConnection(sock)
+        mux._usbmux_address = usbmux_address
+        return mux
 
-        if response.header.version == usbmuxd_version.BINARY:
-            return BinaryMuxConnection(sock)
-        elif response.header.version == usbmuxd_version.PLIST:
-            return PlistMuxConnection(sock)
-
-        raise MuxVersionError(f'usbmuxd returned unsupported version: {response.version}')
+    @staticmethod
+    def forget_version(usbmux_address: Optional[str] = None):
+        """ drop the cached protocol version, the next create() probes again """
+        _protocol_versions.pop(MuxConnection.address_key(usbmux_address), None)
 
     def __init__(self, sock: SafeStreamSocket):
         self._sock = sock
@@ -220,6 +286,9 @@ class MuxConnection:
 
         self.devices = []
 
+        # set by create(), used to drop the cached protocol version on version errors
+        self._usbmux_address = None
+
     @abc.abstractmethod
     def _connect(self, device_id: int, port: int):
         """ initiate a "Connect" request to target port """
@@ -255,6 +324,8 @@ class MuxConnection:
             int(usbmuxd_result.BADVERSION): MuxVersionError,
         }
         exception = exceptions.get(result, MuxError)
+        if exception is MuxVersionError:
+            MuxConnection.forget_version(self._usbmux_address)
         raise exception(message)
 
     def __enter__(self):
@@ -294,6 +365,24 @@ class BinaryMuxConnection(MuxConnection):
         """ start listening for events of attached and detached devices """
         self._send_receive(usbmuxd_msgtype.LISTEN)
 
+    def receive_event(self, timeout: Optional[float] = None) -> MuxEvent:
+        """
+        after listen(), wait for the next Attached or Detached event.
+        usbmuxd sends Attached for every connected device right after listen()
+
+        Raises:
+            socket.timeout, MuxError
+        """
+        self._sock.settimeout(timeout)
+        response = self._receive()
+        if response.header.message == usbmuxd_msgtype.ADD:
+            # old protocol only supported USB devices
+            device = MuxDevice(response.data.device_id, response.data.serial_number, 'USB')
+            return MuxEvent('Attached', device.devid, device)
+        if response.header.message == usbmuxd_msgtype.REMOVE:
+            return MuxEvent('Detached', response.data.device_id)
+        raise MuxError(f'Invalid packet type received: {response}')
+
     def _connect(self, device_id: int, port: int):
         self._send({'header': {'version': self._version,
                                'message': usbmuxd_msgtype.CONNECT,
@@ -317,6 +406,11 @@ class BinaryMuxConnection(MuxConnection):
     def _receive(self, expected_tag: int = None):
         self._assert_not_connected()
         response = usbmuxd_response.parse_stream(self._sock)
+        if response.header.version != self._version:
+            # usbmuxd was restarted with another protocol since the version was cached
+            MuxConnection.forget_version(self._usbmux_address)
+            raise MuxVersionError(f'usbmuxd replied with version {response.header.version}, '
+                                  f'expected {self._version}')
         if expected_tag and response.header.tag != expected_tag:
             raise MuxError(f'Reply tag mismatch: expected {expected_tag}, got {response.header.tag}')
         return response
@@ -357,6 +451,18 @@ class PlistMuxConnection(BinaryMuxConnection):
     def listen(self) -> None:
         self._send_receive({'MessageType': 'Listen'})
 
+    def receive_event(self, timeout: Optional[float] = None) -> MuxEvent:
+        self._sock.settimeout(timeout)
+        while True:
+            message = self._receive()
+            if message['MessageType'] == 'Attached':
+                properties = message['Properties']
+                device = MuxDevice(message['DeviceID'], properties['SerialNumber'], properties['ConnectionType'])
+                return MuxEvent('Attached', device.devid, device)
+            if message['MessageType'] == 'Detached':
+                return MuxEvent('Detached', message['DeviceID'])
+            # Paired and other notifications are not interesting
+
     def get_pair_record(self, serial: str) -> Mapping:
         # serials are saved inside usbmuxd without '-'
         self._send({'MessageType': 'ReadPairRecord', 'PairRecordID': serial})
@@ -430,14 +536,9 @@ def list_devices(usbmux_address: Optional[str] = None) -> List[MuxDevice]:
     return devices
 
 
-def select_device(udid: str = None, connection_type: str = None, usbmux_address: Optional[str] = None) \
-        -> Optional[MuxDevice]:
-    """
-    select a UsbMux device according to given arguments.
-    if more than one device could be selected, always prefer the usb one.
-    """
+def _select_from(devices: List[MuxDevice], udid: str = None, connection_type: str = None) -> Optional[MuxDevice]:
     tmp = None
-    for device in list_devices(usbmux_address=usbmux_address):
+    for device in devices:
         if connection_type is not None and device.connection_type != connection_type:
             # if a specific connection_type was desired and not of this one then skip
             continue
@@ -456,6 +557,52 @@ def select_device(udid: str = None, connection_type: str = None, usbmux_address:
     return tmp
 
 
+def select_device(udid: str = None, connection_type: str = None, usbmux_address: Optional[str] = None) \
+        -> Optional[MuxDevice]:
+    """
+    select a UsbMux device according to given arguments.
+    if more than one device could be selected, always prefer the usb one.
+
+    device records are served from the cached device directory
+    """
+    return device_directory(usbmux_address).lookup(udid, connection_type)
+
+
+def wait_for_device(udid: str, timeout: float, connection_type: str = None,
+                    usbmux_address: Optional[str] = None) -> Optional[MuxDevice]:
+    """
+    wait until the device is attached, woken up by the usbmuxd Attached event instead of polling.
+    The cached device directory is updated with the events received
+
+    Returns:
+        MuxDevice or None if timeout
+
+    Raises:
+        MuxError: usbmuxd is not reachable
+    """
+    directory = device_directory(usbmux_address)
+    deadline = time.monotonic() + timeout
+    mux = create_mux(usbmux_address=usbmux_address)
+    try:
+        mux.listen()
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return None
+            try:
+                event = mux.receive_event(left)
+            except (socket.timeout, StreamError):
+                return None
+            if event.kind == 'Detached':
+                directory.detach(event.device_id)
+                continue
+            directory.attach(event.device)
+            if event.device.matches_udid(udid) and connection_type in (None, event.device.connection_type):
+                return event.device
+    finally:
+        mux.close()
+
+
 def select_devices_by_connection_type(connection_type: str, usbmux_address: Optional[str] = None) -> List[MuxDevice]:
     """
     select all UsbMux devices by connection type
@@ -468,6 +615,110 @@ def select_devices_by_connection_type(connection_type: str, usbmux_address: Opti
     return tmp
 
 
+# seconds a cached device list is trusted before usbmuxd is asked again
+DEVICE_CACHE_TTL = 10.0
+
+
+class DeviceDirectory:
+    """
+    Cache of MuxDevice records of one usbmuxd address
+
+    The cache is refreshed with list_devices() when it is older than ttl,
+    and kept up to date by attach()/detach() when usbmuxd events are received.
+    While pinned (see wda.usbmux.monitor.DeviceMonitor) the cache never expires.
+    """
+
+    def __init__(self, usbmux_address: Optional[str] = None, ttl: float = DEVICE_CACHE_TTL):
+        self._usbmux_address = usbmux_address
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._devices: Dict[int, MuxDevice] = {}
+        self._expires_at = 0.0
+        self._pinned = False
+
+    def _refresh_locked(self):
+        devices = list_devices(usbmux_address=self._usbmux_address)
+        self._devices = {device.devid: device for device in devices}
+        self._expires_at = float('inf') if self._pinned else time.monotonic() + self.ttl
+
+    def devices(self, refresh: bool = False) -> List[MuxDevice]:
+        with self._lock:
+            if refresh or time.monotonic() >= self._expires_at:
+                self._refresh_locked()
+            return list(self._devices.values())
+
+    def lookup(self, udid: str = None, connection_type: str = None) -> Optional[MuxDevice]:
+        """ same as select_device, refresh once when nothing matched in cache """
+        with self._lock:
+            refreshed = False
+            if time.monotonic() >= self._expires_at:
+                self._refresh_locked()
+                refreshed = True
+            device = _select_from(self._devices.values(), udid, connection_type)
+            if device is None and not refreshed and not self._pinned:
+                self._refresh_locked()
+                device = _select_from(self._devices.values(), udid, connection_type)
+            return device
+
+    def peek(self, udid: str = None, connection_type: str = None) -> Optional[MuxDevice]:
+        """ lookup without talking to usbmuxd, returns None when the cache is expired """
+        with self._lock:
+            if time.monotonic() >= self._expires_at:
+                return None
+            return _select_from(self._devices.values(), udid, connection_type)
+
+    def update(self, devices: List[MuxDevice]):
+        """ replace the cache with a device list fetched elsewhere (eg: wda.usbmux.aio) """
+        with self._lock:
+            self._devices = {device.devid: device for device in devices}
+            self._expires_at = float('inf') if self._pinned else time.monotonic() + self.ttl
+
+    def invalidate(self):
+        with self._lock:
+            if not self._pinned:
+                self._expires_at = 0.0
+
+    def pin(self, devices: List[MuxDevice]):
+        """ replace the cache and trust it until unpin(), attach()/detach() keep it up to date """
+        with self._lock:
+            self._devices = {device.devid: device for device in devices}
+            self._pinned = True
+            self._expires_at = float('inf')
+
+    def unpin(self):
+        """ nobody keeps the cache up to date anymore, refresh on next use """
+        with self._lock:
+            self._pinned = False
+            self._expires_at = 0.0
+
+    @property
+    def pinned(self) -> bool:
+        return self._pinned
+
+    def attach(self, device: MuxDevice):
+        """ called on usbmuxd Attached event """
+        with self._lock:
+            self._devices[device.devid] = device
+
+    def detach(self, device_id: int):
+        """ called on usbmuxd Detached event """
+        with self._lock:
+            self._devices.pop(device_id, None)
+
+
+_directories: Dict[str, DeviceDirectory] = {}  # MuxConnection.address_key -> DeviceDirectory
+_directories_lock = threading.Lock()
+
+
+def device_directory(usbmux_address: Optional[str] = None) -> DeviceDirectory:
+    """ process-wide DeviceDirectory of usbmux_address """
+    usbmux_address = MuxConnection.address_key(usbmux_address)
+    with _directories_lock:
+        directory = _directories.get(usbmux_address)
+        if directory is None:
+            directory = _directories[usbmux_address] = DeviceDirectory(usbmux_address)
+        return directory
+
 
 class USBMuxHTTPConnection(HTTPConnection):
     def __init__(self, device: MuxDevice, port=8100):
@@ -476,10 +727,16 @@ class USBMuxHTTPConnection(HTTPConnection):
         self.__port = port
 
     def connect(self):
-        self.sock = self.__device.connect(self.__port)
+        self.sock = _prewarm.take_tunnel(self.__device, self.__port) or self.__device.connect(self.__port)
+        if self.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+            self.sock.settimeout(self.timeout)
 
     def __enter__(self) -> HTTPConnection:
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.close()
\ No newline at end of file
+        self.close()
+
+
+# at the bottom, prewarm imports MuxDevice and select_device from this module
+from wda.usbmux import prewarm as _prewarm  # noqa: E402
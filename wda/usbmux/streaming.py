@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Decode the base64 "value" of a WDA response while it is being received
+
+WDA screenshot response looks like
+    {"value" : "iVBORw0KGgo...", "sessionId" : "..."}
+
+NSJSONSerialization escapes "/" as "\\/", and the base64 text may contain
+escaped line breaks ("\\r\\n"), so the string is unescaped before decoding.
+"""
+
+import binascii
+import re
+from typing import BinaryIO
+
+_STREAM_CHUNK_SIZE = 64 * 1024
+_MAX_PREFIX_SIZE = 64 * 1024
+
+# "value" key followed by the first character of its value
+_VALUE_START = re.compile(rb'"value"\s*:\s*(\S)')
+
+
+def _unescape(segment: bytes) -> bytes:
+    """ base64 alphabet never contains backslash or quote, only these escapes are possible """
+    if b"\\" not in segment:
+        return segment
+    return segment.replace(b"\\/", b"/").replace(b"\\r", b"").replace(b"\\n", b"").replace(b"\\t", b"")
+
+
+class Base64ValueReader:
+    def __init__(self, sink: BinaryIO):
+        self._sink = sink
+        self._prefix = bytearray()  # bytes before the value string
+        self._suffix = bytearray()  # bytes after the value string
+        self._pending = b""  # base64 characters not aligned to 4 yet, or a trailing backslash
+        self._state = "prefix"  # prefix -> value -> suffix, or raw if value is not a string
+        self.decoded_size = 0
+
+    @property
+    def streamed(self) -> bool:
+        """ False when value is not a string (eg: error dict), the whole body is returned by envelope() """
+        return self._state in ("value", "suffix")
+
+    def feed(self, data: bytes):
+        if self._state == "suffix" or self._state == "raw":
+            self._suffix += data
+        elif self._state == "prefix":
+            self._prefix += data
+            m = _VALUE_START.search(self._prefix)
+            if m is None:
+                if len(self._prefix) > _MAX_PREFIX_SIZE:
+                    self._state = "raw"
+                return
+            if m.group(1) != b'"':
+                self._state = "raw"
+                return
+            rest = bytes(self._prefix[m.end():])
+            del self._prefix[m.end():]
+            self._state = "value"
+            self._feed_value(rest)
+        else:
+            self._feed_value(data)
+
+    def _feed_value(self, data: bytes):
+        end = data.find(b'"')
+        if end >= 0:
+            self._suffix += data[end:]
+            data = data[:end]
+        data = _unescape(self._pending + data)
+        if end >= 0:
+            self._pending = b""
+            self._state = "suffix"
+            data += b"=" * (-len(data) % 4)  # tolerate missing padding
+        else:
+            tail = b""
+            if data.endswith(b"\\"):  # escape sequence split by chunk boundary
+                data, tail = data[:-1], b"\\"
+            aligned = len(data) - len(data) % 4
+            data, self._pending = data[:aligned], data[aligned:] + tail
+        if data:
+            decoded = binascii.a2b_base64(data)
+            self._sink.write(decoded)
+            self.decoded_size += len(decoded)
+
+    def envelope(self) -> bytes:
+        """
+        Returns:
+            the response json, where the streamed value is replaced by an empty string
+        """
+        # prefix ends with the opening quote, suffix starts with the closing quote
+        return bytes(self._prefix + self._suffix)
+
+
+def read_base64_value(response, sink: BinaryIO, chunk_size: int = _STREAM_CHUNK_SIZE) -> bytes:
+    """
+    Stream the body of an http.client.HTTPResponse, base64 decode "value" into sink
+
+    Returns:
+        response json with value replaced by "", or the whole body if value is not a string
+    """
+    reader = Base64ValueReader(sink)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    while True:
+        n = response.readinto(view)
+        if not n:
+            break
+        reader.feed(view[:n].tobytes())
+    view.release()
+    return reader.envelope()
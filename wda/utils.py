@@ -1,8 +1,9 @@
 # coding: utf-8
 
 import functools
-import typing
 import inspect
+import threading
+import typing
 
 
 def inject_call(fn, *args, **kwargs):
@@ -29,24 +30,71 @@ def inject_call(fn, *args, **kwargs):
     return fn(*ba.args, **ba.kwargs)
 
 
+class CompiledCall(object):
+    """
+    Same as inject_call, but the signature of fn is inspected only once
+
+    Compares equal to the wrapped function, so it can be found and removed
+    from a list by the original function
+    """
+    __slots__ = ('fn', '_names')
+
+    def __init__(self, fn):
+        assert callable(fn), "first argument must be callable"
+        self.fn = fn
+        st = inspect.signature(fn)
+        self._names = tuple(
+            name for name, p in st.parameters.items()
+            if p.kind not in (p.VAR_POSITIONAL, p.VAR_KEYWORD, p.POSITIONAL_ONLY))
+
+    def __call__(self, **kwargs):
+        return self.fn(**{key: kwargs[key] for key in self._names if key in kwargs})
+
+    def __eq__(self, other):
+        if isinstance(other, CompiledCall):
+            other = other.fn
+        return self.fn == other
+
+    def __hash__(self):
+        return hash(self.fn)
+
+    def __repr__(self):
+        return "<CompiledCall %r>" % (self.fn,)
+
+
+def compile_call(fn) -> CompiledCall:
+    """
+    Returns:
+        callable which only takes keyword arguments, unknown ones are dropped
+
+    Example:
+        call = compile_call(lambda url: print(url))
+        call(url="/status", method="GET")
+    """
+    if isinstance(fn, CompiledCall):
+        return fn
+    return CompiledCall(fn)
+
+
 def limit_call_depth(n: int):
     """
     n = 0 means not allowed recursive call
     """
     def wrapper(fn: typing.Callable):
-        if not hasattr(fn, '_depth'):
-            fn._depth = 0
+        # depth is counted per thread, concurrent calls are not recursion
+        local = threading.local()
 
         @functools.wraps(fn)
         def _inner(*args, **kwargs):
-            if fn._depth > n:
+            depth = getattr(local, 'depth', 0)
+            if depth > n:
                 raise RuntimeError("call depth exceed %d" % n)
 
-            fn._depth += 1
+            local.depth = depth + 1
             try:
                 return fn(*args, **kwargs)
             finally:
-                fn._depth -= 1
+                local.depth = depth
         
         _inner._fn = fn
         return _inner